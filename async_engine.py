@@ -0,0 +1,314 @@
+'''An asyncio alternative to the thread pool in my-apps-downloader.py.
+
+Page scraping and downloads run as coroutines on a single thread, so many
+more transfers can be in flight at once. A global limit caps the total, and
+a separate limit per host keeps any one site from being swamped.
+
+Requires aiohttp (pip install aiohttp).'''
+
+import asyncio
+import collections
+import contextlib
+import os
+import time
+from urllib.parse import urlsplit
+
+import bandwidth
+import classes as cl
+import mirrors
+import resolvers
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+class AsyncEngine:
+    '''Resolves and downloads a list of App instances with asyncio'''
+
+    def __init__(self, max_in_flight=16, per_host=4, timeout=10,
+                 parse_pool=None):
+        self.max_in_flight = max_in_flight  # Requests open at once, overall
+        self.per_host = per_host            # Requests open at once, per host
+        self.timeout = timeout              # Seconds to connect or read
+        self.parse_pool = parse_pool        # Executor for pages, or threads
+        self._slots = None
+        self._host_slots = None
+
+    def run(self, apps, manifest=None, cache=None) -> list:
+        '''Downloads every app, showing a progress bar. Returns one entry
+        per app: True if downloaded, False if the manifest showed the file
+        on disk was still current, None if it failed its checksum. Download
+        urls are looked up in, and added to, the ResolveCache 'cache' if
+        given.'''
+        if aiohttp is None:
+            raise RuntimeError("The asyncio engine needs aiohttp. "
+                               "Install it with 'pip install aiohttp'.")
+        return asyncio.run(self._run(apps, manifest, cache))
+
+    async def _run(self, apps, manifest, cache):
+        # Tied to the running event loop, so created here
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._host_slots = collections.defaultdict(
+            lambda: asyncio.Semaphore(self.per_host))
+        from tqdm.asyncio import tqdm_asyncio
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout,
+                                        sock_read=self.timeout)
+        async with aiohttp.ClientSession(headers=cl.HEADERS,
+                                         timeout=timeout) as session:
+            return await tqdm_asyncio.gather(
+                *(self.download_app(session, app, manifest, cache)
+                  for app in apps),
+                colour='green')
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url):
+        '''Waits for room under both the global and the per-host limit'''
+        async with self._slots, self._host_slots[urlsplit(url).netloc]:
+            yield
+
+    async def download_app(self, session, app, manifest=None,
+                           cache=None) -> bool:
+        '''Coroutine counterpart of download_app() in my-apps-downloader.py'''
+        if app.download_url == None and cache is not None:
+            app.download_url = cache.get(app)
+            app.from_cache = app.download_url is not None
+        if app.download_url == None:
+            await self.resolve(session, app)
+            if cache is not None:
+                cache.put(app)
+        app.get_file_name()
+        await self.fetch_checksum(session, app)
+        if app.mirrors and not app.mirror:
+            await asyncio.to_thread(app.pick_source)
+        if manifest is not None and \
+           await self.is_up_to_date(session, app, manifest.get(app.name)):
+            manifest.refresh_mtime(app)
+            app.stats['skipped'] = True
+            return False
+        try:
+            await self.fetch_installer(session, app, cache)
+        except cl.ChecksumMismatch as err:
+            print(err)
+            return None
+        if manifest is not None:
+            manifest.record(app)
+        return True
+
+    async def fetch_installer(self, session, app, cache=None):
+        '''Coroutine counterpart of pipeline.fetch_installer: finds the url
+        again if a cached one went stale'''
+        try:
+            await self.download_installer(session, app)
+        except aiohttp.ClientResponseError:
+            if not app.from_cache:
+                raise
+            # The cached link went stale (e.g. replaced by a newer version)
+            app.from_cache = False
+            await self.resolve(session, app)
+            cache.put(app)
+            app.get_file_name()
+            await self.fetch_checksum(session, app)
+            await self.download_installer(session, app)
+
+    async def resolve(self, session, app):
+        '''Asks the resolver backend for the app's host if there is one,
+        else fetches the download page and finds the download url in it'''
+        resolver = resolvers.for_app(app)
+        if resolver is not None and \
+           await self.resolve_with(session, resolver, app):
+            return
+        start = time.perf_counter()
+        async with self.slot(app.download_page):
+            async with session.get(app.download_page) as response:
+                app.add_time('page', time.perf_counter() - start)
+                response.raise_for_status()
+                app.content_type = cl.content_type_of(
+                    response.headers.get('Content-Type', ''))
+                # 'FILE' = download page contains redirection to download url
+                if app.content_type == 'FILE':
+                    app.download_url = str(response.url)
+                    return
+                if app.content_type not in ('HTML', 'JSON'):
+                    raise ValueError(
+                        f"No download url for {app.name}: "
+                        f"{app.download_page} is neither a file nor an "
+                        f"HTML or JSON page "
+                        f"({response.headers.get('Content-Type')})")
+                if app.content_type == 'JSON':
+                    app.links = cl.json_links(await response.json())
+                elif self.parse_pool is not None:
+                    page, encoding = await response.read(), response.charset
+                else:
+                    html = await response.text()
+        if app.content_type == 'HTML' and self.parse_pool is not None:
+            start = time.perf_counter()
+            app.links, app.download_url = \
+                await asyncio.get_running_loop().run_in_executor(
+                    self.parse_pool, cl.parse_and_match, page, encoding,
+                    app.pattern, app.link_parser, app.base_url, app.name)
+            app.add_time('parse', time.perf_counter() - start)
+            return
+        if app.content_type == 'HTML':
+            # Parsing is CPU-bound: keep it off the event loop
+            await asyncio.to_thread(app.parse_html, html)
+        app.download_url = cl.pick_download_url(app.links, app.pattern,
+                                                app.base_url, app.name)
+
+    async def resolve_with(self, session, resolver, app) -> bool:
+        '''Coroutine counterpart of Resolver.resolve'''
+        request = resolver.api_request(app)
+        if request is None:
+            return False
+        url, headers = request
+        start = time.perf_counter()
+        try:
+            async with self.slot(url):
+                async with session.get(url, headers=headers) as response:
+                    data = await response.json(content_type=None) \
+                        if response.status == 200 else None
+                    return resolver.resolve_from(app, response.status,
+                                                 response.headers, data)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            print(f"Falling back on scraping for {app.name}:", err)
+            return False
+        finally:
+            app.add_time('api', time.perf_counter() - start)
+
+    async def fetch_checksum(self, session, app):
+        '''Coroutine counterpart of App.fetch_checksum'''
+        if app.digest or not app.checksum_url:
+            return
+        url = app.checksum_url.format(url=app.download_url)
+        try:
+            async with self.slot(url):
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    app.digest = cl.parse_checksum(await response.text(),
+                                                   app.file_name)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            print(f"No checksum for {app.name}:", err)
+
+    async def is_up_to_date(self, session, app, entry) -> bool:
+        '''Coroutine counterpart of App.is_up_to_date'''
+        if not app.has_file_from(entry):
+            return False
+        try:
+            async with self.slot(app.download_url):
+                async with session.head(app.download_url,
+                                        headers=cl.conditional_headers(entry),
+                                        allow_redirects=True) as response:
+                    return cl.unchanged(entry, response.status,
+                                        response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def download_installer(self, session, app) -> int:
+        '''Coroutine counterpart of App.download_installer: streams into a
+        '.part' file, resuming it after a dropped connection or an earlier
+        interrupted run, then renames it. A file not matching its published
+        digest is quarantined instead (raising ChecksumMismatch).'''
+        temp_name = app.file_name + '.part'
+        if app.mirrors and not app.mirror and not app.sources:
+            # Not ranked in download_app
+            app.sources = await asyncio.to_thread(mirrors.rank, app)
+        attempt = 0
+        hasher = None
+        start = time.perf_counter()
+        while True:
+            done = os.path.getsize(temp_name) \
+                if os.path.exists(temp_name) else 0
+            url = app.transfer_url()
+            headers = dict(cl.FILE_HEADERS)
+            if done:
+                # As App.fetch_range: only resume what's known to be from
+                # the same file
+                source = cl.read_part_source(temp_name)
+                if source is None:
+                    cl.remove_part(temp_name)
+                    continue
+                if source['validator'] and source['url'] == url:
+                    headers['If-Range'] = source['validator']
+                headers['Range'] = f'bytes={done}-'
+            try:
+                async with self.slot(app.download_url):
+                    async with session.get(url, headers=headers) as response:
+                        if app.mirror and response.status >= 500:
+                            app.leave_mirror(f"it answered {response.status}")
+                            continue
+                        if response.status == 416 and response.headers.get(
+                                'Content-Range', '').split('/')[-1] \
+                                != str(done):
+                            # Longer than the file: not a complete one
+                            cl.remove_part(temp_name)
+                            continue
+                        if response.status != 416:
+                            response.raise_for_status()
+                            size = cl.file_size(response.status,
+                                                response.headers)
+                            if app.content_length and size and \
+                               size != app.content_length and \
+                               not app.mirror and len(app.sources) > 1 and \
+                               url != app.download_url:
+                                # A mirror of another file: as fetch_range
+                                app.drop_source(url, f"it has {size} bytes, "
+                                                f"not {app.content_length}")
+                                continue
+                            app.note_headers(response.status,
+                                             response.headers)
+                            if response.status != 206:
+                                done = 0
+                            if not done:
+                                cl.write_part_source(
+                                    temp_name, url,
+                                    cl.part_validator(response.headers))
+                                hasher = cl.Hashes(app.algorithms())
+                            elif hasher is None:
+                                hasher = cl.hash_file(temp_name,
+                                                      app.chunk_size,
+                                                      app.algorithms())
+                            app.count('bytes', await self._write(
+                                response, temp_name, done, hasher,
+                                app.chunk_size, app.priority))
+                        elif hasher is None:
+                            # Nothing left to send: the file is complete
+                            hasher = cl.hash_file(temp_name, app.chunk_size,
+                                                  app.algorithms())
+                break
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError,
+                    asyncio.TimeoutError) as err:
+                if app.mirror:
+                    app.leave_mirror(err)
+                    continue
+                attempt += 1
+                if attempt > app.max_retries:
+                    raise
+                app.count('retries')
+                await asyncio.sleep(app.retry_delay * 2 ** (attempt - 1))
+        cl.remove_part(temp_name, with_data=False)
+        app.set_hashes(hasher)
+        app.content_length = os.path.getsize(temp_name)
+        if not app.verify():
+            raise cl.ChecksumMismatch(app.name, app.quarantine(temp_name))
+        # Replace in one step so a half-written file never has the real name
+        os.replace(temp_name, app.file_name)
+        app.add_time('download', time.perf_counter() - start)
+        return app.content_length
+
+    @staticmethod
+    async def _write(response, path, done, hasher, chunk_size,
+                     priority=1) -> int:
+        written = 0
+        limiter = bandwidth.limiter
+        # Write in binary ('wb'); only for Windows
+        with open(path, 'ab' if done else 'wb') as output_file, \
+             limiter.stream(priority) as stream:
+            async for chunk in response.content.iter_chunked(
+                    limiter.step(chunk_size)):
+                output_file.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+                delay = limiter.reserve(stream, len(chunk))
+                if delay:
+                    await asyncio.sleep(delay)
+        return written
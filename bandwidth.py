@@ -0,0 +1,171 @@
+'''Caps the bandwidth used by all the downloads together, sharing it between
+them by priority.
+
+Every transfer opens a stream on the shared limiter with its App's
+'priority' weight (1 by default, set in catalogue.json). The limit is
+split between the open streams in proportion to their weights, each
+stream pacing itself with its own token bucket. A stream of weight 4
+gets four times the bandwidth of one of weight 1 while both run, and
+shares are recomputed whenever a stream opens or closes, so whatever
+finishes early leaves its bandwidth to the others.
+
+The limit can be changed while downloading: a ControlFile holds it as
+e.g. '5M' (bytes per second, k/M/G suffixes), and is read again when it
+changes or, outside Windows, when the process gets SIGHUP.'''
+
+import contextlib
+import os
+import re
+import signal
+import threading
+import time
+
+STEP = 64 * 1024    # Bytes read per step while limited, for smooth pacing
+BURST = 0.25        # Seconds of its share a stream may receive back to back
+
+UNITS = {'': 1, 'k': 1e3, 'm': 1e6, 'g': 1e9}
+
+def parse_rate(text) -> float:
+    '''Bytes per second from e.g. '500k', '2.5M' or '1G'; None (no limit)
+    for '0', 'none' or an empty string'''
+    text = text.strip().lower()
+    if text in ('', '0', 'none'):
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmg]?)b?(?:/s)?', text)
+    if match is None:
+        raise ValueError(f"Not a bandwidth: {text!r} (e.g. '500k' or '5M')")
+    return float(match.group(1)) * UNITS[match.group(2)] or None
+
+def format_rate(rate) -> str:
+    return 'none' if rate is None else f'{rate / 1e6:g} MB/s'
+
+class Stream:
+    '''One transfer's share of a BandwidthLimiter'''
+
+    def __init__(self, weight, now):
+        self.weight = weight
+        self.tokens = 0.0       # Bytes it may receive now (negative: owed)
+        self.updated = now
+
+class BandwidthLimiter:
+    '''Token buckets sharing 'rate' bytes per second between the open
+    streams by weight (None: no limit). Safe to share between threads.'''
+
+    def __init__(self, rate=None, burst=BURST, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._streams = set()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        '''Changes the limit; None lifts it'''
+        with self._lock:
+            self.rate = rate
+
+    @contextlib.contextmanager
+    def stream(self, weight=1):
+        '''Stream for one transfer, open for the duration of the block'''
+        stream = Stream(weight, self.clock())
+        with self._lock:
+            self._streams.add(stream)
+        try:
+            yield stream
+        finally:
+            with self._lock:
+                self._streams.discard(stream)
+
+    def share(self, stream) -> float:
+        '''Bytes per second the stream gets now. Call under _lock.'''
+        total = sum(other.weight for other in self._streams)
+        return self.rate * stream.weight / total
+
+    def reserve(self, stream, amount) -> float:
+        '''Counts 'amount' bytes received on the stream; returns the seconds
+        to wait before reading more'''
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            now = self.clock()
+            share = self.share(stream)
+            stream.tokens = min(share * self.burst, stream.tokens +
+                                (now - stream.updated) * share)
+            stream.updated = now
+            stream.tokens -= amount
+            return max(0.0, -stream.tokens / share)
+
+    def take(self, stream, amount):
+        '''Counts 'amount' bytes received and waits for the stream's turn'''
+        delay = self.reserve(stream, amount)
+        if delay:
+            self.sleep(delay)
+
+    def step(self, chunk_size) -> int:
+        '''Bytes to read at a time: smaller steps while limited'''
+        return min(chunk_size, STEP) if self.rate else chunk_size
+
+# Shared by every download
+limiter = BandwidthLimiter()
+
+class ControlFile:
+    '''Sets a limiter's rate from the file at 'path' whenever the file
+    changes (checked every 'interval' seconds) or the process gets SIGHUP'''
+
+    def __init__(self, path, limiter=limiter, interval=1):
+        self.path = path
+        self.limiter = limiter
+        self.interval = interval
+        self.mtime = None
+        self._stop = threading.Event()
+        self._reload = threading.Event()    # Set on SIGHUP
+        self._thread = None
+
+    def load(self):
+        '''Reads the file and applies its limit'''
+        try:
+            self.mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding='utf-8') as control_file:
+                rate = parse_rate(control_file.read())
+        except FileNotFoundError:
+            return
+        except ValueError as err:
+            print(f"Ignoring {self.path}:", err)
+            return
+        if rate != self.limiter.rate:
+            self.limiter.set_rate(rate)
+            print(f"Bandwidth limit: {format_rate(rate)}")
+
+    def _watch(self):
+        while True:
+            self._reload.wait(self.interval)
+            if self._stop.is_set():
+                return
+            reload = self._reload.is_set()
+            self._reload.clear()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except FileNotFoundError:
+                continue
+            if reload or mtime != self.mtime:
+                self.load()
+
+    def start(self):
+        '''Applies the file's limit, then follows its changes. Call from the
+        main thread, which is the one allowed to set a signal handler. The
+        handler only wakes the watching thread: the main thread may be
+        holding the limiter's lock when the signal comes (async engine).'''
+        self.load()
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP,
+                          lambda signum, frame: self._reload.set())
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._reload.set()
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        self._thread.join()
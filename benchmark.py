@@ -0,0 +1,578 @@
+'''Benchmarks for my-apps-downloader, run offline against page fixtures.
+
+Usage:
+    python benchmark.py links [--repeat N]    # link extraction: bs4 vs lxml
+    python benchmark.py record [APP ...]      # save live pages as fixtures
+    python benchmark.py pipeline [options]    # whole run, see below
+    python benchmark.py startup [--budget MS] # time to the first prompt
+    python benchmark.py parse [options]       # downloads while pages parse
+    python benchmark.py pages [options]       # page fetches: HTTP/1.1 vs 2
+
+The 'pipeline' benchmark replays every app in apps.py from local servers
+(local_server.py), one per real host: its download page and an installer
+of synthetic bytes. Latency, bandwidth caps and errors can be injected.
+The resolve and download phases then run as in my-apps-downloader.py, once
+per number of workers, each run in a fresh process so that its peak memory
+is its own. Results can be saved with --save and checked against a saved
+baseline with --baseline: the exit status is 1 if any run's wall time grew
+by more than --threshold.
+
+The 'startup' benchmark runs my-apps-downloader.py with '-X importtime',
+answering no to its prompt, and shows what was imported before it. Heavy
+modules (requests, bs4, lxml...) should only be imported after the prompt.
+
+The 'parse' benchmark downloads a file over and over while pages are
+parsed on worker threads, as the resolve phase does, then again with each
+parse sent to a process pool (my-apps-downloader.py --parse-processes).
+It shows how much download speed parsing under the GIL costs. The file is
+served from another process, so the server doesn't compete for the GIL.
+
+The 'pages' benchmark fetches the scraped apps' pages from one local host
+as the resolve phase does: over HTTP/1.1 uncompressed (for reference, as
+requests never asks for that by default), with requests' own
+Accept-Encoding (gzip, and brotli if installed), with classes.PAGE_HEADERS,
+then over HTTP/2 with PAGE_HEADERS (local_h2_server.py, with
+my-apps-downloader.py --http2's client). It shows the wall time, the
+latency of each fetch, the body bytes sent, how long those take on a link
+of --link Mbit/s (loopback hides what compression saves) and the
+connections opened.
+
+See fixtures.py for where pages come from.'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import requests
+
+import apps
+import classes as cl
+import fixtures
+import pipeline
+import sessions
+from local_server import LocalServer, SyntheticFile
+from scheduler import HostScheduler
+
+def scraped_apps(names=None) -> list:
+    '''Apps from apps.py whose download url is found by scraping'''
+    return [app for name, app in apps.programs.items()
+            if app.download_url is None and (not names or name in names)]
+
+def best_time(func, repeat) -> float:
+    '''Fastest of 'repeat' runs, in seconds'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def link_speedup(html, pattern, repeat) -> tuple:
+    '''(bs4 seconds, lxml seconds) to extract the links of a page'''
+    slow = cl.html_links(html)
+    fast = cl.first_links(html, pattern)
+    # Both must lead to the same download url
+    assert cl.pick_download_url(slow, pattern) == \
+        cl.pick_download_url(fast, pattern)
+    return (best_time(lambda: cl.html_links(html), repeat),
+            best_time(lambda: cl.first_links(html, pattern), repeat))
+
+def bench_links(args):
+    # 'last': a synthetic page with as many links, the match being the last
+    # one, where stopping early saves nothing
+    print(f"{'App':<32}{'Page':>10}{'KiB':>6}{'bs4 ms':>9}{'lxml ms':>9}"
+          f"{'speedup':>9}{'last':>8}")
+    speedups = {'fixture': [], 'synthetic': [], 'last': []}
+    for app in scraped_apps(args.apps):
+        kind = 'fixture' if os.path.exists(fixtures.recorded_path(app)) \
+            else 'synthetic'
+        html = fixtures.load_page(app)
+        soup_time, fast_time = link_speedup(html, app.pattern, args.repeat)
+        speedups[kind].append(soup_time / fast_time)
+        last = fixtures.synthetic_page(
+            app.pattern, anchors=max(2, len(cl.html_links(html))),
+            position=1)
+        soup_last, fast_last = link_speedup(last, app.pattern, args.repeat)
+        speedups['last'].append(soup_last / fast_last)
+        print(f"{app.name[:31]:<32}{kind:>10}{len(html) // 1024:>6}"
+              f"{soup_time * 1000:>9.2f}{fast_time * 1000:>9.2f}"
+              f"{speedups[kind][-1]:>8.1f}x{speedups['last'][-1]:>7.1f}x")
+    for kind, label in (('fixture', "pages in fixtures/"),
+                        ('synthetic', "synthetic pages, match 1/4 down"),
+                        ('last', "match as the last link")):
+        if speedups[kind]:
+            print(f"Median speedup, {label}: "
+                  f"{statistics.median(speedups[kind]):.1f}x "
+                  f"({len(speedups[kind])} pages)")
+
+def record_pages(args):
+    for app in scraped_apps(args.apps):
+        path = fixtures.record(app)
+        print(f"{app.name}: {path or 'not an html page, skipped'}")
+
+def replay_apps(size, names=None, **conditions) -> tuple:
+    '''Serves the apps in apps.py locally: one started LocalServer (with the
+    given network 'conditions') per real host, holding each app's download
+    page and an installer of 'size' bytes on average. Returns the servers
+    and, per app, the App arguments pointing at them (plain data, to pass to
+    another process).'''
+    servers = {}
+    def server_for(url):
+        host = urlsplit(url).netloc.lower()
+        if host not in servers:
+            servers[host] = LocalServer(**conditions).start()
+        return servers[host]
+
+    specs = []
+    for name, app in apps.programs.items():
+        if names and name not in names:
+            continue
+        # Same size for an app on every run
+        payload = SyntheticFile(int(size * (0.25 + 1.5 *
+                                            random.Random(name).random())))
+        spec = {'name': name, 'pattern': app.pattern.pattern,
+                'flags': app.pattern.flags, 'segments': app.segments,
+                'link_parser': app.link_parser, 'base_url': None,
+                'download_url': None, 'size': payload.size}
+        if app.download_url:
+            server = server_for(app.download_url)
+            path = urlsplit(app.download_url).path
+            server.add(quote(path, safe='/%'), payload)
+            spec['download_page'] = spec['download_url'] = server.url(path)
+        else:
+            server = server_for(app.download_page)
+            path = f'/files/{fixtures.slug(name)}/' + \
+                fixtures.sample_match(app.pattern)
+            server.add(quote(path, safe='/%'), payload)
+            # Mirror how apps.py rebuilds absolute urls
+            if name == 'foobar2000':
+                spec['base_url'] = server.url(path.rsplit('/', 1)[0] + '/')
+                href = path
+            elif app.base_url and 'github.com' not in app.download_page:
+                spec['base_url'] = server.url('/')
+                href = path[1:]
+            else:
+                href = server.url(path)
+            page = f'/pages/{fixtures.slug(name)}'
+            server.add(page, fixtures.replay_page(app, href))
+            spec['download_page'] = server.url(page)
+        specs.append(spec)
+    return servers, specs
+
+def percentile(values, share) -> float:
+    return sorted(values)[min(len(values) - 1, int(share * len(values)))]
+
+def peak_rss() -> float:
+    '''Highest memory use of this process so far, in MiB (None if unknown)'''
+    try:
+        import resource
+    except ImportError:     # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def run_trial(specs, workers, per_host=2, rate=None) -> dict:
+    '''Resolves and downloads the apps described by 'specs' into a scratch
+    folder, with 'workers' threads, and measures the run'''
+    pool = sessions.SessionPool(pool_size=max(10, workers))
+    scheduler = HostScheduler(max_workers=workers, per_host=per_host,
+                              rate=rate, burst=per_host)
+    pool.throttle = scheduler.throttle
+    replay = [cl.App(spec['name'], spec['download_page'],
+                     re.compile(spec['pattern'], spec['flags']),
+                     base_url=spec['base_url'],
+                     download_url=spec['download_url'],
+                     segments=spec['segments'],
+                     link_parser=spec['link_parser'], session=pool)
+              for spec in specs]
+    latencies = {'resolve': [], 'download': []}
+    def timed(phase, func):
+        def job(app):
+            start = time.perf_counter()
+            try:
+                return func(app)
+            finally:
+                latencies[phase].append(time.perf_counter() - start)
+        return job
+
+    folder = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            # The two phases of pipeline.run, timed apart
+            start = time.perf_counter()
+            scheduler.run(timed('resolve', pipeline.resolve_app), replay,
+                          progress=False)
+            resolved = time.perf_counter()
+            scheduler.run(timed('download', pipeline.download_app),
+                          pipeline.plan(replay), key=pipeline.download_order,
+                          progress=False)
+            end = time.perf_counter()
+            size = sum(os.path.getsize(app.file_name) for app in replay)
+        finally:
+            os.chdir(folder)
+    result = {'workers': workers, 'wall': end - start,
+              'resolve': resolved - start, 'download': end - resolved,
+              'bytes': size, 'throughput': size / 1e6 / (end - resolved),
+              'peak_rss': peak_rss()}
+    for phase, values in latencies.items():
+        result[f'{phase}_p50'] = percentile(values, 0.5)
+        result[f'{phase}_p95'] = percentile(values, 0.95)
+    return result
+
+def isolated(func, *args):
+    '''Calls func(*args) in a new process and returns the result'''
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(func, *args).result()
+
+def regressions(results, baseline, threshold) -> list:
+    '''(workers, old wall time, new wall time) of the runs more than
+    'threshold' (0.2 = 20%) slower than the baseline's run with as many
+    workers'''
+    before = {entry['workers']: entry for entry in baseline['results']}
+    return [(entry['workers'], before[entry['workers']]['wall'],
+             entry['wall'])
+            for entry in results if entry['workers'] in before and
+            entry['wall'] > before[entry['workers']]['wall'] * (1 + threshold)]
+
+def bench_pipeline(args):
+    conditions = {'latency': args.latency / 1000,
+                  'bandwidth': args.bandwidth * 1e6 if args.bandwidth else None,
+                  'error_rate': args.error_rate}
+    servers, specs = replay_apps(args.size * 1e6, args.apps, **conditions)
+    settings = dict(conditions, size=args.size, apps=len(specs),
+                    per_host=args.per_host, host_rate=args.host_rate)
+    print(f"{len(specs)} apps, {sum(spec['size'] for spec in specs) / 1e6:.0f}"
+          f" MB from {len(servers)} local hosts")
+    print(f"{'Workers':>7}{'Wall s':>8}{'Resolve s':>10}{'p50 ms':>8}"
+          f"{'p95 ms':>8}{'Download s':>11}{'p50 ms':>8}{'p95 ms':>8}"
+          f"{'MB/s':>8}{'RSS MiB':>9}")
+    results = []
+    try:
+        for workers in args.workers:
+            runs = [isolated(run_trial, specs, workers, args.per_host,
+                             args.host_rate) for _ in range(args.repeat)]
+            result = min(runs, key=lambda run: run['wall'])
+            results.append(result)
+            rss = f"{result['peak_rss']:.0f}" if result['peak_rss'] else '?'
+            print(f"{workers:>7}{result['wall']:>8.2f}"
+                  f"{result['resolve']:>10.2f}"
+                  f"{result['resolve_p50'] * 1000:>8.0f}"
+                  f"{result['resolve_p95'] * 1000:>8.0f}"
+                  f"{result['download']:>11.2f}"
+                  f"{result['download_p50'] * 1000:>8.0f}"
+                  f"{result['download_p95'] * 1000:>8.0f}"
+                  f"{result['throughput']:>8.1f}{rss:>9}")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    report = {'settings': settings, 'results': results}
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as report_file:
+            json.dump(report, report_file, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('settings') != settings:
+            print("Warning: the baseline was run with other settings:",
+                  baseline.get('settings'))
+        slower = regressions(results, baseline, args.threshold)
+        for workers, before, after in slower:
+            print(f"Regression with {workers} workers: {before:.2f}s -> "
+                  f"{after:.2f}s")
+        if slower:
+            sys.exit(1)
+        print(f"No run over {args.threshold:.0%} slower than the baseline.")
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'my-apps-downloader.py')
+# Only needed once downloading starts
+HEAVY_MODULES = ('requests', 'urllib3', 'bs4', 'lxml', 'tqdm', 'aiohttp',
+                 'classes')
+
+def startup_profile() -> tuple:
+    '''Runs the downloader up to its first prompt, answering no. Returns
+    the seconds it took and, for every module imported, its cumulative
+    import time in microseconds and whether it was imported directly (top
+    level) rather than by another module.'''
+    start = time.perf_counter()
+    finished = subprocess.run([sys.executable, '-X', 'importtime',
+                               MAIN_SCRIPT], input='n\n',
+                              capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    imports = {}
+    for line in finished.stderr.splitlines():
+        match = re.fullmatch(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)',
+                             line)
+        if match:
+            imports[match.group(3)] = (int(match.group(1)),
+                                       not match.group(2))
+    return elapsed, imports
+
+def bench_startup(args):
+    runs = [startup_profile() for _ in range(args.repeat)]
+    elapsed, imports = min(runs, key=lambda run: run[0])
+    top_level = sorted(((micros, name) for name, (micros, direct)
+                        in imports.items() if direct), reverse=True)
+    print(f"{'Module':<32}{'Import ms':>10}")
+    for micros, name in top_level[:args.top]:
+        print(f"{name[:31]:<32}{micros / 1000:>10.1f}")
+    total = sum(micros for micros, _ in top_level)
+    print(f"Imports before the prompt: {total / 1000:.1f} ms; time to first "
+          f"prompt and exit: {elapsed * 1000:.0f} ms (best of {args.repeat})")
+    heavy = [name for name in HEAVY_MODULES if name in imports]
+    if heavy:
+        print("Imported before the prompt:", ', '.join(heavy))
+    if args.budget and (heavy or elapsed * 1000 > args.budget):
+        print(f"Over budget ({args.budget:.0f} ms, no heavy module)")
+        sys.exit(1)
+
+def serve_file(size, urls, stop):
+    '''Serves 'size' synthetic bytes until 'stop' is set, putting their url
+    in the 'urls' queue. Meant to run in its own process.'''
+    with LocalServer({'/file': SyntheticFile(size)}) as server:
+        urls.put(server.url('/file'))
+        stop.wait()
+
+def download_while(url, busy) -> float:
+    '''Downloads 'url' again and again, hashing it as a real download
+    does, until busy() is false after a download. Returns the bytes per
+    second.'''
+    session = requests.Session()
+    received = 0
+    start = time.perf_counter()
+    while busy():
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            hashes = cl.Hashes(('sha256',))
+            for chunk in response.iter_content(cl.CHUNK_SIZE):
+                hashes.update(chunk)
+                received += len(chunk)
+    return received / (time.perf_counter() - start)
+
+def parse_trial(url, page, pattern, parses, threads, link_parser='soup',
+                pool=None) -> dict:
+    '''Parses 'page' (bytes) 'parses' times on 'threads' threads, in the
+    threads or on 'pool', while downloading 'url'. With no parses, downloads
+    for a second instead.'''
+    def parse(_):
+        arguments = (page, 'utf-8', pattern, link_parser)
+        if pool is None:
+            return cl.parse_and_match(*arguments)
+        return pool.submit(cl.parse_and_match, *arguments).result()
+
+    done = threading.Event()
+    with ThreadPoolExecutor(1) as downloader, \
+         ThreadPoolExecutor(threads) as parsers:
+        download = downloader.submit(download_while, url,
+                                     lambda: not done.is_set())
+        start = time.perf_counter()
+        try:
+            if parses:
+                urls = {url for _, url in parsers.map(parse, range(parses))}
+                assert len(urls) == 1, urls
+            else:
+                time.sleep(1)
+            elapsed = time.perf_counter() - start
+        finally:
+            done.set()
+        return {'parse': elapsed if parses else None,
+                'throughput': download.result()}
+
+def bench_parse(args):
+    pattern = re.compile(r'setup-[\d.]+\.exe')
+    page = fixtures.synthetic_page(pattern, anchors=args.anchors,
+                                   position=0.9).encode()
+    print(f"{args.parses} parses of a {len(page) // 1024} KiB page with the "
+          f"'{args.parser}' parser on {args.threads} threads")
+    context = multiprocessing.get_context('spawn')
+    urls, stop = context.Queue(), context.Event()
+    server = context.Process(target=serve_file,
+                             args=(int(args.size * 1e6), urls, stop))
+    server.start()
+    url = urls.get()
+    print(f"{'Parses run in':<24}{'Parse s':>8}{'Pages/s':>9}"
+          f"{'Download MB/s':>15}")
+    try:
+        for label, processes in (('(no parsing)', None), ('threads', 0),
+                                 (f'{args.processes} processes',
+                                  args.processes)):
+            if processes:
+                pool = ProcessPoolExecutor(processes, mp_context=context)
+                # Workers start once per run, not once per page
+                list(pool.map(cl.parse_and_match, [page] * processes,
+                              ['utf-8'] * processes, [pattern] * processes))
+            else:
+                pool = None
+            result = parse_trial(url, page, pattern,
+                                 args.parses if processes is not None else 0,
+                                 args.threads, args.parser, pool)
+            if pool is not None:
+                pool.shutdown()
+            timing = f"{result['parse']:>8.2f}" \
+                     f"{args.parses / result['parse']:>9.1f}" \
+                if result['parse'] else f"{'-':>8}{'-':>9}"
+            print(f"{label:<24}{timing}{result['throughput'] / 1e6:>15.1f}")
+    finally:
+        stop.set()
+        server.join()
+
+def fetch_pages(get, urls, threads) -> dict:
+    '''Fetches 'urls' with get(url) on 'threads' threads'''
+    def fetch(url):
+        start = time.perf_counter()
+        response = get(url)
+        response.raise_for_status()
+        return time.perf_counter() - start, len(response.content)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(fetch, urls))
+    return {'wall': time.perf_counter() - start,
+            'latencies': [latency for latency, _ in results],
+            'decoded': sum(size for _, size in results)}
+
+def bench_pages(args):
+    import http2
+    if not http2.available():
+        print("The 'pages' benchmark needs 'pip install httpx[http2]'")
+        sys.exit(1)
+    from local_h2_server import H2Server
+    routes = {f'/{fixtures.slug(app.name)}.html': fixtures.load_page(app)
+              for app in scraped_apps(args.apps)}
+    paths = list(routes) * args.rounds
+    latency = args.latency / 1000
+    print(f"{len(paths)} fetches of {len(routes)} pages on {args.threads} "
+          f"threads, {args.latency:.0f} ms latency; requests offers "
+          f"'{requests.utils.DEFAULT_ACCEPT_ENCODING}', PAGE_HEADERS "
+          f"'{cl.ACCEPT_ENCODING}'")
+    print(f"{'Transport':<28}{'Wall s':>8}{'p50 ms':>8}{'p90 ms':>8}"
+          f"{'Body kB':>9}{'Link s':>8}{'Connections':>13}")
+    modes = (('HTTP/1.1, uncompressed', False,
+              dict(cl.HEADERS, **{'Accept-Encoding': 'identity'})),
+             ('HTTP/1.1, requests default', True, cl.HEADERS),
+             ('HTTP/1.1, PAGE_HEADERS', True, cl.PAGE_HEADERS),
+             ('HTTP/2, PAGE_HEADERS', None, cl.PAGE_HEADERS))
+    decoded = None
+    for label, compress, headers in modes:
+        if compress is None:
+            server = H2Server(routes, latency=latency)
+            client = http2.PageClient(prior_knowledge=True)
+        else:
+            server = LocalServer(routes, latency=latency, compress=compress)
+            client = sessions.SessionPool(pool_size=args.threads)
+        with server:
+            result = fetch_pages(
+                lambda url: client.get(url, headers=headers),
+                [server.url(path) for path in paths], args.threads)
+        if compress is None:
+            client.close()
+        # Every transport must hand the same text over
+        assert decoded in (None, result['decoded']), label
+        decoded = result['decoded']
+        print(f"{label:<28}{result['wall']:>8.2f}"
+              f"{percentile(result['latencies'], 0.5) * 1000:>8.0f}"
+              f"{percentile(result['latencies'], 0.9) * 1000:>8.0f}"
+              f"{server.sent / 1000:>9.0f}"
+              f"{server.sent * 8 / (args.link * 1e6):>8.1f}"
+              f"{server.connections:>13}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    links = commands.add_parser('links', help="time link extraction")
+    links.add_argument('apps', nargs='*', help="app names (default: all)")
+    links.add_argument('--repeat', type=int, default=5)
+    links.set_defaults(func=bench_links)
+
+    record = commands.add_parser('record', help="save live pages as "
+                                                "fixtures (needs internet)")
+    record.add_argument('apps', nargs='*', help="app names (default: all)")
+    record.set_defaults(func=record_pages)
+
+    run = commands.add_parser('pipeline', help="time whole runs against "
+                                               "local servers")
+    run.add_argument('apps', nargs='*', help="app names (default: all)")
+    run.add_argument('--workers', default=[1, 2, 4, 8],
+                     type=lambda text: [int(n) for n in text.split(',')],
+                     help="comma-separated worker counts (default: 1,2,4,8)")
+    run.add_argument('--per-host', type=int, default=2)
+    run.add_argument('--host-rate', type=float, default=None,
+                     help="requests/second per host (default: no limit)")
+    run.add_argument('--size', type=float, default=4,
+                     help="average installer size in MB (default: 4)")
+    run.add_argument('--latency', type=float, default=0,
+                     help="ms before each answer (default: 0)")
+    run.add_argument('--bandwidth', type=float, default=None,
+                     help="MB/s per response (default: no cap)")
+    run.add_argument('--error-rate', type=float, default=0,
+                     help="share of requests answered 503 (default: 0)")
+    run.add_argument('--repeat', type=int, default=1,
+                     help="runs per worker count; the fastest is kept")
+    run.add_argument('--save', metavar='FILE', help="write results as json")
+    run.add_argument('--baseline', metavar='FILE',
+                     help="results saved earlier to compare with")
+    run.add_argument('--threshold', type=float, default=0.2,
+                     help="slowdown tolerated over the baseline "
+                          "(default: 0.2, i.e. 20%%)")
+    run.set_defaults(func=bench_pipeline)
+
+    startup = commands.add_parser('startup', help="time imports before the "
+                                                  "first prompt")
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--top', type=int, default=10,
+                         help="slowest imports shown (default: 10)")
+    startup.add_argument('--budget', type=float, default=None, metavar='MS',
+                         help="exit with status 1 if the prompt takes longer, "
+                              "or heavy modules are imported before it")
+    startup.set_defaults(func=bench_startup)
+
+    parse = commands.add_parser('parse', help="time downloads while pages "
+                                              "are parsed")
+    parse.add_argument('--parses', type=int, default=40)
+    parse.add_argument('--threads', type=int, default=4,
+                       help="threads parsing at once (default: 4)")
+    parse.add_argument('--processes', type=int,
+                       default=min(4, os.cpu_count() or 1),
+                       help="size of the process pool (default: up to 4)")
+    parse.add_argument('--parser', choices=('soup', 'fast'), default='soup',
+                       help="link parser (default: soup, the slower one)")
+    parse.add_argument('--anchors', type=int, default=3000,
+                       help="links on the page (default: 3000)")
+    parse.add_argument('--size', type=float, default=20,
+                       help="MB per download of the file (default: 20)")
+    parse.set_defaults(func=bench_parse)
+
+    pages = commands.add_parser('pages', help="time page fetches over "
+                                              "HTTP/1.1 and HTTP/2")
+    pages.add_argument('apps', nargs='*', help="app names (default: all)")
+    pages.add_argument('--rounds', type=int, default=3,
+                       help="times each page is fetched (default: 3)")
+    pages.add_argument('--threads', type=int, default=6,
+                       help="fetches at once (default: 6, as the resolve "
+                            "phase)")
+    pages.add_argument('--latency', type=float, default=50,
+                       help="ms before each answer (default: 50)")
+    pages.add_argument('--link', type=float, default=20,
+                       help="Mbit/s the body bytes are timed at "
+                            "(default: 20)")
+    pages.set_defaults(func=bench_pages)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    args.func(args)
@@ -0,0 +1,80 @@
+'''The apps that can be downloaded, as listed in catalogue.json.
+
+Each entry has the App arguments described in apps.py (regexes as plain
+strings), plus 'tags' to select groups of apps by (e.g. 'essential' or
+'dev') and an optional 'note'. The file is only read when first needed,
+into light Entry records: App objects, and their compiled regexes, are only
+built for the entries selected.'''
+
+import json
+import os
+
+CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'catalogue.json')
+
+class Entry:
+    '''One app of the catalogue, as plain data'''
+
+    __slots__ = ('name', 'download_page', 'pattern', 'download_url',
+                 'base_url', 'segments', 'link_parser', 'digest',
+                 'checksum_url', 'mirrors', 'priority', 'tags', 'note')
+
+    def __init__(self, name, download_page, pattern, download_url=None,
+                 base_url=None, segments=1, link_parser='fast', digest=None,
+                 checksum_url=None, mirrors=(), priority=1, tags=(),
+                 note=None):
+        self.name = name
+        self.download_page = download_page
+        self.pattern = pattern              # Regex source, compiled by to_app
+        self.download_url = download_url
+        self.base_url = base_url
+        self.segments = segments
+        self.link_parser = link_parser
+        self.digest = digest
+        self.checksum_url = checksum_url
+        self.mirrors = tuple(mirrors)       # Url templates, see mirrors.py
+        self.priority = priority            # Bandwidth weight
+        self.tags = tuple(tags)
+        self.note = note                    # For whoever edits the file
+
+    def to_app(self, session=None):
+        '''Builds the App for this entry'''
+        import re
+        import classes as cl
+        return cl.App(self.name, self.download_page, re.compile(self.pattern),
+                      download_url=self.download_url, base_url=self.base_url,
+                      segments=self.segments, link_parser=self.link_parser,
+                      digest=self.digest, checksum_url=self.checksum_url,
+                      mirrors=list(self.mirrors), priority=self.priority,
+                      session=session)
+
+    def __repr__(self):
+        return f'Entry({self.name!r})'
+
+_entries = {}       # Path -> entries, once read
+
+def entries(path=CATALOGUE_PATH) -> list:
+    '''Every entry of a catalogue file, in file order'''
+    if path not in _entries:
+        with open(path, encoding='utf-8') as catalogue_file:
+            data = json.load(catalogue_file)
+        loaded = []
+        for fields in data['apps']:
+            try:
+                loaded.append(Entry(**fields))
+            except TypeError as err:
+                raise ValueError(f"Bad entry {fields.get('name')!r} in "
+                                 f"{path}: {err}") from None
+        _entries[path] = loaded
+    return _entries[path]
+
+def select(names=None, tags=None, path=CATALOGUE_PATH) -> list:
+    '''Entries named in 'names' or having one of 'tags' (case-insensitive),
+    in catalogue order; every entry if neither is given'''
+    if not names and not tags:
+        return list(entries(path))
+    names = {name.lower() for name in names or ()}
+    tags = {tag.lower() for tag in tags or ()}
+    return [entry for entry in entries(path)
+            if entry.name.lower() in names or
+            tags.intersection(tag.lower() for tag in entry.tags)]
@@ -1,7 +1,353 @@
-from urllib.parse import unquote_plus
+import email.utils
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote_plus
 
 import requests
-from bs4 import BeautifulSoup
+
+import bandwidth
+import mirrors
+import sessions
+
+# bs4 and lxml are imported when a page is first parsed: runs where every
+# app has a direct download url, or a JSON page, never load them
+
+CHUNK_SIZE = 1024 * 1024    # Bytes read and written per step when streaming
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024  # Smaller files aren't worth splitting
+FEED_SIZE = 64 * 1024       # Characters of html parsed per step
+
+# Errors after which a transfer can pick up where it left off
+DROPPED = (requests.exceptions.ConnectionError,
+           requests.exceptions.ChunkedEncodingError,
+           requests.exceptions.Timeout)
+
+# Stage -> profiler (e.g. a cProfile.Profile) that calls of the App methods
+# timed under that stage are run with, see report.py
+PROFILERS = {}
+
+# Apps each thread is running a timed method of
+_timing = threading.local()
+
+def timed(stage):
+    '''Decorator for App methods: adds each call's duration to the App's
+    stats for 'stage', and runs the call under PROFILERS[stage] if set.
+    A call made from within another timed call on the same App (e.g. the
+    HEAD request a download may need first) counts towards the outer stage
+    only, so the stages add up to the time spent.'''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            active = getattr(_timing, 'apps', None)
+            if active is None:
+                active = _timing.apps = set()
+            if id(self) in active:
+                return method(self, *args, **kwargs)
+            active.add(id(self))
+            start = time.perf_counter()
+            try:
+                profiler = PROFILERS.get(stage)
+                if profiler is not None:
+                    return profiler.runcall(method, self, *args, **kwargs)
+                return method(self, *args, **kwargs)
+            finally:
+                self.add_time(stage, time.perf_counter() - start)
+                active.discard(id(self))
+        return wrapper
+    return decorator
+
+class RateLimited(Exception):
+    '''Raised when a server answers 429 Too Many Requests. 'retry_after' is
+    how many seconds it asked us to wait, if it said.'''
+
+    def __init__(self, url, retry_after=None):
+        super().__init__(f"Too many requests to {url}")
+        self.url = url
+        self.retry_after = retry_after
+
+    @classmethod
+    def check(cls, response):
+        '''Raises RateLimited if the response is a 429'''
+        if response.status_code == 429:
+            raise cls(response.url,
+                      retry_after_seconds(response.headers.get('Retry-After')))
+
+def retry_after_seconds(value):
+    '''Converts a Retry-After header (seconds or HTTP date) to seconds'''
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+# Keep headers parameter to avoid ConnectionErrors.
+HEADERS = {'User-Agent': 'Mozilla/5.0 \
+                         (Windows NT 10.0; Win64; x64; rv:90.0) \
+                         Gecko/20100101 Firefox/90.0'}
+
+# Pages are text and shrink a lot compressed; brotli is only asked for when
+# it can be decoded. requests offers the same on its own: this keeps the
+# offer explicit, whichever client fetches the page.
+ACCEPT_ENCODING = 'br, gzip, deflate' \
+    if importlib.util.find_spec('brotli') else 'gzip, deflate'
+PAGE_HEADERS = dict(HEADERS, **{'Accept-Encoding': ACCEPT_ENCODING})
+
+# Installers are asked for as is, in every request about them: Range offsets,
+# Content-Length and validators must be those of the file's own bytes.
+FILE_HEADERS = {'Accept-Encoding': 'identity'}
+
+# The App methods below are thin wrappers around these functions, so other
+# engines (e.g. async_engine.py) can parse pages fetched their own way.
+
+def content_type_of(content_type) -> str:
+    '''Maps a Content-Type header to 'FILE', 'HTML' or 'JSON' (else None)'''
+    try:
+        if content_type == 'binary/octet-stream' or \
+           content_type == 'application/octet-stream' or \
+           content_type == 'application/x-msdownload' or \
+           content_type == 'application/x-msdos-program':
+            return 'FILE'
+        elif content_type.startswith('text/html'):
+            return 'HTML'
+        elif content_type.startswith('application/json'):
+            return 'JSON'
+    except Exception as e:
+        raise e(f"Unable to set content_type attribute! Url content type \
+            is {content_type}.")
+    return None
+
+def html_links(html) -> list:
+    '''Gets all urls from an html page'''
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'lxml')
+    anchors = soup.select('a')
+    # Exclude potential NoneTypes (would keep code from running)
+    return [link.get('href') for link in anchors
+            if isinstance(link.get('href'), str)]
+
+class _FoundLink(Exception):
+    '''Stops the parser as soon as the link we're after has been seen'''
+
+class _LinkCollector:
+    '''lxml parser target: keeps the href of each <a> tag as the parser
+    reaches it, without building a document tree'''
+
+    def __init__(self, pattern=None):
+        self.pattern = pattern
+        self.links = []
+
+    def start(self, tag, attrib):
+        href = attrib.get('href') if tag == 'a' else None
+        if isinstance(href, str):
+            self.links.append(href)
+            if self.pattern is not None and self.pattern.search(href):
+                raise _FoundLink
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.links
+
+def first_links(html, pattern=None) -> list:
+    '''Gets the urls of an html page, in order, up to the first one matching
+    'pattern'. Much faster than html_links: the page is fed to lxml a piece
+    at a time, no tree is built and parsing stops at the first match.'''
+    from lxml import etree
+    collector = _LinkCollector(pattern)
+    parser = etree.HTMLParser(target=collector)
+    try:
+        for start in range(0, len(html), FEED_SIZE):
+            parser.feed(html[start:start + FEED_SIZE])
+        parser.close()
+    except _FoundLink:
+        pass
+    return collector.links
+
+def json_links(json) -> list:
+    '''Gets all urls from a json page, in order, however deeply nested
+    (e.g. {'products': [{'url': ...}, ...]})'''
+    if isinstance(json, dict):
+        values = json.values()
+    elif isinstance(json, list):
+        values = json
+    elif isinstance(json, str) and '://' in json:
+        return [json]
+    else:
+        return []
+    return [link for value in values for link in json_links(value)]
+
+def pick_download_url(links, pattern, base_url=None, name=None) -> str:
+    '''Finds download url for latest version among a page's links'''
+    # List all download candidates
+    try:
+        versions = [version for version in links
+                    if pattern.search(version) != None]
+    except IndexError as ie:
+        raise ie("No url matches instance's 'pattern' attribute! \
+            Check pattern and scraped page's list of hrefs.")
+
+    # Pick first candidate
+    latest = versions[0] # Latest version likely to be at the top
+
+    if name == 'foobar2000':
+        # "/getfile/" deleted, replaced by "/files/" from base_url
+        latest = latest.split('/')[-1]
+    # Simplest way to distinguish between relative and absolute urls;
+    # avoids incorrect url reconstruction in most cases
+    if base_url == None:
+        return latest
+    return base_url + latest
+
+def parse_and_match(page, encoding, pattern, link_parser='fast',
+                    base_url=None, name=None) -> tuple:
+    '''Gets the links of an html page (raw bytes, decoded with 'encoding')
+    and picks the download url among them: (links, download_url). Only
+    takes and returns plain data, so that it can run in a worker process
+    (see App.parse_in).'''
+    html = page.decode(encoding or 'utf-8', errors='replace')
+    links = html_links(html) if link_parser == 'soup' else \
+        first_links(html, pattern)
+    return links, pick_download_url(links, pattern, base_url, name)
+
+def conditional_headers(entry) -> dict:
+    '''Request headers asking the server to answer 304 if the file recorded
+    in a manifest entry hasn't changed'''
+    headers = dict(FILE_HEADERS)
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+def unchanged(entry, status_code, headers) -> bool:
+    '''Tells from the answer to a conditional request whether the file
+    recorded in a manifest entry is still current'''
+    if status_code == 304:
+        return True
+    if not 200 <= status_code < 300:
+        return False
+    # Some servers ignore conditional headers: compare validators by hand,
+    # falling back on the size when the server sends none at all
+    if entry.get('etag') or headers.get('ETag'):
+        return headers.get('ETag') == entry.get('etag')
+    if entry.get('last_modified') or headers.get('Last-Modified'):
+        return headers.get('Last-Modified') == entry.get('last_modified')
+    return headers.get('Content-Length') == str(entry['content_length'])
+
+QUARANTINE_DIR = 'quarantine'  # Where downloads failing their checksum go
+
+# Hash algorithm by length of a hex digest, for checksum files
+DIGEST_LENGTHS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+class ChecksumMismatch(Exception):
+    '''Raised when a download doesn't match its published digest, even
+    after downloading it again. 'path' is where the file was moved.'''
+
+    def __init__(self, name, path):
+        super().__init__(f"{name} doesn't match its published checksum; "
+                         f"moved to {path}")
+        self.path = path
+
+class Hashes:
+    '''Several hashlib hashes of the same bytes, fed together, so one pass
+    over a download gives every digest needed'''
+
+    def __init__(self, algorithms=('sha256',)):
+        self.hashers = {name: hashlib.new(name) for name in algorithms}
+
+    def update(self, chunk):
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+
+    def hexdigests(self) -> dict:
+        return {name: hasher.hexdigest()
+                for name, hasher in self.hashers.items()}
+
+def hash_file(path, chunk_size=CHUNK_SIZE, algorithms=('sha256',)) -> Hashes:
+    '''Returns Hashes fed with a file's current contents'''
+    hashes = Hashes(algorithms)
+    with open(path, 'rb') as input_file:
+        while chunk := input_file.read(chunk_size):
+            hashes.update(chunk)
+    return hashes
+
+class FileChanged(Exception):
+    '''Raised when a server answers the request for a segment of a file
+    with the whole file: it changed since the download was split up'''
+
+# Next to each partial file: the url and validator it was started from
+PART_SOURCE_SUFFIX = '.source'
+
+def part_validator(headers) -> str:
+    '''What to send as If-Range to resume the body of a response: its
+    strong ETag, else its Last-Modified date ('' if it has neither)'''
+    etag = headers.get('ETag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified', '')
+
+def read_part_source(path) -> dict:
+    '''{'url', 'validator'} recorded when the partial file 'path' was
+    started, or None if there is no record of it'''
+    try:
+        with open(path + PART_SOURCE_SUFFIX, encoding='utf-8') as record:
+            return json.load(record)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_part_source(path, url, validator):
+    with open(path + PART_SOURCE_SUFFIX, 'w', encoding='utf-8') as record:
+        json.dump({'url': url, 'validator': validator}, record)
+
+def remove_part(path, with_data=True):
+    '''Deletes the partial file 'path' (unless not 'with_data') and its
+    record'''
+    names = [path + PART_SOURCE_SUFFIX] + ([path] if with_data else [])
+    for name in names:
+        if os.path.exists(name):
+            os.remove(name)
+
+def file_size(status_code, headers) -> int:
+    '''Size of the whole file a response is (part of), or None if unsaid'''
+    if status_code == 206:
+        length = headers.get('Content-Range', '').split('/')[-1]
+    else:
+        length = headers.get('Content-Length', '')
+    return int(length) if length.isdigit() else None
+
+def mirror_url(mirror, url) -> str:
+    '''Url asking a LAN mirror (see mirror_server.py) for a download url'''
+    return f"{mirror.rstrip('/')}/fetch?url={quote(url, safe='')}"
+
+def parse_checksum(text, file_name=None) -> str:
+    '''Finds a digest in a checksum file, either a single hash (as in
+    'setup.exe.sha256') or a '<hash>  <file name>' list (as in SHA256SUMS).
+    Returns it as 'algorithm:hex', or None.'''
+    found = []
+    for line in text.splitlines():
+        match = re.search(r'\b([0-9a-fA-F]{32,128})\b', line)
+        if match and len(match.group(1)) in DIGEST_LENGTHS:
+            found.append((match.group(1).lower(), line))
+    named = [digest for digest, line in found
+             if file_name and file_name in line]
+    if named or len(found) == 1:
+        digest = (named or [found[0][0]])[0]
+        return f'{DIGEST_LENGTHS[len(digest)]}:{digest}'
+    return None
 
 class App:
     '''Creates a software/app/program id, scrapes its website and downloads
@@ -9,7 +355,10 @@ class App:
 
     def __init__(self, name, download_page, pattern,
                  page_response=None, content_type=None, links=None,
-                 base_url=None,file_name=None, download_url=None):
+                 base_url=None,file_name=None, download_url=None,
+                 chunk_size=CHUNK_SIZE, segments=1, max_retries=5,
+                 session=None, link_parser='fast', digest=None,
+                 checksum_url=None, mirrors=None, priority=1):
         self.name = name                    # Name of program
         self.download_page = download_page  # Page with direct link to program
         self.pattern = pattern              # To find correct file to d/l
@@ -19,24 +368,68 @@ class App:
         self.base_url = base_url            # For absolute url reconstruction
         self.download_url = download_url    # Absolute/direct download url
         self.file_name = file_name          # Name of downloaded file
-        
-        self.session = requests.Session()   # For multiple requests on one page
+        self.chunk_size = chunk_size        # Max bytes held in memory at once
+        self.segments = segments            # Parallel byte ranges (large files)
+        self.max_retries = max_retries      # Resume attempts per byte range
+        self.retry_delay = 1                # Seconds, doubled on each retry
+        self.accept_ranges = None           # Server supports 'Range' requests
+        self.content_length = None          # Size of the file, if announced
+        self.etag = None                    # Validators sent with the file,
+        self.last_modified = None           # to detect changes on later runs
+        self.sha256 = None                  # Hex digest of the downloaded file
+        self.hashes = {}                    # Algorithm -> hex digest of it
+        self.digest = digest                # Published one, e.g. 'sha256:...'
+        self.checksum_url = checksum_url    # File publishing it, may use {url}
+        self.mirror = None                  # LAN mirror (mirror_server.py)
+        self.mirrors = mirrors or []        # Url templates of other sources
+        self.sources = []                   # (url, throughput), best first
+        self.priority = priority            # Bandwidth weight (bandwidth.py)
+        self.from_cache = False             # download_url from a ResolveCache
+        # Seconds per stage, bytes received, retries... see report.py
+        self.stats = {'seconds': {}, 'bytes': 0, 'retries': 0,
+                      'ttfb': None, 'skipped': False}
+        self._stats_lock = threading.Lock()  # Segments add up concurrently
+
+        self.link_parser = link_parser      # 'fast' (lxml) or 'soup' (bs4)
+        # Shared with other apps: connections to the same host are reused
+        self.session = session or sessions.shared
+        # Fetches the download page instead, if set (e.g. http2.PageClient)
+        self.page_session = None
 
         # GitHub needs to be treated as a special case
         # because mismatch between absolute and relative urls 
         if 'github.com' in self.download_page:
             self.base_url = 'https://www.github.com'
 
+    def add_time(self, stage, seconds):
+        '''Adds to the time spent in a stage (e.g. 'parse')'''
+        with self._stats_lock:
+            spent = self.stats['seconds']
+            spent[stage] = spent.get(stage, 0) + seconds
+
+    def count(self, name, amount=1):
+        '''Adds to a counter in 'stats' (e.g. 'bytes' or 'retries')'''
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def count_retries(self, response):
+        '''Counts the retries urllib3 made on its own (e.g. after a 503)'''
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None:
+            self.count('retries', len(retries.history))
+
+    @timed('page')
     def request_page(self) -> requests.models.Response:
         '''Request download page and check for errors'''
         # try-except syntax source: https://stackoverflow.com/a/47007419
-        # Keep headers parameter to avoid ConnectionErrors.
-        headers = {'User-Agent': 'Mozilla/5.0 \
-                                 (Windows NT 10.0; Win64; x64; rv:90.0) \
-                                 Gecko/20100101 Firefox/90.0'}
         try:
-            self.page_response = self.session.get(url=self.download_page,
-                                                  timeout=10, headers=headers)
+            session = self.page_session or self.session
+            self.page_response = session.get(url=self.download_page,
+                                             headers=PAGE_HEADERS)
+            # Time until the headers came in (connection and server time)
+            self.stats['ttfb'] = self.page_response.elapsed.total_seconds()
+            self.count_retries(self.page_response)
+            RateLimited.check(self.page_response)
             self.page_response.raise_for_status()
         except requests.exceptions.HTTPError as errh:
             print(f"Http Error for {self.download_page}:", errh)
@@ -50,66 +443,51 @@ class App:
 
     def get_content_type(self) -> str:
         '''Gets content type of page (i.e. file, html or json)'''
-        content_type = self.page_response.headers['Content-Type']
-        try:
-            if content_type == 'binary/octet-stream' or \
-               content_type == 'application/octet-stream' or \
-               content_type == 'application/x-msdownload' or \
-               content_type == 'application/x-msdos-program':
-                self.content_type = 'FILE'
-            elif content_type.startswith('text/html'):
-                self.content_type = 'HTML'        
-            elif content_type.startswith('application/json'):
-                self.content_type = 'JSON'
-        except Exception as e:
-            raise e("Unable to set content_type attribute! Url content type \
-                is {self.page_response.headers['Content-Type']}.")
+        self.content_type = content_type_of(
+            self.page_response.headers['Content-Type'])
         return self.content_type
 
     def get_html_links(self) -> list:
         '''Gets all urls from an html page'''
-        html = self.page_response.text
-        soup = BeautifulSoup(html, 'lxml')
-        anchors = soup.select('a')
-        # Exclude potential NoneTypes (would keep code from running)
-        self.links = [link.get('href') for link in anchors
-                      if isinstance(link.get('href'), str)]
+        return self.parse_html(self.page_response.text)
+
+    @timed('parse')
+    def parse_html(self, html) -> list:
+        '''Gets the urls of an html page with the chosen link parser. The
+        fast one stops at the first url matching 'pattern', which is the
+        only one get_download_url would pick anyway.'''
+        if self.link_parser == 'soup':
+            self.links = html_links(html)
+        else:
+            self.links = first_links(html, self.pattern)
         return self.links
 
+    @timed('parse')
+    def parse_in(self, executor) -> str:
+        '''Parses the html page and picks the download url on 'executor',
+        e.g. a ProcessPoolExecutor, so that the parse doesn't hold the GIL
+        the download threads need. Counted as 'parse' time, match included.'''
+        self.links, self.download_url = executor.submit(
+            parse_and_match, self.page_response.content,
+            self.page_response.encoding, self.pattern, self.link_parser,
+            self.base_url, self.name).result()
+        return self.download_url
+
+    @timed('parse')
     def get_json_links(self) -> list:
         '''Gets all urls from a json page'''
-        json = self.page_response.json()
-        json_list = json['products']
-        self.links = [link['url'] for link in json_list]
+        self.links = json_links(self.page_response.json())
         return self.links
 
+    @timed('match')
     def get_download_url(self) -> str:
         '''Finds download url for latest version'''
         # 'FILE' = download page contains redirection to download url
         if self.content_type == 'FILE':
             self.download_url = self.page_response.url
             return self.download_url
-        
-        # List all download candidates
-        try:
-            versions = [version for version in self.links
-                        if self.pattern.search(version) != None]
-        except IndexError as ie:
-            raise ie("No url matches instance's 'pattern' attribute! \
-                Check pattern and scraped page's list of hrefs.")        
-        
-        # Pick first candidate
-        latest = versions[0] # Latest version likely to be at the top
-        
-        if self.name == 'foobar2000':
-            # "/getfile/" deleted, replaced by "/files/" from base_url
-            latest = latest.split('/')[-1]
-        # Simplest way to distinguish between relative and absolute urls;
-        # avoids incorrect url reconstruction in most cases
-        if self.base_url == None:
-            self.download_url = latest
-        elif self.base_url != None:
-            self.download_url = self.base_url + latest
+        self.download_url = pick_download_url(self.links, self.pattern,
+                                              self.base_url, self.name)
         return self.download_url
 
     def get_file_name(self) -> str:
@@ -121,12 +499,369 @@ class App:
             self.file_name = unquote_plus(self.file_name)
         return self.file_name
 
+    @timed('probe')
+    def probe_download(self) -> bool:
+        '''Asks the server (HEAD) for the file size and whether it accepts
+        byte ranges'''
+        try:
+            response = self.session.head(self.download_url,
+                                         headers=FILE_HEADERS,
+                                         allow_redirects=True)
+        except requests.exceptions.RequestException:
+            self.accept_ranges = False
+            return self.accept_ranges
+        if response.ok:
+            self.note_headers(response.status_code, response.headers)
+        self.accept_ranges = response.ok and \
+            response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        return self.accept_ranges
+
+    def note_headers(self, status_code, headers):
+        '''Keeps the file's size and validators (ETag, Last-Modified) from a
+        response, to check for changes on later runs'''
+        self.etag = headers.get('ETag', self.etag)
+        self.last_modified = headers.get('Last-Modified', self.last_modified)
+        length = file_size(status_code, headers)
+        if length is not None:
+            self.content_length = length
+
+    def fetch_range(self, path, start=0, end=None, hashed=False) -> int:
+        '''Streams bytes start-end (inclusive; end=None means to the end of
+        the file) into 'path'. Whatever 'path' already holds is kept and only
+        the rest is requested, so dropped connections and interrupted runs
+        resume instead of starting over. Returns the size of 'path'.
+        With 'hashed', the hashes of 'path' are computed on the way and
+        stored (see set_hashes).
+        The url and validator 'path' was started from are kept next to it
+        (see read_part_source): it's resumed with If-Range, so a file that
+        changed since is downloaded again rather than joined to the old
+        bytes.'''
+        expected = None if end is None else end - start + 1
+        attempt = 0
+        hasher = None
+        while True:
+            done = os.path.getsize(path) if os.path.exists(path) else 0
+            if expected is not None and done >= expected:
+                remove_part(path, with_data=False)
+                return done
+            url = self.transfer_url()
+            headers = dict(FILE_HEADERS)
+            if done:
+                source = read_part_source(path)
+                if source is None:
+                    # No telling which build these bytes are from
+                    remove_part(path)
+                    continue
+                if source['validator'] and source['url'] == url:
+                    headers['If-Range'] = source['validator']
+            if done or end is not None:
+                last = '' if end is None else str(end)
+                headers['Range'] = f'bytes={start + done}-{last}'
+            try:
+                with self.session.get(url, headers=headers,
+                                      stream=True) as response:
+                    if self.mirror and response.status_code >= 500:
+                        self.leave_mirror(
+                            f"it answered {response.status_code}")
+                        continue
+                    # Nothing left to send: the '.part' file is complete,
+                    # if it's as long as the file
+                    if response.status_code == 416 and end is None:
+                        total = response.headers.get('Content-Range',
+                                                     '').split('/')[-1]
+                        if total != str(done):
+                            remove_part(path)
+                            continue
+                        if hashed:
+                            self.set_hashes(hash_file(path, self.chunk_size,
+                                                      self.algorithms()))
+                        remove_part(path, with_data=False)
+                        return done
+                    self.count_retries(response)
+                    RateLimited.check(response)
+                    response.raise_for_status()
+                    size = file_size(response.status_code, response.headers)
+                    if self.content_length and size and \
+                       size != self.content_length and \
+                       (done or end is not None or url != self.download_url):
+                        # Not the file the other bytes come from
+                        if not self.mirror and len(self.sources) > 1 and \
+                           url != self.download_url:
+                            self.drop_source(url, f"it has {size} bytes, "
+                                             f"not {self.content_length}")
+                            continue
+                        # The file itself changed: start over with it
+                        self.note_headers(response.status_code,
+                                          response.headers)
+                        if end is not None:
+                            raise FileChanged(f"{url} is now {size} bytes")
+                        remove_part(path)
+                        continue
+                    self.note_headers(response.status_code, response.headers)
+                    # Server ignored the range, or the file changed (If-Range
+                    # didn't match): start again from byte zero
+                    if response.status_code != 206:
+                        if end is not None:
+                            raise FileChanged(
+                                f"{url} sent the whole file for a segment")
+                        done = 0
+                    if not done:
+                        write_part_source(path, url,
+                                          part_validator(response.headers))
+                    if hashed and not done:
+                        hasher = Hashes(self.algorithms())
+                    elif hashed and hasher is None:
+                        # Leftover from an earlier run: hash what's there once
+                        hasher = hash_file(path, self.chunk_size,
+                                           self.algorithms())
+                    # Watched transfers are read in small steps, so that a
+                    # slowdown shows within seconds. Segments share the
+                    # source's speed.
+                    watch = self.speed_watch(1 if end is None
+                                             else self.segments)
+                    step = min(self.chunk_size, mirrors.WATCH_CHUNK) \
+                        if watch else self.chunk_size
+                    slowed = False
+                    received = 0
+                    limiter = bandwidth.limiter
+                    # Write in binary ('wb'); only for Windows
+                    with open(path, 'ab' if done else 'wb') as output_file, \
+                         limiter.stream(self.priority) as stream:
+                        for chunk in response.iter_content(limiter.step(step)):
+                            output_file.write(chunk)
+                            received += len(chunk)
+                            self.count('bytes', len(chunk))
+                            if hashed:
+                                hasher.update(chunk)
+                            limiter.take(stream, len(chunk))
+                            if watch and limiter.rate is not None:
+                                watch = None    # Limit set meanwhile
+                            if watch and watch.slow(len(chunk)):
+                                slowed = True
+                                break
+                    if slowed:
+                        # Resume from the next source
+                        self.next_source(url, watch.throughput())
+                        continue
+                if expected is None or os.path.getsize(path) >= expected:
+                    if hashed:
+                        self.set_hashes(hasher)
+                    remove_part(path, with_data=False)
+                    return os.path.getsize(path)
+                # Short body: retried, but a server that keeps sending
+                # nothing uses up the attempts
+                if not received:
+                    raise requests.exceptions.ConnectionError(
+                        f"{url} sent no bytes of the range")
+            except DROPPED as err:
+                if self.mirror:
+                    self.leave_mirror(err)
+                    continue
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.count('retries')
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def transfer_url(self) -> str:
+        '''Where the file's bytes come from: the LAN mirror if one is set,
+        else the fastest source (see pick_source), else the download url'''
+        if self.mirror:
+            return mirror_url(self.mirror, self.download_url)
+        if self.sources:
+            return self.sources[0][0]
+        return self.download_url
+
+    @timed('probe')
+    def pick_source(self) -> str:
+        '''Ranks the download url and the 'mirrors' by speed (see
+        mirrors.py); returns the url the download will start from'''
+        self.sources = mirrors.rank(self)
+        return self.sources[0][0]
+
+    def speed_watch(self, share=1) -> mirrors.SpeedWatch:
+        '''Watch on a transfer getting 1/'share' of the current source's
+        speed, if there is another source to switch to when it slows down
+        (else None). Transfers held back by a bandwidth limit aren't
+        watched: they are slow on purpose.'''
+        if bandwidth.limiter.rate is not None:
+            return None
+        with self._stats_lock:
+            if self.mirror or len(self.sources) < 2 or not self.sources[0][1]:
+                return None
+            return mirrors.SpeedWatch(
+                self.sources[0][1] * mirrors.COLLAPSE / share)
+
+    def next_source(self, url, throughput):
+        '''Gives up on source 'url', which slowed down to 'throughput'
+        bytes per second, and remembers that speed for later runs'''
+        mirrors.history.record(url, throughput=throughput)
+        mirrors.history.save()
+        self.drop_source(url, "slowed down")
+
+    def drop_source(self, url, reason):
+        '''Moves the download on from source 'url' to the next one.
+        Segments may give up on it at the same time: only the first one
+        moves the download on.'''
+        from tqdm import tqdm
+        with self._stats_lock:
+            if self.sources and self.sources[0][0] == url:
+                self.sources.pop(0)
+                # Above the download bar, not through it
+                tqdm.write(f"Leaving {mirrors.host_of(url)} for {self.name} "
+                           f"({reason}); switching to "
+                           f"{mirrors.host_of(self.sources[0][0])}.")
+
+    def leave_mirror(self, reason):
+        '''Gets the rest of the file from its site, the mirror having
+        failed. What was received from the mirror is kept.'''
+        from tqdm import tqdm
+        self.mirror = None
+        tqdm.write(f"Mirror failed for {self.name} ({reason}); "
+                   "downloading from the site instead.")
+
+    def download_segments(self, path) -> int:
+        '''Downloads the file as parallel byte ranges, each into its own
+        resumable '.partN' file, then stitches them together into 'path'
+        (hashing them as they are copied)'''
+        size = self.content_length
+        count = max(1, min(self.segments, size // MIN_SEGMENT_SIZE))
+        step = -(-size // count)    # Ceiling division
+        ranges = [(f'{path}{index}', start, min(start + step, size) - 1)
+                  for index, start in enumerate(range(0, size, step))]
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(lambda args: self.fetch_range(*args),
+                                  ranges))
+        except FileChanged:
+            for segment_path, _, _ in ranges:
+                remove_part(segment_path)
+            raise
+        hasher = Hashes(self.algorithms())
+        with open(path, 'wb') as output_file:
+            for segment_path, _, _ in ranges:
+                with open(segment_path, 'rb') as segment:
+                    while chunk := segment.read(self.chunk_size):
+                        output_file.write(chunk)
+                        hasher.update(chunk)
+                os.remove(segment_path)
+        self.set_hashes(hasher)
+        return size
+
+    @timed('download')
     def download_installer(self) -> int:
-        '''Downloads the installer/archive'''
-        file_bytes = self.session.get(self.download_url).content
-        # Write in binary ('wb'); only for Windows
-        with open(self.file_name, 'wb') as output_file:
-            output_file.write(file_bytes)
+        '''Streams the installer/archive to a temporary '.part' file, then
+        renames it. Leftover '.part' files from an interrupted run are
+        resumed. Large files are split into 'segments' byte ranges when the
+        server supports it. The file is hashed on the way and checked
+        against the published digest, if any: on a mismatch it's downloaded
+        again from scratch, then quarantined (raising ChecksumMismatch).
+        Returns the number of bytes written.'''
+        temp_name = self.file_name + '.part'
+        if self.mirrors and not self.mirror and not self.sources:
+            # Not ranked in phase 1 (see pipeline.resolve_app)
+            self.sources = mirrors.rank(self)
+        # Size and range support may be known already (see pipeline.py)
+        if self.segments > 1 and self.accept_ranges is None:
+            self.probe_download()
+        for attempt in range(2):
+            segmented = self.segments > 1 and self.accept_ranges and \
+                self.content_length
+            if segmented:
+                try:
+                    written = self.download_segments(temp_name)
+                except FileChanged as err:
+                    print(f"{self.name} changed while downloading ({err}); "
+                          "starting over in one piece.")
+                    segmented = False
+            if not segmented:
+                written = self.fetch_range(temp_name, hashed=True)
+                self.content_length = written
+            if self.verify():
+                break
+            if attempt:
+                raise ChecksumMismatch(self.name, self.quarantine(temp_name))
+            # Corrupt transfer or a bad leftover '.part': start over once
+            self.count('retries')
+            os.remove(temp_name)
+        # Replace in one step so a half-written file never has the real name
+        os.replace(temp_name, self.file_name)
+        return written
+
+    def algorithms(self) -> tuple:
+        '''Hashes to compute while downloading: SHA-256, plus the algorithm
+        of the published digest'''
+        published = self.digest.partition(':')[0].lower() \
+            if self.digest else 'sha256'
+        return ('sha256',) if published == 'sha256' else ('sha256', published)
+
+    def set_hashes(self, hashes):
+        '''Keeps the digests of the downloaded file (a Hashes object)'''
+        self.hashes = hashes.hexdigests()
+        self.sha256 = self.hashes['sha256']
+
+    def verify(self) -> bool:
+        '''False if the download doesn't match the published digest. True
+        if it does, or if no digest was published.'''
+        if not self.digest:
+            return True
+        algorithm, _, expected = self.digest.partition(':')
+        return self.hashes.get(algorithm.lower()) == expected.lower()
+
+    def quarantine(self, path) -> str:
+        '''Moves a bad download out of the way; returns its new path'''
+        os.makedirs(QUARANTINE_DIR, exist_ok=True)
+        quarantined = os.path.join(QUARANTINE_DIR, self.file_name)
+        os.replace(path, quarantined)
+        return quarantined
+
+    def fetch_checksum(self) -> str:
+        '''Reads the published digest from the 'checksum_url' file (e.g.
+        'setup.exe.sha256' or a SHA256SUMS list), unless already known.
+        '{url}' in 'checksum_url' stands for the download url.'''
+        if self.digest or not self.checksum_url:
+            return self.digest
+        url = self.checksum_url.format(url=self.download_url)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=HEADERS)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as err:
+            print(f"No checksum for {self.name}:", err)
+            return None
+        finally:
+            self.add_time('checksum', time.perf_counter() - start)
+        self.digest = parse_checksum(response.text, self.file_name)
+        return self.digest
+
+    def has_file_from(self, entry) -> bool:
+        '''True if a manifest entry (see manifest.py) describes the file now
+        on disk and the url it would be downloaded from'''
+        if not entry or entry.get('download_url') != self.download_url \
+           or not os.path.isfile(self.file_name) \
+           or os.path.getsize(self.file_name) != entry.get('content_length'):
+            return False
+        # Same size and modification time: trust the recorded hash, else
+        # read the file again to make sure it's still what was downloaded
+        if entry.get('mtime') == os.path.getmtime(self.file_name) or \
+           not entry.get('sha256'):
+            return True
+        return hash_file(self.file_name, self.chunk_size).hexdigests() \
+            ['sha256'] == entry['sha256']
+
+    def is_up_to_date(self, entry) -> bool:
+        '''Checks a manifest entry against the file on disk and, with a
+        conditional HEAD request, against the server. True if the installer
+        doesn't need downloading again.'''
+        if not self.has_file_from(entry):
+            return False
+        try:
+            response = self.session.head(self.download_url,
+                                         headers=conditional_headers(entry),
+                                         allow_redirects=True)
+        except requests.exceptions.RequestException:
+            return False
+        return unchanged(entry, response.status_code, response.headers)
 
     def __str__(self):
         instance_info = f"""
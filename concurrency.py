@@ -0,0 +1,136 @@
+'''Tunes how many downloads run at once from what the run measures, the way
+TCP congestion control tunes its window (additive increase, multiplicative
+decrease).
+
+Every 'interval' seconds, the controller looks at the bytes received, the
+errors (retries, 429s) and the latency of the requests to each host since
+its last decision, then:
+- halves the limit on new errors
+- after a decrease, holds for 'hold' intervals
+- halves the limit when the latency to a host has risen to more than
+  'latency_rise' times the lowest seen for that host (the link is
+  queueing). Hosts are only compared with themselves, and only from
+  start() on, so a slow site after a fast one, or the pages fetched
+  before the downloads, don't count as a rise
+- takes back its last increase if it didn't raise throughput by at least
+  'tolerance', and holds
+- else adds one, while there are jobs waiting for a worker
+
+The limit stays between 'minimum' and 'maximum'. Each decision is kept in
+'decisions' and passed to 'log'.'''
+
+import time
+
+class Decision:
+    '''One change of the limit and what it was based on'''
+
+    __slots__ = ('time', 'limit', 'throughput', 'latency', 'reason')
+
+    def __init__(self, time, limit, throughput, latency, reason):
+        self.time = time
+        self.limit = limit
+        self.throughput = throughput    # Bytes per second over the interval
+        self.latency = latency          # Seconds (slowest host), or None
+        self.reason = reason
+
+    def __str__(self):
+        latency = f", latency {self.latency * 1000:.0f} ms" \
+            if self.latency is not None else ''
+        return (f"Workers: {self.limit} ({self.reason}; "
+                f"{self.throughput / 1e6:.1f} MB/s{latency})")
+
+class AIMDController:
+    '''Limit on jobs running at once, see module docstring'''
+
+    def __init__(self, minimum=2, maximum=16, start=None, interval=2,
+                 tolerance=0.05, latency_rise=2, hold=3, latency=None,
+                 reset_latency=None, log=print, clock=time.monotonic):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = start or minimum
+        self.interval = interval        # Seconds between decisions
+        self.tolerance = tolerance      # Gain expected from one more worker
+        self.latency_rise = latency_rise
+        self.hold = hold                # Intervals without increase after
+        self.latency = latency          # Function: {host: recent latency}
+        self.reset_latency = reset_latency  # Function called by start()
+        self.log = log
+        self.clock = clock
+        self.decisions = []
+        self._last = None               # (time, bytes, errors) at last update
+        self._previous = None           # Throughput before the last increase
+        self._increased = False
+        self._held = 0
+        self._lowest_latency = {}       # Host -> seconds
+
+    def start(self):
+        '''Called when the jobs it tunes start: measures from here on'''
+        self._last = None
+        self._lowest_latency.clear()
+        if self.reset_latency is not None:
+            self.reset_latency()
+
+    def update(self, received, errors, waiting=True) -> int:
+        '''Takes in the bytes received and errors met so far (totals for
+        the run) and whether jobs are waiting for a worker. Decides once
+        'interval' seconds have passed since the last decision. Returns the
+        limit.'''
+        now = self.clock()
+        if self._last is None:
+            self._last = (now, received, errors)
+            return self.limit
+        since, received_before, errors_before = self._last
+        if now - since < self.interval:
+            return self.limit
+        self._last = (now, received, errors)
+        throughput = (received - received_before) / (now - since)
+        latencies = self.latency() if self.latency is not None else {}
+        risen = None                    # Host whose latency rose the most
+        for host, value in latencies.items():
+            lowest = min(self._lowest_latency.get(host, value), value)
+            self._lowest_latency[host] = lowest
+            if value > lowest * self.latency_rise and (
+                    risen is None or value / lowest >
+                    latencies[risen] / self._lowest_latency[risen]):
+                risen = host
+        latency = max(latencies.values()) if latencies else None
+
+        if errors > errors_before:
+            self._decrease(f"{errors - errors_before} error(s)", throughput,
+                           latency)
+        elif self._held:
+            self._held -= 1
+            self._increased = False
+        elif risen is not None:
+            self._decrease(f"latency to {risen} up from "
+                           f"{self._lowest_latency[risen] * 1000:.0f} ms",
+                           throughput, latencies[risen])
+        elif self._increased and \
+             throughput < self._previous * (1 + self.tolerance):
+            self._held = self.hold
+            self._set(self.limit - 1, "one more worker didn't help",
+                      throughput, latency)
+        elif waiting and self.limit < self.maximum:
+            self._previous = throughput
+            self._set(self.limit + 1, "probing for more throughput",
+                      throughput, latency)
+            self._increased = True
+            return self.limit
+        else:
+            self._increased = False
+        return self.limit
+
+    def _decrease(self, reason, throughput, latency):
+        self._held = self.hold
+        self._set(self.limit // 2, reason, throughput, latency)
+
+    def _set(self, limit, reason, throughput, latency):
+        self._increased = False
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit == self.limit:
+            return
+        self.limit = limit
+        decision = Decision(self.clock(), limit, throughput, latency, reason)
+        self.decisions.append(decision)
+        if self.log is not None:
+            self.log(str(decision))
@@ -0,0 +1,3 @@
+# test_my-apps-downloader.py and test_step_by_step.py are manual scripts that
+# hit the live sites and write to the desktop; keep them out of pytest runs.
+collect_ignore = ['test_my-apps-downloader.py', 'test_step_by_step.py']
@@ -0,0 +1,123 @@
+'''Download pages for the benchmarks and offline tests.
+
+Pages recorded from the real sites are kept in the fixtures/ folder, one
+'<app-slug>.html' per app (see 'python benchmark.py record'). deluge.html
+is a stand-in until it is recorded: the real listing's markup with a
+made-up file list (see the comment at its top). For apps with no page in
+fixtures/, a synthetic page of a similar shape is built instead: lots of
+unrelated links, plus one matching the app's pattern.'''
+
+import os
+import re
+
+import classes as cl
+
+try:
+    from re import _parser as sre_parse     # Python 3.11+
+except ImportError:
+    import sre_parse
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures')
+
+def slug(name) -> str:
+    '''File-name friendly version of an app name'''
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+def sample_match(pattern) -> str:
+    '''Builds a string that a compiled regex matches, e.g. a plausible file
+    name for an app's pattern'''
+    return _sample(sre_parse.parse(pattern.pattern, pattern.flags))
+
+def _sample(parsed) -> str:
+    text = []
+    for op, arg in parsed:
+        if op is sre_parse.LITERAL:
+            text.append(chr(arg))
+        elif op is sre_parse.NOT_LITERAL:
+            text.append('y' if chr(arg) == 'x' else 'x')
+        elif op is sre_parse.ANY:
+            text.append('.')    # Usually an unescaped dot before 'exe'
+        elif op is sre_parse.IN:
+            text.append(_sample_set(arg))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, item = arg
+            repeated = 'x' if list(item) == [(sre_parse.ANY, None)] \
+                else _sample(item)
+            text.append(repeated * min(max(low, 1), high))
+        elif op is sre_parse.SUBPATTERN:
+            text.append(_sample(arg[-1]))
+        elif op is sre_parse.BRANCH:
+            text.append(_sample(arg[1][0]))
+        elif op is not sre_parse.AT:    # Anchors match without characters
+            raise ValueError(f"Can't build a sample for regex item {op}")
+    return ''.join(text)
+
+def _sample_set(items) -> str:
+    categories = {sre_parse.CATEGORY_DIGIT: '1',
+                  sre_parse.CATEGORY_WORD: 'a',
+                  sre_parse.CATEGORY_SPACE: ' '}
+    for op, arg in items:
+        if op is sre_parse.LITERAL:
+            return chr(arg)
+        if op is sre_parse.RANGE:
+            return chr(arg[0])
+        if op is sre_parse.CATEGORY and arg in categories:
+            return categories[arg]
+    return 'x'
+
+def synthetic_page(pattern, href=None, anchors=2000, position=0.25) -> str:
+    '''An html page with 'anchors' links, the one matching 'pattern' being
+    about 'position' of the way down (release pages list the latest build
+    near the top; 1 for the last link). 'href' is that link, by default a
+    sample match.'''
+    href = href or '/downloads/' + sample_match(pattern)
+    target = min(int(anchors * position), anchors - 1)
+    rows = []
+    for index in range(anchors):
+        if index == target:
+            rows.append(f'<li class="asset"><a href="{href}" rel="nofollow">'
+                        f'<span>Download</span></a> <small>64-bit</small></li>')
+        else:
+            rows.append(f'<li class="entry"><a href="/page/{index}/notes" '
+                        f'data-id="{index}"><span>Entry {index}</span></a> '
+                        f'<small>Notes, screenshots and checksums</small></li>')
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+            '<title>Downloads</title></head><body><nav><ul>'
+            + ''.join(rows) + '</ul></nav></body></html>')
+
+def recorded_path(app) -> str:
+    return os.path.join(FIXTURE_DIR, slug(app.name) + '.html')
+
+def load_page(app) -> str:
+    '''Recorded download page of an App, or a synthetic one'''
+    try:
+        with open(recorded_path(app), encoding='utf-8') as page:
+            return page.read()
+    except FileNotFoundError:
+        return synthetic_page(app.pattern)
+
+def replay_page(app, href) -> str:
+    '''Download page of an App whose link matching 'pattern' is 'href', to
+    serve from a local server. A recorded page gets its own matching link
+    swapped for 'href'; a synthetic page is built if there is none.'''
+    try:
+        with open(recorded_path(app), encoding='utf-8') as page:
+            html = page.read()
+    except FileNotFoundError:
+        return synthetic_page(app.pattern, href)
+    links = cl.first_links(html, app.pattern)
+    if links and app.pattern.search(links[-1]) and f'"{links[-1]}"' in html:
+        return html.replace(f'"{links[-1]}"', f'"{href}"', 1)
+    return synthetic_page(app.pattern, href)
+
+def record(app) -> str:
+    '''Fetches an App's download page from the real site and saves it as a
+    fixture. Returns the path, or None if the page isn't html.'''
+    app.request_page()
+    if app.page_response is None or app.get_content_type() != 'HTML':
+        return None
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(recorded_path(app), 'w', encoding='utf-8') as page:
+        page.write(app.page_response.text)
+    return recorded_path(app)
@@ -0,0 +1,96 @@
+'''Optional HTTP/2 transport for the download pages (resolve phase), with
+httpx (pip install httpx[http2]).
+
+Over HTTP/2, every page fetched from a host goes over one connection, the
+requests multiplexed on it instead of each waiting for a connection of
+its own. Sites that don't offer HTTP/2 are spoken to in HTTP/1.1 (chosen
+during the TLS handshake), and a host whose HTTP/2 fails is handed over to
+the requests-based 'fallback' (see sessions.py) for the rest of the run.
+
+Answers are turned into requests.Response objects, so App code reads them
+as usual. Pages are asked for compressed (see classes.PAGE_HEADERS): the
+'bytes' counter in 'stats' shows what went over the wire, 'decoded' what
+it expanded to.'''
+
+import collections
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+try:
+    import httpx
+    import h2
+except ImportError:
+    httpx = None
+
+def available() -> bool:
+    '''Whether httpx and h2 are installed'''
+    return httpx is not None
+
+def to_requests_response(response) -> requests.Response:
+    '''The requests.Response equivalent of an httpx.Response, body read'''
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers = CaseInsensitiveDict(response.headers)
+    converted.encoding = get_encoding_from_headers(converted.headers)
+    converted._content = response.content
+    converted.url = str(response.url)
+    converted.elapsed = response.elapsed
+    return converted
+
+class PageClient:
+    '''Stands in for a SessionPool when fetching pages, see module
+    docstring. With 'prior_knowledge', plain http:// urls are spoken to in
+    HTTP/2 straight away (h2c, e.g. local_h2_server.py) rather than in
+    HTTP/1.1. Safe to share between threads.'''
+
+    def __init__(self, fallback=None, timeout=10, prior_knowledge=False):
+        if not available():
+            raise RuntimeError("HTTP/2 needs httpx and h2. Install them "
+                               "with 'pip install httpx[http2]'.")
+        self.fallback = fallback        # For hosts where HTTP/2 failed
+        self.client = httpx.Client(http1=not prior_knowledge, http2=True,
+                                   timeout=timeout, follow_redirects=True)
+        self.stats = {'requests': 0, 'bytes': 0, 'decoded': 0,
+                      'versions': collections.Counter()}
+        self._http1_hosts = set()
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None) -> requests.Response:
+        host = urlsplit(url).netloc.lower()
+        if self.fallback is not None:
+            with self._lock:
+                http1 = host in self._http1_hosts
+            if http1:
+                return self.fallback.get(url, headers=headers)
+            if self.fallback.throttle is not None:
+                self.fallback.throttle(url)     # Same budget as HTTP/1.1
+        try:
+            response = self.client.get(url, headers=headers)
+        except (httpx.RemoteProtocolError, httpx.LocalProtocolError,
+                h2.exceptions.ProtocolError) as err:
+            if self.fallback is None:
+                raise requests.exceptions.ConnectionError(err) from err
+            with self._lock:
+                self._http1_hosts.add(host)
+            print(f"HTTP/2 failed for {host} ({err}); using HTTP/1.1.")
+            return self.fallback.get(url, headers=headers)
+        except httpx.TimeoutException as err:
+            raise requests.exceptions.Timeout(err) from err
+        except httpx.TransportError as err:
+            raise requests.exceptions.ConnectionError(err) from err
+        except httpx.HTTPError as err:
+            raise requests.exceptions.RequestException(err) from err
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += response.num_bytes_downloaded
+            self.stats['decoded'] += len(response.content)
+            self.stats['versions'][response.http_version] += 1
+        return to_requests_response(response)
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,178 @@
+'''An HTTP/2 stand-in for the download sites, to compare page fetches over
+one multiplexed connection with local_server.py's HTTP/1.1. Speaks
+cleartext HTTP/2 with prior knowledge (h2c), so clients must be told to
+use HTTP/2 without negotiating it. Needs the h2 package (pip install h2).
+
+Routes are served as LocalServer serves pages (bytes, str or StaticFile),
+each answer coming 'latency' seconds after its request, text compressed
+with brotli or gzip if the client asks for it. 'sent' counts the body
+bytes sent and 'connections' the connections accepted.'''
+
+import socket
+import threading
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+
+from local_server import StaticFile, encode
+
+class _Connection:
+    '''One client connection. Frames are read on its own thread; each
+    request is answered from a timer thread after the latency, its body
+    sent as fast as flow control allows.'''
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        config = h2.config.H2Configuration(client_side=False,
+                                           header_encoding='utf-8')
+        self.conn = h2.connection.H2Connection(config)
+        self.pending = {}           # Stream id -> body bytes left to send
+        self.lock = threading.Lock()
+
+    def run(self):
+        with self.lock:
+            self.conn.initiate_connection()
+            self.flush()
+        try:
+            while data := self.sock.recv(65536):
+                with self.lock:
+                    for event in self.conn.receive_data(data):
+                        if isinstance(event, h2.events.RequestReceived):
+                            timer = threading.Timer(
+                                self.server.latency, self.respond,
+                                (event.stream_id, dict(event.headers)))
+                            timer.daemon = True
+                            timer.start()
+                        elif isinstance(event, h2.events.StreamReset):
+                            self.pending.pop(event.stream_id, None)
+                        elif isinstance(event,
+                                        h2.events.ConnectionTerminated):
+                            return
+                    self.send_pending()
+                    self.flush()
+        except (OSError, h2.exceptions.ProtocolError):
+            pass
+        finally:
+            self.sock.close()
+
+    def respond(self, stream_id, headers):
+        payload = self.server.routes.get(headers[':path'])
+        try:
+            with self.lock:
+                if payload is None:
+                    self.conn.send_headers(stream_id,
+                                           [(':status', '404'),
+                                            ('content-length', '0')],
+                                           end_stream=True)
+                else:
+                    body, coding = encode(payload,
+                                          headers.get('accept-encoding', ''))
+                    if coding is None:
+                        body = payload.body
+                    response_headers = [
+                        (':status', '200'),
+                        ('content-type', payload.content_type),
+                        ('content-length', str(len(body)))]
+                    if coding is not None:
+                        response_headers.append(('content-encoding', coding))
+                    self.conn.send_headers(stream_id, response_headers,
+                                           end_stream=not body)
+                    if body:
+                        self.pending[stream_id] = body
+                        self.send_pending()
+                self.flush()
+        except (OSError, h2.exceptions.ProtocolError):
+            pass    # The client went away
+
+    def send_pending(self):
+        '''Sends what the flow control windows allow of the bodies left to
+        send. Call under lock.'''
+        for stream_id, body in list(self.pending.items()):
+            try:
+                window = self.conn.local_flow_control_window(stream_id)
+            except h2.exceptions.StreamClosedError:
+                del self.pending[stream_id]
+                continue
+            while body and window > 0:
+                size = min(window, len(body),
+                           self.conn.max_outbound_frame_size)
+                self.conn.send_data(stream_id, body[:size],
+                                    end_stream=size == len(body))
+                self.server.count_sent(size)
+                body = body[size:]
+                window -= size
+            if body:
+                self.pending[stream_id] = body
+            else:
+                del self.pending[stream_id]
+
+    def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+class H2Server:
+    '''Runs an h2c server on 127.0.0.1 in the background. Use as a context
+    manager.'''
+
+    def __init__(self, routes=None, latency=0):
+        self.routes = {}
+        self.latency = latency          # Seconds waited before each answer
+        self.sent = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        for path, payload in (routes or {}).items():
+            self.add(path, payload)
+        self._socket = socket.create_server(('127.0.0.1', 0))
+        self._thread = None
+
+    def add(self, path, payload, content_type='text/html; charset=utf-8'):
+        '''Serves 'payload' (bytes, str or StaticFile) at 'path'. The
+        content type only applies to bytes and str payloads.'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if isinstance(payload, bytes):
+            payload = StaticFile(payload, content_type)
+        self.routes[path] = payload
+
+    def count_sent(self, amount):
+        with self._lock:
+            self.sent += amount
+
+    def url(self, path) -> str:
+        host, port = self._socket.getsockname()
+        return f'http://{host}:{port}{path}'
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self._socket.accept()
+            except OSError:
+                return      # Stopped
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=_Connection(self, sock).run,
+                             daemon=True).start()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Wakes up accept() on Linux, where closing the socket doesn't
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,302 @@
+'''A local HTTP stand-in for the download sites, so transfers can be tested
+and measured without touching the real ones.
+
+Routes map a path (e.g. '/files/big.exe') to either raw bytes or a
+SyntheticFile, which generates its content on the fly and never holds the
+whole payload in memory. Byte ranges are supported unless disabled,
+drop() cuts upcoming responses short to simulate lost connections and
+fail() answers upcoming requests with an error status.
+
+For benchmarks, network conditions can be imitated on every request: a
+delay before answering ('latency'), a cap on each response's transfer rate
+('bandwidth') and a share of requests answered 503 ('error_rate'). With
+'compress', text pages are sent gzip or brotli encoded when the client
+asks for it. 'sent' counts the body bytes sent and 'connections' the
+connections accepted.'''
+
+import collections
+import contextlib
+import gzip
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+TEXT_TYPES = ('text/', 'application/json')
+
+def encode(payload, accept_encoding):
+    '''(body, Content-Encoding) for a StaticFile: brotli or gzip compressed
+    if it's text and the Accept-Encoding header allows it, else as is
+    (Content-Encoding None)'''
+    accepted = {coding.split(';')[0].strip().lower()
+                for coding in accept_encoding.split(',')}
+    if not isinstance(payload, StaticFile) or \
+       not payload.content_type.startswith(TEXT_TYPES):
+        return None, None
+    if 'br' in accepted and brotli is not None:
+        coding = 'br'
+    elif 'gzip' in accepted:
+        coding = 'gzip'
+    else:
+        return None, None
+    # Compressed once per page, as web servers do for static files
+    if coding not in payload.encoded:
+        payload.encoded[coding] = brotli.compress(payload.body, quality=5) \
+            if coding == 'br' else gzip.compress(payload.body, 6)
+    return payload.encoded[coding], coding
+
+class SyntheticFile:
+    '''Deterministic payload of a given size, produced block by block'''
+
+    BLOCK = bytes(range(256)) * 256     # 64 KiB repeating pattern
+
+    def __init__(self, size, content_type='application/octet-stream',
+                 etag=None):
+        self.size = size
+        self.content_type = content_type
+        self.etag = etag or f'"synthetic-{size}"'
+
+    def read(self, start, end):
+        '''Yields the bytes in [start, end) without building them all'''
+        position = start
+        while position < end:
+            offset = position % len(self.BLOCK)
+            step = min(len(self.BLOCK) - offset, end - position)
+            yield self.BLOCK[offset:offset + step]
+            position += step
+
+    def content(self) -> bytes:
+        '''Whole payload at once; only meant for small files in assertions'''
+        return b''.join(self.read(0, self.size))
+
+class StaticFile(SyntheticFile):
+    '''In-memory payload, e.g. a recorded HTML page'''
+
+    def __init__(self, body, content_type='text/html; charset=utf-8'):
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        super().__init__(len(body), content_type, etag)
+        self.body = body
+        self.encoded = {}       # Content-Encoding -> compressed body
+
+    def read(self, start, end):
+        yield self.body[start:end]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep test output clean
+
+    def setup(self):
+        super().setup()
+        server = self.server.owner
+        with server._lock:
+            server.connections += 1
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, send_body=True):
+        server = self.server.owner
+        with server.tracking():
+            self.send(server, send_body)
+
+    def send(self, server, send_body):
+        server.hits[self.path] += 1
+        server.log.append((self.command, self.path, self.headers.get('Range')))
+        payload = server.routes.get(self.path)
+        if payload is None:
+            self.send_error(404)
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        failure = server.next_failure(self.path)
+        if failure is not None:
+            status, headers = failure
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == payload.etag:
+            self.send_response(304)
+            self.send_header('ETag', payload.etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if server.compress:
+            body, coding = encode(payload,
+                                  self.headers.get('Accept-Encoding', ''))
+            if coding is not None:
+                self.send_response(200)
+                self.send_header('Content-Type', payload.content_type)
+                self.send_header('Content-Encoding', coding)
+                self.send_header('Vary', 'Accept-Encoding')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+                    server.count_sent(len(body))
+                return
+
+        status, start, end = 200, 0, payload.size - 1
+        requested = re.fullmatch(r'bytes=(\d+)-(\d*)',
+                                 self.headers.get('Range', ''))
+        # A changed file (validator not matching If-Range) is sent whole
+        if_range = self.headers.get('If-Range')
+        if requested and server.ranges and if_range in (None, payload.etag):
+            start = int(requested.group(1))
+            if requested.group(2):
+                end = min(int(requested.group(2)), end)
+            if start >= payload.size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{payload.size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', payload.content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', payload.etag)
+        if server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range',
+                             f'bytes {start}-{end}/{payload.size}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        cut = server.next_drop(self.path)
+        sent = 0
+        started = time.monotonic()
+        for block in payload.read(start, end + 1):
+            if cut is not None and sent + len(block) >= cut:
+                # Send part of the body, then hang up mid-transfer
+                self.wfile.write(block[:cut - sent])
+                server.count_sent(cut)
+                self.close_connection = True
+                return
+            self.wfile.write(block)
+            sent += len(block)
+            server.count_sent(len(block))
+            if server.bandwidth:
+                # Wait until the bytes sent so far are within the cap
+                ahead = sent / server.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+class LocalServer:
+    '''Runs a threaded HTTP server on 127.0.0.1 in the background.
+    Use as a context manager; 'hits' counts requests per path, 'log'
+    records (method, path, Range header) for each of them and 'peak' is the
+    highest number of requests handled at the same time.'''
+
+    def __init__(self, routes=None, ranges=True, latency=0, bandwidth=None,
+                 error_rate=0, seed=0, compress=False):
+        self.routes = {}
+        self.ranges = ranges            # Honour 'Range' request headers
+        self.latency = latency          # Seconds waited before each answer
+        self.bandwidth = bandwidth      # Bytes/second per response, or None
+        self.error_rate = error_rate    # Share of requests answered 503
+        self.compress = compress        # gzip/brotli for text, if asked
+        self.sent = 0
+        self.connections = 0
+        self._random = random.Random(seed)
+        self.hits = collections.Counter()
+        self.log = []
+        self.active = 0
+        self.peak = 0
+        self._drops = collections.defaultdict(collections.deque)
+        self._failures = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        for path, payload in (routes or {}).items():
+            self.add(path, payload)
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+
+    def add(self, path, payload, content_type='text/html; charset=utf-8'):
+        '''Serves 'payload' (bytes, str or SyntheticFile) at 'path'. The
+        content type only applies to bytes and str payloads.'''
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if isinstance(payload, bytes):
+            payload = StaticFile(payload, content_type)
+        self.routes[path] = payload
+
+    def drop(self, path, *cuts):
+        '''Makes the next GET responses for 'path' close the connection after
+        sending the given number of body bytes, one cut per response'''
+        with self._lock:
+            self._drops[path].extend(cuts)
+
+    def next_drop(self, path):
+        with self._lock:
+            if self._drops[path]:
+                return self._drops[path].popleft()
+        return None
+
+    def fail(self, path, status, times=1, headers=None):
+        '''Answers the next 'times' requests for 'path' with 'status' (e.g.
+        429 or 503) and the given headers (e.g. {'Retry-After': '30'})'''
+        with self._lock:
+            self._failures[path].extend([(status, headers or {})] * times)
+
+    def next_failure(self, path):
+        with self._lock:
+            if self._failures[path]:
+                return self._failures[path].popleft()
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 503, {}
+        return None
+
+    def count_sent(self, amount):
+        with self._lock:
+            self.sent += amount
+
+    @contextlib.contextmanager
+    def tracking(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def url(self, path) -> str:
+        host, port = self._httpd.server_address
+        return f'http://{host}:{port}{path}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
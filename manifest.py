@@ -0,0 +1,65 @@
+'''Keeps a record of every installer downloaded so far, so that later runs can
+skip the ones that haven't changed.'''
+
+import json
+import os
+import threading
+
+import storage
+
+MANIFEST_NAME = '.manifest.json'
+
+class Manifest:
+    '''Persistent JSON record, stored in the download folder, of what was
+    downloaded for each app: resolved url, file name, size, validators
+    (ETag, Last-Modified), hashes and the file's modification time, which
+    saves hashing it again while it stays the same. Safe to share between
+    threads.'''
+
+    def __init__(self, path=MANIFEST_NAME):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as manifest_file:
+                self.entries = json.load(manifest_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable manifest {path}; starting afresh.")
+
+    def get(self, name) -> dict:
+        '''Entry recorded for an app name, or None'''
+        with self._lock:
+            return self.entries.get(name)
+
+    def record(self, app):
+        '''Stores what was just downloaded for an App and saves the file'''
+        entry = {'download_url': app.download_url,
+                 'file_name': app.file_name,
+                 'content_length': app.content_length,
+                 'etag': app.etag,
+                 'last_modified': app.last_modified,
+                 'sha256': app.sha256,
+                 'hashes': app.hashes,
+                 'digest': app.digest,
+                 'mtime': os.path.getmtime(app.file_name)}
+        with self._lock:
+            self.entries[app.name] = entry
+            self.save()
+
+    def refresh_mtime(self, app):
+        '''Records the modification time of an App's file, after hashing
+        showed it unchanged (e.g. it was copied or touched), so the next
+        run trusts it without hashing it again'''
+        mtime = os.path.getmtime(app.file_name)
+        with self._lock:
+            entry = self.entries.get(app.name)
+            if entry is not None and entry.get('mtime') != mtime:
+                entry['mtime'] = mtime
+                self.save()
+
+    def save(self):
+        '''Writes the manifest to a temporary file, then swaps it in, so an
+        interrupted run never leaves it half-written'''
+        storage.save_json(self.path, self.entries)
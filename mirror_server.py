@@ -0,0 +1,416 @@
+'''A caching HTTP mirror for a local network: every machine running
+my-apps-downloader.py with '--mirror http://<host>:<port>' gets its
+installers from here, and each installer only comes from the internet once.
+
+Clients ask for 'GET /fetch?url=<download url>'. The mirror answers from its
+store if it has the file, else fetches it from the origin and passes it on
+while it is still arriving. Clients asking for a file already being fetched
+read along the same fetch, so 50 machines asking for the same installer at
+once make one request to its site. Byte ranges are supported, so clients
+can resume and split large files as usual.
+
+Files are stored content-addressed ('blobs/<sha256>'), with an index mapping
+each download url to its blob, validators and last use. After 'ttl' seconds
+an entry is checked again with the origin (a conditional request, so an
+unchanged file isn't downloaded again). Beyond 'max_bytes', the least
+recently used blobs are deleted.
+
+Usage:
+    python mirror_server.py [--port 8080] [--store DIR] [--max-size GB]
+
+It fetches any http(s) url it is asked for: only run it on a trusted
+network.'''
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import classes as cl
+import sessions
+import storage
+
+INDEX_NAME = 'index.json'
+
+class _Fetch:
+    '''One download from the origin in progress. Any number of clients read
+    the file while it is written; 'readers' counts them.'''
+
+    def __init__(self, mirror, url, entry):
+        self.mirror = mirror
+        self.url = url
+        self.entry = entry              # Expired index entry, or None
+        self.path = os.path.join(mirror.blob_dir,
+                                 f'.fetch-{uuid.uuid4().hex}')
+        self.changed = threading.Condition()
+        self.meta = None                # Headers to pass on, once known
+        self.not_modified = False       # Origin says 'entry' is still good
+        self.written = 0
+        self.sha256 = None
+        self.done = False
+        self.error = None
+        self.readers = 0
+
+    def run(self):
+        try:
+            self._download()
+        except Exception as err:
+            with self.changed:
+                self.error = err
+        with self.changed:
+            self.done = True
+            self.changed.notify_all()
+        self.mirror.fetched(self)
+
+    def _download(self):
+        headers = dict(cl.HEADERS, **cl.FILE_HEADERS)
+        if self.entry is not None:
+            headers.update(cl.conditional_headers(self.entry))
+        with self.mirror.upstream.get(self.url, headers=headers,
+                                      stream=True) as response:
+            if response.status_code == 304 and self.entry is not None:
+                with self.changed:
+                    self.not_modified = True
+                    self.changed.notify_all()
+                return
+            response.raise_for_status()
+            length = response.headers.get('Content-Length', '')
+            hasher = hashlib.sha256()
+            # Created before readers are let in, so they can open it
+            with open(self.path, 'wb') as blob:
+                with self.changed:
+                    self.meta = {'size': int(length) if length.isdigit()
+                                 else None,
+                                 'content_type': response.headers.get(
+                                     'Content-Type',
+                                     'application/octet-stream'),
+                                 'etag': response.headers.get('ETag'),
+                                 'last_modified': response.headers.get(
+                                     'Last-Modified')}
+                    self.changed.notify_all()
+                for chunk in response.iter_content(cl.CHUNK_SIZE):
+                    blob.write(chunk)
+                    blob.flush()    # Readers have their own file handle
+                    hasher.update(chunk)
+                    with self.changed:
+                        self.written += len(chunk)
+                        self.changed.notify_all()
+        if self.meta['size'] not in (None, self.written):
+            raise IOError(f"{self.url} ended after {self.written} of "
+                          f"{self.meta['size']} bytes")
+        self.sha256 = hasher.hexdigest()
+
+    def wait_for_headers(self):
+        with self.changed:
+            self.changed.wait_for(lambda: self.meta is not None or
+                                  self.not_modified or self.done)
+
+    def wait_for(self, position) -> int:
+        '''Blocks until the file holds more than 'position' bytes or the
+        fetch is over; returns how many bytes it holds'''
+        with self.changed:
+            self.changed.wait_for(lambda: self.written > position or
+                                  self.done)
+            return self.written
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        mirror = self.server.mirror
+        parts = urlsplit(self.path)
+        url = parse_qs(parts.query).get('url', [''])[0]
+        if parts.path != '/fetch' or \
+           urlsplit(url).scheme not in ('http', 'https'):
+            self.send_error(400, "Expected /fetch?url=<http(s) url>")
+            return
+        entry, fetch = mirror.lookup(url)
+        try:
+            if fetch is not None:
+                fetch.wait_for_headers()
+                if fetch.not_modified:
+                    entry = fetch.entry
+                elif fetch.meta is None:
+                    self.send_error(502, f"Origin failed: {fetch.error}")
+                    return
+                elif fetch.meta['size'] is None:
+                    # Unknown length: wait for the whole file
+                    fetch.wait_for(float('inf'))
+                    if fetch.error is not None:
+                        self.send_error(502, f"Origin failed: {fetch.error}")
+                        return
+                    meta = dict(fetch.meta, size=fetch.written)
+                    self.send_file(fetch.path, meta, 'miss')
+                    return
+                else:
+                    self.send_growing(fetch)
+                    return
+            self.send_file(mirror.blob_path(entry['sha256']), entry, 'hit')
+        finally:
+            if fetch is not None:
+                mirror.release(fetch)
+
+    def requested_range(self, meta) -> tuple:
+        '''(status, start, end) for the Range header, end inclusive, or None
+        if the range can't be satisfied (416 sent). The whole file is sent
+        if an If-Range header matches neither its ETag nor its date.'''
+        size = meta['size']
+        requested = re.fullmatch(r'bytes=(\d+)-(\d*)',
+                                 self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if not requested or if_range is not None and \
+           if_range not in (meta.get('etag'), meta.get('last_modified')):
+            return 200, 0, size - 1
+        start = int(requested.group(1))
+        end = min(int(requested.group(2)), size - 1) if requested.group(2) \
+            else size - 1
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        return 206, start, end
+
+    def send_headers(self, meta, status, start, end, source):
+        self.send_response(status)
+        self.send_header('Content-Type', meta['content_type'])
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range',
+                             f"bytes {start}-{end}/{meta['size']}")
+        for header, key in (('ETag', 'etag'),
+                            ('Last-Modified', 'last_modified')):
+            if meta.get(key):
+                self.send_header(header, meta[key])
+        self.send_header('X-Mirror', source)    # 'hit' or 'miss'
+        self.end_headers()
+
+    def send_file(self, path, meta, source):
+        requested = self.requested_range(meta)
+        if requested is None:
+            return
+        status, start, end = requested
+        self.send_headers(meta, status, start, end, source)
+        with open(path, 'rb') as blob:
+            blob.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = blob.read(min(cl.CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                left -= len(chunk)
+
+    def send_growing(self, fetch):
+        '''Passes on a file that is still arriving from the origin'''
+        requested = self.requested_range(fetch.meta)
+        if requested is None:
+            return
+        status, start, end = requested
+        self.send_headers(fetch.meta, status, start, end, 'miss')
+        position = start
+        with open(fetch.path, 'rb') as blob:
+            while position <= end:
+                available = fetch.wait_for(position)
+                if fetch.error is not None or available <= position:
+                    # Origin failed: hang up, the client will resume
+                    self.close_connection = True
+                    return
+                blob.seek(position)
+                chunk = blob.read(min(available, end + 1) - position)
+                self.wfile.write(chunk)
+                position += len(chunk)
+
+class MirrorServer:
+    '''The mirror, see module docstring. Use as a context manager, or call
+    start() and stop(). 'origin_requests' counts requests to origins.'''
+
+    def __init__(self, store='mirror-store', max_bytes=50 * 2**30,
+                 ttl=24 * 60 * 60, host='0.0.0.0', port=8080, session=None,
+                 clock=time.time):
+        self.store = store
+        self.blob_dir = os.path.join(store, 'blobs')
+        self.max_bytes = max_bytes      # Size of the store before evicting
+        self.ttl = ttl                  # Seconds before checking the origin
+        self.upstream = session or sessions.SessionPool(timeout=30)
+        self.clock = clock
+        self.index = {}                 # Download url -> entry
+        self.fetches = {}               # Download url -> _Fetch in progress
+        self.origin_requests = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        try:
+            with open(os.path.join(store, INDEX_NAME),
+                      encoding='utf-8') as index_file:
+                self.index = json.load(index_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable index in {store}; starting afresh.")
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mirror = self
+        self._thread = None
+
+    def blob_path(self, sha256) -> str:
+        return os.path.join(self.blob_dir, sha256)
+
+    def lookup(self, url) -> tuple:
+        '''(entry, fetch): the index entry to serve, or the fetch to read
+        along (joined, or started if there is none). A fetch must be
+        release()d once read.'''
+        with self._lock:
+            fetch = self.fetches.get(url)
+            if fetch is None:
+                entry = self.index.get(url)
+                if entry is not None and \
+                   not os.path.exists(self.blob_path(entry['sha256'])):
+                    # Blob deleted: a 304 would leave nothing to serve, so
+                    # the origin is asked without validators
+                    del self.index[url]
+                    entry = None
+                if entry is not None and \
+                   self.clock() - entry['fetched'] <= self.ttl:
+                    entry['used'] = self.clock()
+                    return entry, None
+                fetch = self.fetches[url] = _Fetch(self, url, entry)
+                self.origin_requests += 1
+                threading.Thread(target=fetch.run, daemon=True).start()
+            fetch.readers += 1
+            return None, fetch
+
+    def release(self, fetch):
+        with self._lock:
+            fetch.readers -= 1
+            if fetch.done and not fetch.readers:
+                self._settle(fetch)
+
+    def fetched(self, fetch):
+        '''Called by a fetch once the origin is done sending'''
+        with self._lock:
+            if not fetch.readers:
+                self._settle(fetch)
+
+    def _settle(self, fetch):
+        '''Files a finished fetch once nobody is reading it (an open file
+        can't be renamed on Windows). Call under _lock.'''
+        if self.fetches.get(fetch.url) is not fetch:
+            return      # Already settled
+        del self.fetches[fetch.url]
+        now = self.clock()
+        if fetch.not_modified:
+            fetch.entry.update(fetched=now, used=now)
+        elif fetch.error is None:
+            if os.path.exists(self.blob_path(fetch.sha256)):
+                os.remove(fetch.path)   # Same bytes as another url
+            else:
+                os.replace(fetch.path, self.blob_path(fetch.sha256))
+            replaced = self.index.get(fetch.url)
+            self.index[fetch.url] = {'sha256': fetch.sha256,
+                                     'size': fetch.written,
+                                     'content_type': fetch.meta['content_type'],
+                                     'etag': fetch.meta['etag'],
+                                     'last_modified':
+                                         fetch.meta['last_modified'],
+                                     'fetched': now, 'used': now}
+            if replaced is not None:
+                self._remove_unused(replaced['sha256'])
+            self._evict()
+        elif os.path.exists(fetch.path):
+            os.remove(fetch.path)
+        self.save()
+
+    def _evict(self):
+        '''Deletes the least recently used blobs while the store is over
+        'max_bytes'. Call under _lock.'''
+        blobs = {}      # sha256 -> (last use, size)
+        for entry in self.index.values():
+            used, size = blobs.get(entry['sha256'], (0, entry['size']))
+            blobs[entry['sha256']] = (max(used, entry['used']), size)
+        total = sum(size for _, size in blobs.values())
+        for sha256 in sorted(blobs, key=lambda sha256: blobs[sha256][0]):
+            if total <= self.max_bytes:
+                break
+            total -= blobs[sha256][1]
+            self.index = {url: entry for url, entry in self.index.items()
+                          if entry['sha256'] != sha256}
+            self._remove_unused(sha256)
+
+    def _remove_unused(self, sha256):
+        '''Deletes a blob no url in the index points to. Call under _lock.'''
+        if any(entry['sha256'] == sha256 for entry in self.index.values()):
+            return
+        try:
+            os.remove(self.blob_path(sha256))
+        except OSError:
+            pass    # Still being sent (Windows); gone from the index anyway
+
+    def save(self):
+        '''Writes the index to a temporary file, then swaps it in. Call
+        under _lock.'''
+        storage.save_json(os.path.join(self.store, INDEX_NAME), self.index)
+
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        if host == '0.0.0.0':
+            host = '127.0.0.1'
+        return f'http://{host}:{port}'
+
+    def serve(self):
+        '''Runs in the foreground until interrupted (Ctrl+C)'''
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='0.0.0.0',
+                        help="address to listen on (default: all)")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--store', default='mirror-store',
+                        help="folder for the files (default: mirror-store)")
+    parser.add_argument('--max-size', type=float, default=50,
+                        help="GB stored before the least recently used "
+                             "files are deleted (default: 50)")
+    parser.add_argument('--ttl', type=float, default=24,
+                        help="hours before a file is checked again with "
+                             "its site (default: 24)")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    mirror = MirrorServer(args.store, int(args.max_size * 1e9),
+                          args.ttl * 60 * 60, args.host, args.port)
+    print(f"Mirror serving {os.path.abspath(args.store)} on "
+          f"{args.host}:{args.port}; Ctrl+C to stop.")
+    mirror.serve()
@@ -0,0 +1,194 @@
+'''Picks the fastest of several mirrors of an installer, and moves to the
+next one if a transfer slows to a crawl.
+
+An App's 'mirrors' are url templates for the same file on other servers,
+'{path}' standing for the download url's path and '{file_name}' for the
+file name, e.g. 'https://deac-fra.dl.sourceforge.net{path}'. Before the
+download, every candidate (the download url included) is probed at once:
+a short byte range is requested, timing the first byte and the transfer.
+They are then ranked by expected download time, ttfb + size / throughput.
+Mirrors that fail, or announce another file size, are left out.
+
+During the download, a SpeedWatch compares the throughput over the last
+few seconds with what the probe measured. If it collapses, the transfer
+moves on to the next mirror, resuming with a byte range.
+
+Probe results are kept per host in a history (see MirrorHistory) which can
+be saved to a file: later runs rank the mirrors by past speed, and only
+race them again once a record is missing or older than 'max_age'.'''
+
+import collections
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+import storage
+
+HISTORY_NAME = '.mirror-stats.json'
+SAMPLE_SIZE = 256 * 1024    # Bytes downloaded from each mirror when racing
+WATCH_CHUNK = 64 * 1024     # Bytes read per step while a transfer is watched
+WINDOW = 5                  # Seconds of transfer a throughput is taken over
+COLLAPSE = 0.2              # Share of the probed throughput that is too slow
+
+def host_of(url) -> str:
+    return urlsplit(url).netloc.lower()
+
+def candidates(app) -> list:
+    '''The App's download url followed by its mirrors' urls, without
+    duplicates'''
+    parts = urlsplit(app.download_url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    urls = [app.download_url]
+    for template in app.mirrors:
+        url = template.format(path=path, file_name=app.file_name)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def probe(session, url, size=None, sample_size=SAMPLE_SIZE) -> dict:
+    '''Downloads the first 'sample_size' bytes of 'url': {'ttfb': seconds
+    until the headers, 'throughput': bytes per second after them}. None if
+    the request fails or the file isn't 'size' bytes long.'''
+    # Uncompressed, as downloaded (see classes.FILE_HEADERS)
+    headers = {'Range': f'bytes=0-{sample_size - 1}',
+               'Accept-Encoding': 'identity'}
+    start = time.perf_counter()
+    try:
+        with session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            ttfb = time.perf_counter() - start
+            if response.status_code == 206:
+                total = response.headers.get('Content-Range',
+                                             '').split('/')[-1]
+            else:
+                total = response.headers.get('Content-Length', '')
+            if size and total.isdigit() and int(total) != size:
+                return None
+            received = 0
+            for chunk in response.iter_content(WATCH_CHUNK):
+                received += len(chunk)
+                if received >= sample_size:
+                    break
+    except requests.exceptions.RequestException:
+        return None
+    elapsed = max(time.perf_counter() - start - ttfb, 1e-6)
+    return {'ttfb': ttfb, 'throughput': received / elapsed}
+
+def expected_seconds(record, size) -> float:
+    '''Time a download of 'size' bytes should take, going by a probe'''
+    return record['ttfb'] + (size or SAMPLE_SIZE) / record['throughput']
+
+class MirrorHistory:
+    '''Past probe results and download speeds per host, optionally kept in
+    a JSON file. New measurements are averaged in with the older ones.
+    Safe to share between threads.'''
+
+    def __init__(self, max_age=7 * 24 * 60 * 60, clock=time.time):
+        self.max_age = max_age      # Seconds before mirrors are raced again
+        self.clock = clock
+        self.path = None
+        self.hosts = {}             # Host -> {'ttfb', 'throughput', 'updated'}
+        self._lock = threading.Lock()
+
+    def use_file(self, path=HISTORY_NAME):
+        '''Loads the history from 'path' and saves it there from now on'''
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as history_file:
+                self.hosts = json.load(history_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable mirror stats {path}; starting afresh.")
+
+    def record(self, url, ttfb=None, throughput=None):
+        '''Averages a measurement into the url's host record'''
+        with self._lock:
+            entry = self.hosts.setdefault(host_of(url), {})
+            for name, value in (('ttfb', ttfb), ('throughput', throughput)):
+                if value is not None:
+                    entry[name] = value if name not in entry \
+                        else (entry[name] + value) / 2
+            entry['updated'] = self.clock()
+
+    def get(self, url) -> dict:
+        '''Recent record for the url's host, or None'''
+        with self._lock:
+            entry = self.hosts.get(host_of(url))
+            if entry is None or 'ttfb' not in entry or \
+               self.clock() - entry['updated'] > self.max_age:
+                return None
+            return dict(entry)
+
+    def save(self):
+        '''Writes the history to its file, if any, in one step'''
+        if self.path is None:
+            return
+        with self._lock:
+            storage.save_json(self.path, self.hosts)
+
+# Used by every App; main script points it at a file in the download folder
+history = MirrorHistory()
+
+def race(session, urls, size=None) -> dict:
+    '''Probes every url at once; returns url -> probe result for those that
+    answered, recording them in the history'''
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        results = dict(zip(urls, executor.map(
+            lambda url: probe(session, url, size), urls)))
+    for url, record in results.items():
+        if record is not None:
+            history.record(url, **record)
+    history.save()
+    return {url: record for url, record in results.items()
+            if record is not None}
+
+def rank(app) -> list:
+    '''(url, expected throughput) for the App's download url and mirrors,
+    best first. Goes by the history if every host has a recent record, else
+    races them.'''
+    urls = candidates(app)
+    records = {url: history.get(url) for url in urls}
+    if None in records.values():
+        records = race(app.session, urls, app.content_length) or \
+            {app.download_url: None}
+    ordered = sorted(records, key=lambda url: expected_seconds(
+        records[url], app.content_length) if records[url] else 0)
+    return [(url, records[url]['throughput'] if records[url] else None)
+            for url in ordered]
+
+class SpeedWatch:
+    '''Tells when a transfer has been slower than 'floor' bytes per second
+    over its last 'window' seconds. Its first 'window' seconds, while TCP
+    speeds up, are never judged.'''
+
+    def __init__(self, floor, window=None, clock=time.monotonic):
+        self.floor = floor
+        self.window = WINDOW if window is None else window
+        self.clock = clock
+        self.started = clock()
+        self.received = 0
+        self.samples = collections.deque()  # (time, bytes received by then)
+
+    def slow(self, amount) -> bool:
+        '''Counts 'amount' more bytes received; True if the transfer is too
+        slow'''
+        now = self.clock()
+        self.received += amount
+        self.samples.append((now, self.received))
+        while len(self.samples) > 1 and \
+              self.samples[1][0] <= now - self.window:
+            self.samples.popleft()
+        if now - self.started < 2 * self.window:
+            return False
+        since, received = self.samples[0]
+        return now > since and \
+            (self.received - received) / (now - since) < self.floor
+
+    def throughput(self) -> float:
+        '''Average bytes per second since the start'''
+        return self.received / max(self.clock() - self.started, 1e-6)
@@ -1,5 +1,6 @@
 '''Current version: 0.1.1'''
 
+import argparse
 import os
 import sys
 import pathlib
@@ -8,10 +9,123 @@ import pathlib
 # See explanation: https://nitratine.net/blog/post/issues-when-using-auto-py-to-exe/?utm_source=auto_py_to_exe&utm_medium=readme_link&utm_campaign=auto_py_to_exe_help#using-concurrentfutures
 from multiprocessing import freeze_support
 
-# Combines multithreading and progress bars
-from tqdm.contrib.concurrent import thread_map
-
+# Only light modules here: the rest (requests, lxml, tqdm...) is imported
+# once the user has answered the prompt, so that it shows up right away
 import apps
+import catalogue
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Downloads the latest setup files of the apps in "
+                    "catalogue.json (see apps.py)")
+    parser.add_argument('--app', action='append', metavar='NAME',
+                        help="only download this app; repeat for more "
+                             "(default: every app)")
+    parser.add_argument('--tag', action='append',
+                        help="only download the apps with this tag, e.g. "
+                             "'essential'; repeat for more")
+    parser.add_argument('--list', action='store_true',
+                        help="list the apps and their tags, then exit")
+    parser.add_argument('--engine', choices=('threads', 'async'),
+                        default='threads',
+                        help="run downloads on a thread pool (default) or "
+                             "as asyncio coroutines (needs aiohttp)")
+    parser.add_argument('--workers', type=int,
+                        help="transfers in flight at once (default: tuned "
+                             "during the run between 2 and --max-workers "
+                             "threads, or 16 coroutines with --engine async)")
+    parser.add_argument('--max-workers', type=int, default=16,
+                        help="most downloads the tuning may run at once "
+                             "(default: 16)")
+    parser.add_argument('--per-host', type=int,
+                        help="transfers in flight at once to any one host "
+                             "(default: 2, or 4 with --engine async)")
+    parser.add_argument('--host-rate', type=float, default=2,
+                        help="requests per second to any one host, with "
+                             "--engine threads; 0 for no limit (default: 2)")
+    parser.add_argument('--pool-size', type=int, default=10,
+                        help="connections kept open per host (default: 10)")
+    parser.add_argument('--retries', type=int, default=3,
+                        help="retries on connection errors and server "
+                             "errors, with exponential backoff (default: 3)")
+    parser.add_argument('--timeout', type=float, default=10,
+                        help="seconds to wait for a connection or for data "
+                             "(default: 10)")
+    parser.add_argument('--cache-ttl', type=float, default=24,
+                        help="hours a download url found by scraping is "
+                             "reused before the page is scraped again "
+                             "(default: 24)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="find every download url and file size, then "
+                             "print the download plan without downloading")
+    parser.add_argument('--refresh', action='store_true',
+                        help="scrape every page again, ignoring download "
+                             "urls cached by earlier runs")
+    parser.add_argument('--limit', metavar='RATE',
+                        help="cap the bandwidth of all downloads together, "
+                             "in bytes per second, e.g. 500k or 5M; shared "
+                             "by priority (see catalogue.json)")
+    parser.add_argument('--limit-file', metavar='FILE',
+                        help="read the cap from FILE (e.g. '5M', or 'none') "
+                             "and again whenever it changes or the process "
+                             "gets SIGHUP")
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        metavar='N',
+                        help="parse download pages in N worker processes, "
+                             "so downloads running meanwhile keep their "
+                             "speed (default: 0, parse in the threads)")
+    parser.add_argument('--http2', action='store_true',
+                        help="fetch download pages over HTTP/2, one "
+                             "connection per host (needs 'pip install "
+                             "httpx[http2]'); threads engine only")
+    parser.add_argument('--mirror', metavar='URL',
+                        help="get the installers through a LAN mirror "
+                             "(see mirror_server.py), e.g. "
+                             "http://192.168.1.10:8080; falls back on the "
+                             "sites if it fails")
+    parser.add_argument('--report', metavar='FILE',
+                        help="write how long each app spent in each stage, "
+                             "bytes, retries and cache hits to FILE (.json "
+                             "or .csv)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write the same figures to FILE in Prometheus "
+                             "text format")
+    parser.add_argument('--profile-parse', metavar='FILE',
+                        help="profile page parsing with cProfile and save "
+                             "the stats to FILE (slows parsing down)")
+    args = parser.parse_args()
+    if args.limit is not None:
+        import bandwidth
+        try:
+            args.limit = bandwidth.parse_rate(args.limit)
+        except ValueError as err:
+            parser.error(str(err))
+    # Relative to where the command was run, not the download folder
+    for name in ('report', 'metrics', 'profile_parse', 'limit_file'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    return args
+
+def print_connection_stats(stats):
+    '''Shows how many requests each host's connections carried'''
+    print("Connection reuse per host:")
+    for host, counts in sorted(stats.items()):
+        print(f"- {host}: {counts['requests']} request(s) over "
+              f"{counts['connections']} connection(s)")
+
+def print_page_stats(stats):
+    '''Shows what the pages fetched over HTTP/2 (http2.py) cost'''
+    versions = ', '.join(f"{count} over {version}" for version, count
+                         in sorted(stats['versions'].items()))
+    print(f"Pages: {stats['requests']} ({versions or 'none'}), "
+          f"{stats['bytes'] / 1000:.0f} kB received for "
+          f"{stats['decoded'] / 1000:.0f} kB of text")
+
+def print_catalogue():
+    for entry in catalogue.entries():
+        print(f"- {entry.name} ({', '.join(entry.tags)})")
+    for name in apps.extra:
+        print(f"- {name}")
 
 def get_answer():
     while True:
@@ -19,33 +133,59 @@ def get_answer():
         if answer in ('yes', 'y', 'no', 'n'):
             return answer
 
-def download_app(app):
-    '''Scrapes an app's website, finds the link to download the setup files,
-    and downloads it.
-    
-    ----PARAMETER----
-    app: an instance of the App class'''
-    
-    # Check that direct download url isn't already provided
-    if app.download_url == None:
-        app.request_page()
-        app.get_content_type()
-        if app.content_type == 'HTML':
-            app.get_html_links()            
-        elif app.content_type == 'JSON':
-            app.get_json_links()
-        app.get_download_url()
-    app.get_file_name()
-    app.download_installer()
-
 if __name__ == '__main__':
-    # Ask user for confirmation
-    print("The following software will be downloaded:")
-    [print("- " + key) for key in apps.programs.keys()]
-    answer = get_answer()
-    if answer in ('no', 'n'):
+    # Must come first: in a frozen exe, the parse worker processes start
+    # by running this script again
+    freeze_support()
+    args = parse_args()
+    if args.list:
+        print_catalogue()
         sys.exit()
-    
+    selected = apps.selected_names(args.app, args.tag)
+    unknown = {name.lower() for name in args.app or ()} - \
+        {name.lower() for name in selected}
+    if unknown:
+        print("Unknown app(s):", ', '.join(sorted(unknown)), "(see --list)")
+        sys.exit(1)
+    if not selected:
+        print("No app has the tag(s):", ', '.join(args.tag), "(see --list)")
+        sys.exit(1)
+    # Ask user for confirmation (nothing is downloaded in a dry run)
+    if not args.dry_run:
+        print("The following software will be downloaded:")
+        [print("- " + name) for name in selected]
+        answer = get_answer()
+        if answer in ('no', 'n'):
+            sys.exit()
+
+    import bandwidth
+    import mirrors
+    import pipeline
+    import report
+    import resolvers
+    import sessions
+    from concurrency import AIMDController
+    from manifest import Manifest
+    from resolve_cache import ResolveCache
+    from scheduler import HostScheduler
+    sessions.shared.configure(pool_size=args.pool_size, retries=args.retries,
+                              timeout=args.timeout)
+    if args.profile_parse:
+        parse_profiler = report.profile_stage('parse')
+    bandwidth.limiter.set_rate(args.limit)
+    if args.limit_file:
+        # Takes over from --limit once the file exists
+        control = bandwidth.ControlFile(args.limit_file)
+        control.start()
+    parse_pool = None
+    if args.parse_processes:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Spawned rather than forked: forking while threads hold locks can
+        # leave a worker stuck, and spawn is what Windows does anyway
+        parse_pool = ProcessPoolExecutor(
+            args.parse_processes, multiprocessing.get_context('spawn'))
+
     # Where to download the files
     directory = os.path.join('Desktop', 'installers')
     download_path = os.path.join(pathlib.Path.home(), directory)
@@ -55,23 +195,96 @@ if __name__ == '__main__':
         os.mkdir(download_path)
     os.chdir(download_path)
 
-    freeze_support() # keeps concurrent.futures from causing issues
-
-    apps_list = list(apps.programs.values())
+    # Only the selected apps are built
+    apps_list = apps.select(args.app, args.tag)
+    for app in apps_list:
+        app.mirror = args.mirror
     # For testing purposes
     # names = list(apps.programs.keys())[:10]
     # print(names)
     # sample = apps_list[:10]
     # Download everything from apps.py
-    # 6 threads is the sweet spot for performance with 30-40 apps
-    thread_map(download_app, apps_list, max_workers=6, colour='green')
+    # Records what was downloaded so unchanged files are skipped next time
+    manifest = Manifest()
+    # Saves scraping pages again for a while
+    cache = ResolveCache(ttl=args.cache_ttl * 60 * 60, refresh=args.refresh)
+    # GitHub API answers are requested again conditionally, for free
+    resolvers.github.use_cache_file('.github-releases.json')
+    # Apps with mirrors start from the one that was fastest last time
+    mirrors.history.use_file()
+    if args.engine == 'async' and args.dry_run:
+        print("The dry run resolves with the threaded engine; "
+              "--engine async only applies to downloads.")
+    if args.engine == 'async' and not args.dry_run:
+        from async_engine import AsyncEngine
+        engine = AsyncEngine(max_in_flight=args.workers or 16,
+                             per_host=args.per_host or 4,
+                             timeout=args.timeout,
+                             parse_pool=parse_pool)
+        downloaded = engine.run(apps_list, manifest, cache)
+    else:
+        # 6 threads resolve 30-40 apps quickly; downloads are tuned from
+        # the throughput, errors and latency seen, unless --workers is given
+        scheduler = HostScheduler(max_workers=args.workers or 6,
+                                  per_host=args.per_host or 2,
+                                  rate=args.host_rate or None)
+        controller = None
+        if not args.workers:
+            from tqdm import tqdm
+            controller = AIMDController(
+                minimum=min(2, args.max_workers), maximum=args.max_workers,
+                start=min(6, args.max_workers),
+                latency=sessions.shared.latency,
+                reset_latency=sessions.shared.reset_latency, log=tqdm.write)
+        # Every request counts towards its host's rate limit
+        sessions.shared.throttle = scheduler.throttle
+        page_client = None
+        if args.http2:
+            import http2
+            if http2.available():
+                page_client = http2.PageClient(fallback=sessions.shared,
+                                               timeout=args.timeout)
+                for app in apps_list:
+                    app.page_session = page_client
+            else:
+                print("HTTP/2 needs 'pip install httpx[http2]'; "
+                      "fetching pages over HTTP/1.1.")
+        # Resolve every url first, then download the largest files first
+        downloaded = pipeline.run(apps_list, scheduler, manifest, cache,
+                                  dry_run=args.dry_run, parse_pool=parse_pool,
+                                  controller=controller)
+        print_connection_stats(sessions.shared.stats())
+        if page_client is not None:
+            print_page_stats(page_client.stats)
+            page_client.close()
+    if parse_pool is not None:
+        parse_pool.shutdown()
+    if args.limit_file:
+        control.stop()
+    cache.save()   # Keeps track of which entries were used
+    if args.report:
+        report.write_report(args.report, apps_list)
+    if args.metrics:
+        report.write_prometheus(args.metrics, apps_list)
+    if args.profile_parse:
+        parse_profiler.save(args.profile_parse)
+    if args.dry_run:
+        sys.exit()
 
     # Alternative for multithreading (but no progress bar)
     # import concurrent.futures
     # with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
     #     executor.map(download_app, apps.programs.values())
 
-    print("All files successfully downloaded.")
+    skipped = downloaded.count(False)
+    if skipped:
+        print(f"{skipped} file(s) already up to date, not downloaded again.")
+    corrupt = downloaded.count(None)
+    if corrupt:
+        print(f"{corrupt} file(s) didn't match their published checksum and "
+              "were moved to the 'quarantine' folder.")
+    else:
+        print("All files successfully downloaded.")
 
     while True:
         open_folder = input("The program will now exit. Would you like to open the destination folder? (y/n) ").strip().lower()
@@ -0,0 +1,146 @@
+'''Runs the downloads in two phases, so that slow page fetches never hold up
+a worker that could be moving bytes:
+
+1. resolve: every app's download url is found (resolver backend, cache or
+   scraping) and its size asked for with a HEAD request, all concurrently.
+   Apps given a download_url in apps.py skip the scraping and only get the
+   HEAD request.
+2. download: files are started largest first ("longest processing time
+   first" scheduling), so that no big file starts last and drags out the
+   end of the run. Apps with a higher priority (see bandwidth.py) go
+   before the others.
+
+Pages can be parsed in a process pool ('parse_pool', e.g. a
+ProcessPoolExecutor) rather than in the worker threads: only the page bytes
+and the pattern go over, only the links and download url come back, and
+the threads moving bytes no longer wait on the GIL while a page is parsed.'''
+
+from functools import partial
+
+import requests
+
+import classes as cl
+import resolvers
+
+def find_download_url(app, parse_pool=None):
+    '''Asks the resolver backend for the app's host if there is one (e.g.
+    the GitHub API), else scrapes the app's website to find the link to
+    download the setup file. HTML pages are parsed on 'parse_pool' if
+    given.'''
+    resolver = resolvers.for_app(app)
+    if resolver is not None and resolver.resolve(app):
+        return
+    app.request_page()
+    app.get_content_type()
+    if app.content_type == 'HTML' and parse_pool is not None:
+        app.parse_in(parse_pool)
+        return
+    if app.content_type == 'HTML':
+        app.get_html_links()
+    elif app.content_type == 'JSON':
+        app.get_json_links()
+    app.get_download_url()
+
+def resolve_app(app, cache=None, parse_pool=None):
+    '''Phase 1 for one app: finds its download url, file name and size,
+    and ranks its mirrors if it has any'''
+    # Check that direct download url isn't already provided
+    if app.download_url == None:
+        app.download_url = cache.get(app) if cache is not None else None
+        app.from_cache = app.download_url is not None
+        if not app.from_cache:
+            find_download_url(app, parse_pool)
+            if cache is not None:
+                cache.put(app)
+    app.get_file_name()
+    app.fetch_checksum()
+    if app.content_length is None:
+        app.probe_download()
+    # After the probe: mirrors announcing another size are left out
+    if app.mirrors and not app.mirror:
+        app.pick_source()
+    return app
+
+def download_app(app, manifest=None, cache=None, parse_pool=None):
+    '''Scrapes an app's website, finds the link to download the setup files,
+    and downloads it, unless the manifest shows the file on disk is still
+    current. Returns True if the file was downloaded, False if it was up to
+    date and None if it failed its checksum. Phase 1 is skipped if it
+    already ran for the app.
+
+    ----PARAMETERS----
+    app: an instance of the App class
+    manifest: (optional) a Manifest of earlier downloads
+    cache: (optional) a ResolveCache of download urls found earlier
+    parse_pool: (optional) an executor to parse download pages on'''
+    if app.file_name == None:
+        resolve_app(app, cache, parse_pool)
+    if manifest is not None and app.is_up_to_date(manifest.get(app.name)):
+        manifest.refresh_mtime(app)
+        app.stats['skipped'] = True
+        return False
+    try:
+        fetch_installer(app, cache, parse_pool)
+    except cl.ChecksumMismatch as err:
+        print(err)
+        return None
+    if manifest is not None:
+        manifest.record(app)
+    return True
+
+def fetch_installer(app, cache=None, parse_pool=None):
+    '''Downloads the installer, finding the url again if a cached one went
+    stale'''
+    try:
+        app.download_installer()
+    except requests.exceptions.HTTPError:
+        if not app.from_cache:
+            raise
+        # The cached link went stale (e.g. replaced by a newer version)
+        find_download_url(app, parse_pool)
+        cache.put(app)
+        app.get_file_name()
+        app.fetch_checksum()
+        app.download_installer()
+
+def size_of(app) -> int:
+    '''Sort key: announced size, unknown sizes counting as 0'''
+    return app.content_length or 0
+
+def download_order(app) -> tuple:
+    '''Sort key: higher priorities, then larger files, first'''
+    return app.priority, size_of(app)
+
+def plan(apps) -> list:
+    '''Download order for resolved apps: by priority, then largest files
+    first'''
+    return sorted(apps, key=download_order, reverse=True)
+
+def print_plan(apps):
+    '''Shows what would be downloaded, in which order'''
+    total = sum(size_of(app) for app in apps)
+    print(f"{'#':>3}  {'App':<32}{'Size (MB)':>10}  Download url")
+    for number, app in enumerate(apps, start=1):
+        size = f'{app.content_length / 1e6:.1f}' \
+            if app.content_length else '?'
+        print(f"{number:>3}  {app.name[:31]:<32}{size:>10}  "
+              f"{app.download_url}")
+    print(f"Total: {total / 1e6:.1f} MB (unknown sizes not included)")
+
+def run(apps, scheduler, manifest=None, cache=None, dry_run=False,
+        parse_pool=None, controller=None) -> list:
+    '''Resolves every app, then downloads them largest first, both phases
+    on 'scheduler' (see scheduler.py), pages being parsed on 'parse_pool' if
+    given. A 'controller' (see concurrency.py) tunes how many downloads run
+    at once. Returns download_app's result for each app, in download order;
+    with 'dry_run', prints the plan instead and returns an empty list.'''
+    scheduler.run(partial(resolve_app, cache=cache, parse_pool=parse_pool),
+                  apps, desc='Resolving')
+    ordered = plan(apps)
+    if dry_run:
+        print_plan(ordered)
+        return []
+    return scheduler.run(partial(download_app, manifest=manifest,
+                                 cache=cache, parse_pool=parse_pool),
+                         ordered, key=download_order, desc='Downloading',
+                         controller=controller)
@@ -0,0 +1,136 @@
+'''Run report: where each app's time went, how many bytes it received and
+how fast, how many retries it needed and whether its download url came
+from the cache. Built from the 'stats' each App keeps (see classes.py).
+
+Stages, in seconds (each counted in one stage only, see classes.timed):
+- api: asking a resolver backend, e.g. the GitHub API (see resolvers.py)
+- page: fetching the download page; 'ttfb' is the part until its headers
+  came in (connecting, TLS and server time)
+- parse: extracting the page's links
+- match: picking the download url among them
+- probe: the HEAD request asking for the file size, and racing mirrors
+- checksum: fetching the published checksum file, if any
+- download: the transfer itself, retries included
+
+The report is written as JSON or CSV, and optionally as a Prometheus text
+format file (e.g. for node_exporter's textfile collector).
+profile_stage() runs every call of a stage under cProfile.'''
+
+import cProfile
+import csv
+import json
+import pstats
+import threading
+
+import classes as cl
+import storage
+
+STAGES = ('api', 'page', 'parse', 'match', 'probe', 'checksum', 'download')
+
+# Keys of app_row(), in order: the CSV header, even with no apps
+COLUMNS = ('app', 'download_url', 'cache_hit', 'skipped', 'bytes', 'retries',
+           'ttfb_seconds') + tuple(f'{stage}_seconds' for stage in STAGES) + \
+          ('total_seconds', 'throughput')
+
+def app_row(app) -> dict:
+    '''One flat report row for an App'''
+    seconds = app.stats['seconds']
+    row = {'app': app.name, 'download_url': app.download_url,
+           'cache_hit': app.from_cache, 'skipped': app.stats['skipped'],
+           'bytes': app.stats['bytes'], 'retries': app.stats['retries'],
+           'ttfb_seconds': app.stats['ttfb']}
+    for stage in STAGES:
+        row[f'{stage}_seconds'] = seconds.get(stage, 0.0)
+    row['total_seconds'] = sum(seconds.values())
+    # Bytes per second while downloading
+    row['throughput'] = app.stats['bytes'] / seconds['download'] \
+        if app.stats['bytes'] and seconds.get('download') else None
+    return row
+
+def totals(rows) -> dict:
+    '''Sums over every app of a report'''
+    summed = {'apps': len(rows),
+              'cache_hits': sum(row['cache_hit'] for row in rows),
+              'skipped': sum(row['skipped'] for row in rows),
+              'bytes': sum(row['bytes'] for row in rows),
+              'retries': sum(row['retries'] for row in rows)}
+    for stage in STAGES:
+        summed[f'{stage}_seconds'] = sum(row[f'{stage}_seconds']
+                                         for row in rows)
+    return summed
+
+def write_report(path, apps):
+    '''Writes one row per app to 'path': CSV if its name ends in '.csv',
+    else JSON (with totals). No apps gives a header or empty totals.'''
+    rows = [app_row(app) for app in apps]
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w', encoding='utf-8') as report_file:
+            json.dump({'apps': rows, 'totals': totals(rows)}, report_file,
+                      indent=2)
+
+def _label(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+                     .replace('\n', r'\n')
+
+def prometheus_text(apps) -> str:
+    '''The apps' stats as Prometheus text format metrics'''
+    metrics = [('stage_seconds', "Seconds spent per app and stage"),
+               ('bytes', "Bytes received while downloading"),
+               ('retries', "Requests retried after an error"),
+               ('cache_hit', "1 if the download url came from the cache"),
+               ('throughput_bytes_per_second', "Download speed")]
+    samples = {name: [] for name, _ in metrics}
+    for app in apps:
+        row = app_row(app)
+        label = f'app="{_label(app.name)}"'
+        for stage in STAGES:
+            samples['stage_seconds'].append(
+                (f'{label},stage="{stage}"', row[f'{stage}_seconds']))
+        samples['bytes'].append((label, row['bytes']))
+        samples['retries'].append((label, row['retries']))
+        samples['cache_hit'].append((label, int(row['cache_hit'])))
+        if row['throughput'] is not None:
+            samples['throughput_bytes_per_second'].append(
+                (label, row['throughput']))
+    lines = []
+    for name, description in metrics:
+        lines.append(f'# HELP my_apps_{name} {description}')
+        lines.append(f'# TYPE my_apps_{name} gauge')
+        lines.extend(f'my_apps_{name}{{{labels}}} {value}'
+                     for labels, value in samples[name])
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path, apps):
+    '''Writes prometheus_text() to 'path' in one step, so a collector never
+    reads half a file'''
+    storage.write_text(path, prometheus_text(apps))
+
+class StageProfiler:
+    '''cProfile profiler shared by the threads running a stage. A profiler
+    only follows one thread, so profiled calls take turns: only switch it
+    on to investigate.'''
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    def runcall(self, func, *args, **kwargs):
+        with self._lock:
+            return self.profile.runcall(func, *args, **kwargs)
+
+    def save(self, path, top=15):
+        '''Dumps the stats to 'path' (for pstats or snakeviz) and prints the
+        'top' functions by cumulative time'''
+        self.profile.dump_stats(path)
+        pstats.Stats(path).sort_stats('cumulative').print_stats(top)
+
+def profile_stage(stage) -> StageProfiler:
+    '''Profiles every call of an App stage (e.g. 'parse') from now on'''
+    profiler = StageProfiler()
+    cl.PROFILERS[stage] = profiler
+    return profiler
@@ -0,0 +1,69 @@
+'''Remembers the download urls found by scraping, so pages are only scraped
+again once their entry has expired.'''
+
+import json
+import threading
+import time
+
+import storage
+
+CACHE_NAME = '.resolve-cache.json'
+
+def cache_key(app) -> str:
+    '''Entries are only reused for the same app, page and pattern'''
+    return '\n'.join((app.name, app.download_page, app.pattern.pattern))
+
+class ResolveCache:
+    '''Persistent JSON store of resolved download urls, kept in the download
+    folder. Entries expire after 'ttl' seconds; beyond 'max_entries', the
+    least recently used ones are dropped. With 'refresh', stored entries are
+    ignored (but replaced by fresh ones). Safe to share between threads.'''
+
+    def __init__(self, path=CACHE_NAME, ttl=24 * 60 * 60, max_entries=200,
+                 refresh=False, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.clock = clock
+        self.entries = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                self.entries = json.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable cache {path}; starting afresh.")
+
+    def get(self, app) -> str:
+        '''Cached download url for an App, or None if missing or expired'''
+        if self.refresh:
+            return None
+        key = cache_key(app)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if self.clock() - entry['resolved'] > self.ttl:
+                del self.entries[key]
+                return None
+            entry['used'] = self.clock()
+            return entry['download_url']
+
+    def put(self, app):
+        '''Stores an App's freshly resolved download url and saves the file'''
+        now = self.clock()
+        with self._lock:
+            self.entries[cache_key(app)] = {'download_url': app.download_url,
+                                            'resolved': now, 'used': now}
+            if len(self.entries) > self.max_entries:
+                by_use = sorted(self.entries,
+                                key=lambda key: self.entries[key]['used'])
+                for key in by_use[:len(self.entries) - self.max_entries]:
+                    del self.entries[key]
+            self.save()
+
+    def save(self):
+        '''Writes the cache to a temporary file, then swaps it in'''
+        storage.save_json(self.path, self.entries)
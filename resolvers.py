@@ -0,0 +1,161 @@
+'''Resolver backends: ways of finding an app's download url other than
+scraping its download page, chosen by the page's host.
+
+A resolver answers for the hosts listed in its 'hosts' attribute. Its
+resolve() method fills in the App's download_url (and, when the source
+publishes them, its size and digest) and returns True, or returns False to
+fall back on scraping. The HTTP request is split out (api_request and
+resolve_from) so the async engine can send it itself.
+
+Add a backend by subclassing Resolver and passing an instance to
+register().'''
+
+import abc
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import classes as cl
+import storage
+
+class Resolver(abc.ABC):
+    '''Base class for resolver backends: subclasses implement api_request
+    and resolve_from'''
+
+    hosts = ()
+
+    @abc.abstractmethod
+    def api_request(self, app) -> tuple:
+        '''(url, headers) of the request to send, or None to skip'''
+
+    @abc.abstractmethod
+    def resolve_from(self, app, status_code, headers, data) -> bool:
+        '''Finds the download url in the answer to api_request. 'data' is
+        the decoded JSON body, or None if there wasn't one.'''
+
+    def resolve(self, app) -> bool:
+        '''Sends api_request through the App's session and resolves'''
+        request = self.api_request(app)
+        if request is None:
+            return False
+        url, headers = request
+        start = time.perf_counter()
+        try:
+            response = app.session.get(url, headers=headers)
+            cl.RateLimited.check(response)
+            data = response.json() if response.status_code == 200 else None
+        except (requests.exceptions.RequestException, cl.RateLimited,
+                ValueError) as err:
+            print(f"Falling back on scraping for {app.name}:", err)
+            return False
+        finally:
+            app.add_time('api', time.perf_counter() - start)
+        return self.resolve_from(app, response.status_code,
+                                 response.headers, data)
+
+class GitHubResolver(Resolver):
+    '''Asks the GitHub Releases API, rather than the heavy releases page,
+    for the newest stable release with an asset matching the App's pattern.
+    The asset's size and SHA-256 digest come with it.
+
+    Sends a token from the GITHUB_TOKEN environment variable if set (more
+    requests allowed per hour). Answers are kept, in a file if
+    use_cache_file() was called, and requested again conditionally: an
+    unchanged release list costs no rate limit.'''
+
+    hosts = ('github.com', 'www.github.com')
+
+    def __init__(self, api_url='https://api.github.com', token=None,
+                 per_page=10):
+        self.api_url = api_url.rstrip('/')
+        self.token = token or os.environ.get('GITHUB_TOKEN')
+        self.per_page = per_page            # Releases looked at, newest first
+        self.path = None
+        self.answers = {}                   # API url -> {'etag', 'releases'}
+        self._lock = threading.Lock()
+
+    def use_cache_file(self, path):
+        '''Loads earlier answers from 'path' and saves new ones to it'''
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as cache_file:
+                self.answers = json.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"Ignoring unreadable cache {path}; starting afresh.")
+
+    def releases_url(self, app) -> str:
+        owner, repo = urlsplit(app.download_page).path.strip('/').split('/')[:2]
+        return f'{self.api_url}/repos/{owner}/{repo}/releases' \
+               f'?per_page={self.per_page}'
+
+    def api_request(self, app) -> tuple:
+        url = self.releases_url(app)
+        headers = {'Accept': 'application/vnd.github+json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        with self._lock:
+            if url in self.answers:
+                headers['If-None-Match'] = self.answers[url]['etag']
+        return url, headers
+
+    def resolve_from(self, app, status_code, headers, data) -> bool:
+        url = self.releases_url(app)
+        with self._lock:
+            if status_code == 200 and isinstance(data, list):
+                self.answers[url] = {'etag': headers.get('ETag'),
+                                     'releases': self._trim(data)}
+                self.save()
+            elif status_code != 304 or url not in self.answers:
+                print(f"GitHub API answered {status_code} for {app.name}; "
+                      "falling back on scraping.")
+                return False
+            releases = self.answers[url]['releases']
+
+        for release in releases:
+            if release['draft'] or release['prerelease']:
+                continue
+            for asset in release['assets']:
+                if app.pattern.search(asset['url']):
+                    app.download_url = asset['url']
+                    app.content_length = asset['size']
+                    app.digest = asset['digest'] or app.digest
+                    return True
+        return False
+
+    @staticmethod
+    def _trim(releases) -> list:
+        '''Keeps only what resolving needs; full answers are large'''
+        return [{'tag': release.get('tag_name'),
+                 'draft': release.get('draft', False),
+                 'prerelease': release.get('prerelease', False),
+                 'assets': [{'url': asset['browser_download_url'],
+                             'size': asset.get('size'),
+                             'digest': asset.get('digest')}
+                            for asset in release.get('assets', [])]}
+                for release in releases]
+
+    def save(self):
+        '''Writes the answers to the cache file, if any. Call under _lock.'''
+        if self.path is None:
+            return
+        storage.save_json(self.path, self.answers)
+
+RESOLVERS = {}      # Host -> resolver
+
+def register(resolver):
+    '''Makes 'resolver' answer for the hosts it lists'''
+    for host in resolver.hosts:
+        RESOLVERS[host] = resolver
+
+def for_app(app) -> Resolver:
+    '''Resolver for the host of an App's download page, or None'''
+    return RESOLVERS.get(urlsplit(app.download_page).netloc.lower())
+
+github = GitHubResolver()
+register(github)
@@ -0,0 +1,222 @@
+'''Runs the app downloads on a thread pool while staying polite to each site.
+
+Jobs are grouped by host and handed out round-robin across hosts, so that
+while one site is at its limit the workers keep busy with the others. Each
+host gets:
+- a cap on jobs running at once ('per_host')
+- a token bucket capping requests per second ('rate', bursts of 'burst')
+- a pause whenever it answers 429 Too Many Requests: as long as its
+  Retry-After header says, or an exponential backoff if it doesn't. The job
+  that got the 429 goes back to the front of its host's queue.
+
+The number of jobs running at once is either fixed ('max_workers') or, if
+run() is given a controller (see concurrency.py), tuned during the run from
+the bytes the apps receive and the errors they meet.
+
+The clock and sleep function can be swapped for fake ones in tests.'''
+
+import collections
+import threading
+import time
+from concurrent import futures
+from urllib.parse import urlsplit
+
+from classes import RateLimited
+
+def host_of(url) -> str:
+    return urlsplit(url).netloc.lower()
+
+def app_host(app) -> str:
+    '''Host an App's first request goes to'''
+    return host_of(app.download_url or app.download_page)
+
+class TokenBucket:
+    '''Allows 'rate' events per second on average, in bursts of up to
+    'capacity' events'''
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        '''Seconds until a token is available (0 if one is now)'''
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+class HostScheduler:
+    '''Runs a function over a list of App instances, see module docstring'''
+
+    def __init__(self, max_workers=6, per_host=2, rate=None, burst=1,
+                 backoff=5, max_attempts=5, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.max_workers = max_workers      # Jobs running at once, overall
+        self.per_host = per_host            # Jobs running at once, per host
+        self.rate = rate                    # Requests/second per host or None
+        self.burst = burst                  # Requests allowed back to back
+        self.backoff = backoff              # Seconds paused after a bare 429
+        self.max_attempts = max_attempts    # Tries per job before giving up
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._paused_until = {}
+        self._lock = threading.Lock()
+        # Host whose token the running job's first request already has
+        self._local = threading.local()
+
+    def _bucket(self, host) -> TokenBucket:
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst,
+                                              self.clock)
+        return self._buckets[host]
+
+    def _delay(self, host, tokens=True) -> float:
+        '''Seconds until 'host' may receive a request (or, if not 'tokens',
+        until its pause is over). Call under _lock.'''
+        delay = self._paused_until.get(host, 0) - self.clock()
+        if self.rate and tokens:
+            delay = max(delay, self._bucket(host).delay())
+        return max(0.0, delay)
+
+    def throttle(self, url):
+        '''Blocks until the url's host may receive another request. Meant to
+        be set as a SessionPool's 'throttle', so every request counts. A
+        job's first request to its host uses the token taken when the job
+        was started.'''
+        host = host_of(url)
+        prepaid = getattr(self._local, 'host', None) == host
+        if prepaid:
+            self._local.host = None
+        while True:
+            with self._lock:
+                delay = self._delay(host, tokens=not prepaid)
+                if not delay:
+                    if self.rate and not prepaid:
+                        self._bucket(host).take()
+                    return
+            self.sleep(delay)
+
+    def _job(self, func, app, host):
+        '''Runs func(app) with the token taken for it in _dispatch'''
+        self._local.host = host if self.rate else None
+        try:
+            return func(app)
+        finally:
+            self._local.host = None
+
+    def pause(self, host, seconds):
+        '''Sends no more requests to 'host' for a while'''
+        with self._lock:
+            self._paused_until[host] = max(self._paused_until.get(host, 0),
+                                           self.clock() + seconds)
+
+    def run(self, func, apps, key=None, desc=None, progress=True,
+            controller=None) -> list:
+        '''Calls func(app) for every app and returns the results in the same
+        order, with a progress bar labelled 'desc'. Hosts take turns, unless
+        'key' is given: then, among the hosts free to start a job, the one
+        whose next app has the highest key(app) goes first. An exception
+        other than RateLimited, or RateLimited more than 'max_attempts'
+        times, is raised. With a 'controller', it sets how many jobs run at
+        once instead of 'max_workers'.'''
+        from tqdm import tqdm
+        queues = collections.OrderedDict()
+        for index, app in enumerate(apps):
+            queues.setdefault(app_host(app), collections.deque()).append(
+                (index, app))
+        results = [None] * len(apps)
+        attempts = collections.Counter()
+        running = {}                            # Future -> (index, app, host)
+        busy = collections.Counter()            # Running jobs per host
+        limit = self.max_workers if controller is None else controller.limit
+        threads = self.max_workers if controller is None \
+            else controller.maximum
+        if controller is not None:
+            controller.start()
+
+        with futures.ThreadPoolExecutor(threads) as executor, \
+             tqdm(total=len(apps), desc=desc, colour='green',
+                  disable=not progress) as bar:
+            while queues or running:
+                if controller is not None:
+                    limit = controller.update(
+                        sum(app.stats['bytes'] for app in apps),
+                        sum(app.stats['retries'] for app in apps) +
+                        sum(attempts.values()), waiting=bool(queues))
+                wait = self._dispatch(executor, func, queues, running, busy,
+                                      key, limit)
+                if controller is not None:
+                    # Wake up for the controller's next decision
+                    wait = min(wait or controller.interval,
+                               controller.interval)
+                if not running:
+                    # Every remaining host is paused or out of tokens
+                    self.sleep(wait)
+                    continue
+                done, _ = futures.wait(running, timeout=wait,
+                                       return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    index, app, host = running.pop(future)
+                    busy[host] -= 1
+                    error = future.exception()
+                    if isinstance(error, RateLimited) and \
+                       attempts[index] + 1 < self.max_attempts:
+                        attempts[index] += 1
+                        self.pause(host_of(error.url), error.retry_after or
+                                   self.backoff * 2 ** (attempts[index] - 1))
+                        queues.setdefault(host, collections.deque()) \
+                              .appendleft((index, app))
+                        continue
+                    if error is not None:
+                        raise error
+                    results[index] = future.result()
+                    bar.update()
+        return results
+
+    def _dispatch(self, executor, func, queues, running, busy, key, limit):
+        '''Starts queued jobs until 'limit' jobs are running, as far as the
+        hosts' limits allow, taking turns between hosts, or going by 'key'
+        if given. A job only starts once its host has a token, which it
+        takes, so workers don't sit waiting in throttle() while other hosts
+        could use them. Returns the seconds until a blocked host frees up
+        (None if no host is waiting on time).'''
+        while len(running) < limit:
+            wait = None
+            ready = []
+            with self._lock:
+                for host in queues:
+                    if busy[host] >= self.per_host:
+                        continue
+                    delay = self._delay(host)
+                    if delay:
+                        wait = delay if wait is None else min(wait, delay)
+                    else:
+                        ready.append(host)
+                if not ready:
+                    return wait
+                # Ties go to the host whose turn it is
+                host = ready[0] if key is None else \
+                    max(ready, key=lambda host: key(queues[host][0][1]))
+                if self.rate:
+                    self._bucket(host).take()
+            index, app = queues[host].popleft()
+            if not queues[host]:
+                del queues[host]
+            else:
+                queues.move_to_end(host)    # Other hosts go next
+            running[executor.submit(self._job, func, app, host)] = \
+                (index, app, host)
+            busy[host] += 1
+        return None
@@ -0,0 +1,108 @@
+'''Shared HTTP sessions, one per host, so that apps downloaded from the same
+site reuse its connections (and skip the TCP and TLS handshakes) instead of
+each opening their own.'''
+
+import collections
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class SessionPool:
+    '''Thread-safe set of requests.Session objects keyed by host, all sharing
+    the same connection pool size, retry policy and timeout.
+
+    Offers get() and head() like a Session, so it can stand in for one:
+    each request goes through the session of the host it is addressed to.
+    If 'throttle' is set (see scheduler.py), it is called with the url
+    before each request and may block to slow down.'''
+
+    def __init__(self, pool_size=10, retries=3, backoff=0.5, timeout=10):
+        self.configure(pool_size, retries, backoff, timeout)
+        self.throttle = None
+        self._latency = {}              # Host -> averaged seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pool_size=10, retries=3, backoff=0.5, timeout=10):
+        '''Changes the settings; applies to hosts not contacted yet'''
+        self.pool_size = pool_size  # Connections kept open per host
+        self.retries = retries      # Retries on connection errors and 5xx
+        self.backoff = backoff      # Seconds before 1st retry, then doubled
+        self.timeout = timeout      # Seconds to connect, or between bytes
+
+    def session_for(self, url) -> requests.Session:
+        '''Session shared by every request to the url's host'''
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = self._new_session()
+            return self._sessions[host]
+
+    def _new_session(self) -> requests.Session:
+        # 429s are left to the caller, which knows how to slow down
+        retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=('GET', 'HEAD'), raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', False)    # As requests does
+        return self.request('HEAD', url, **kwargs)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        if self.throttle is not None:
+            self.throttle(url)
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session_for(url).request(method, url, **kwargs)
+        if method == 'GET':
+            # HEADs answer sooner than GETs, so they would skew the average
+            host = urlsplit(url).netloc.lower()
+            elapsed = response.elapsed.total_seconds()
+            with self._lock:
+                previous = self._latency.get(host)
+                self._latency[host] = elapsed if previous is None \
+                    else 0.8 * previous + 0.2 * elapsed
+        return response
+
+    def latency(self) -> dict:
+        '''Recent seconds until response headers of GETs, averaged per host
+        contacted since the last reset_latency(); see concurrency.py'''
+        with self._lock:
+            return dict(self._latency)
+
+    def reset_latency(self):
+        '''Forgets the latencies measured so far'''
+        with self._lock:
+            self._latency.clear()
+
+    def stats(self) -> dict:
+        '''Requests sent and connections opened so far, per host contacted
+        (redirect targets included). Fewer connections than requests means
+        connections were reused.'''
+        counts = collections.defaultdict(lambda: {'requests': 0,
+                                                  'connections': 0})
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    counts[pool.host]['requests'] += pool.num_requests
+                    counts[pool.host]['connections'] += pool.num_connections
+        return dict(counts)
+
+# Used by every App unless given a pool of its own
+shared = SessionPool()
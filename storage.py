@@ -0,0 +1,18 @@
+'''Files kept between runs (manifest, caches, histories, metrics), written
+to a temporary file then swapped in, so an interrupted run or a concurrent
+reader never sees one half-written.'''
+
+import json
+import os
+
+def write_text(path, text):
+    '''Replaces the file at 'path' with 'text', in one step'''
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as temp_file:
+        temp_file.write(text)
+    os.replace(temp_path, path)
+
+def save_json(path, data):
+    '''Replaces the file at 'path' with 'data' as indented JSON, in one
+    step'''
+    write_text(path, json.dumps(data, indent=2, sort_keys=True))
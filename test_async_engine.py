@@ -0,0 +1,72 @@
+'''Offline tests for async_engine.py, run against local_server.py'''
+
+import hashlib
+import re
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+import classes as cl
+from async_engine import AsyncEngine
+from local_server import LocalServer, SyntheticFile
+from manifest import Manifest
+from resolve_cache import ResolveCache
+
+def test_scrapes_and_downloads_with_limits(tmp_path, monkeypatch):
+    payloads = {f'/files/setup-{n}.exe': SyntheticFile(1024 * 1024 + n)
+                for n in range(8)}
+    monkeypatch.chdir(tmp_path)
+    with LocalServer(payloads) as server:
+        server.add('/download', '<a href="/files/other.zip">zip</a>'
+                                '<a href="/files/setup-0.exe">latest</a>')
+        server.drop('/files/setup-0.exe', 300000)
+        apps = [cl.App('Scraped', server.url('/download'),
+                       re.compile(r'setup-\d\.exe'), base_url=server.url(''))]
+        apps += [cl.App(f'Direct {n}', server.url(path), re.compile('.+'),
+                        download_url=server.url(path))
+                 for n, path in enumerate(list(payloads)[1:], start=1)]
+        for app in apps:
+            app.retry_delay = 0
+        manifest = Manifest()
+        downloaded = AsyncEngine(max_in_flight=8, per_host=3).run(apps,
+                                                                  manifest)
+        assert server.peak <= 3
+
+        assert downloaded == [True] * 8
+        for app in apps:
+            payload = payloads['/files/' + app.file_name]
+            assert (tmp_path / app.file_name).read_bytes() == \
+                payload.content()
+            assert manifest.get(app.name)['sha256'] == \
+                hashlib.sha256(payload.content()).hexdigest()
+
+        # Second run: everything is current
+        again = [cl.App(app.name, app.download_page, app.pattern,
+                        base_url=app.base_url,
+                        download_url=app.download_url) for app in apps]
+        assert AsyncEngine().run(again, Manifest()) == [False] * 8
+
+def test_stale_cached_url_is_resolved_again(tmp_path, monkeypatch):
+    payload = SyntheticFile(200000)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/files/setup-2.exe': payload}) as server:
+        server.add('/download', '<a href="/files/setup-2.exe">latest</a>')
+        app = cl.App('Scraped', server.url('/download'),
+                     re.compile(r'setup-\d\.exe'), base_url=server.url(''))
+        cache = ResolveCache()
+        # Cached on an earlier run, since replaced by a newer version
+        app.download_url = server.url('/files/setup-1.exe')
+        cache.put(app)
+        app.download_url = None
+        assert AsyncEngine().run([app], cache=cache) == [True]
+    assert (tmp_path / 'setup-2.exe').read_bytes() == payload.content()
+    assert cache.get(app) == server.url('/files/setup-2.exe')
+
+def test_unknown_page_type_fails_clearly(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer() as server:
+        server.add('/download', 'Moved elsewhere', 'text/plain')
+        app = cl.App('Plain', server.url('/download'), re.compile(r'.+'))
+        with pytest.raises(ValueError, match='neither a file nor'):
+            AsyncEngine().run([app])
@@ -0,0 +1,117 @@
+'''Tests for the bandwidth limiter (bandwidth.py), partly run against
+local_server.py'''
+
+import os
+import re
+import signal
+import threading
+import time
+
+import pytest
+
+import bandwidth
+import classes as cl
+from local_server import LocalServer, SyntheticFile
+from sessions import SessionPool
+
+@pytest.fixture
+def limiter(monkeypatch):
+    shared = bandwidth.BandwidthLimiter()
+    monkeypatch.setattr(bandwidth, 'limiter', shared)
+    return shared
+
+def test_parse_rate():
+    assert bandwidth.parse_rate('500k') == 500000
+    assert bandwidth.parse_rate('2.5M') == 2500000
+    assert bandwidth.parse_rate(' 1GB/s\n') == 1e9
+    assert bandwidth.parse_rate('none') is None
+    assert bandwidth.parse_rate('0') is None
+    with pytest.raises(ValueError):
+        bandwidth.parse_rate('fast')
+
+def test_rate_is_shared_by_weight():
+    now = [0.0]
+    limiter = bandwidth.BandwidthLimiter(400, clock=lambda: now[0])
+    with limiter.stream(3) as high, limiter.stream(1) as low:
+        assert limiter.reserve(high, 300) == pytest.approx(1)
+        assert limiter.reserve(low, 100) == pytest.approx(1)
+        now[0] = 2.0
+        with limiter.stream(1) as other:
+            # Three streams now: 240 + 80 + 80 B/s, with bursts of 1/4 s
+            assert limiter.reserve(high, 300) == pytest.approx(1)
+            assert limiter.reserve(other, 40) == pytest.approx(0.5)
+        now[0] = 4.0
+        # 'other' is done: its share goes back to the others
+        assert limiter.reserve(low, 125) == pytest.approx(1)
+        limiter.set_rate(None)
+        assert limiter.reserve(low, 10 ** 9) == 0
+
+def make_app(server, name, priority=1):
+    url = server.url(f'/files/{name}.exe')
+    app = cl.App(name, url, re.compile('.+'), download_url=url,
+                 priority=priority, session=SessionPool())
+    app.get_file_name()
+    return app
+
+def download(apps) -> dict:
+    '''Downloads the apps at once; returns when each finished, in seconds'''
+    finished = {}
+    start = time.perf_counter()
+    def run(app):
+        app.download_installer()
+        finished[app.name] = time.perf_counter() - start
+    threads = [threading.Thread(target=run, args=(app,)) for app in apps]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return finished
+
+def test_downloads_stay_under_the_limit(limiter, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    limiter.set_rate(2e6)
+    payload = SyntheticFile(1000000)
+    with LocalServer({'/files/a.exe': payload,
+                      '/files/b.exe': payload}) as server:
+        finished = download([make_app(server, 'a'), make_app(server, 'b')])
+    # 2 MB at 2 MB/s (less the first bursts); only slower on a busy machine
+    assert max(finished.values()) > 0.85
+
+def test_higher_priority_finishes_first(limiter, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    limiter.set_rate(1e6)
+    payload = SyntheticFile(600000)
+    with LocalServer({'/files/essential.exe': payload,
+                      '/files/optional.exe': payload}) as server:
+        finished = download([make_app(server, 'optional'),
+                             make_app(server, 'essential', priority=3)])
+    # 750 kB/s vs 250 kB/s, then the optional one gets it all
+    assert finished['essential'] > 0.6
+    assert finished['optional'] > finished['essential']
+
+def test_control_file_changes_the_limit(limiter, tmp_path):
+    path = tmp_path / 'limit'
+    path.write_text('1M')
+    control = bandwidth.ControlFile(str(path), limiter, interval=0.05)
+    control.start()
+    try:
+        assert limiter.rate == 1e6
+        path.write_text('250k')
+        os.utime(path, (time.time() + 5, time.time() + 5))
+        deadline = time.monotonic() + 2
+        while limiter.rate != 250000 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert limiter.rate == 250000
+        if hasattr(signal, 'SIGHUP'):
+            limiter.set_rate(None)
+            # Held by this (the main) thread, as the async engine may be:
+            # the handler must not need it
+            with limiter._lock:
+                os.kill(os.getpid(), signal.SIGHUP)
+                time.sleep(0.05)    # The handler runs between bytecodes
+            deadline = time.monotonic() + 2
+            while limiter.rate != 250000 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert limiter.rate == 250000
+    finally:
+        control.stop()
@@ -0,0 +1,58 @@
+'''Tests for the pipeline benchmark in benchmark.py and the network
+conditions of local_server.py'''
+
+import re
+import time
+
+import requests
+
+import benchmark
+import fixtures
+from local_server import LocalServer, SyntheticFile
+
+def test_server_imitates_latency_and_bandwidth():
+    with LocalServer({'/file': SyntheticFile(200000)}, latency=0.1,
+                     bandwidth=1e6) as server:
+        start = time.perf_counter()
+        assert len(requests.get(server.url('/file')).content) == 200000
+        elapsed = time.perf_counter() - start
+    # 0.1s latency + 0.2s of transfer, at least (a busy machine is slower)
+    assert elapsed > 0.28
+
+def test_server_injects_errors():
+    with LocalServer({'/page': 'ok'}, error_rate=0.5) as server:
+        statuses = [requests.get(server.url('/page')).status_code
+                    for _ in range(40)]
+    assert set(statuses) == {200, 503}
+
+def test_replayed_apps_all_download():
+    names = ['7zip', 'Adobe Reader', 'Firefox', 'foobar2000', 'VS Code']
+    servers, specs = benchmark.replay_apps(50000, names)
+    try:
+        result = benchmark.run_trial(specs, workers=2)
+    finally:
+        for server in servers.values():
+            server.stop()
+    assert [spec['name'] for spec in specs] == names
+    assert result['bytes'] == sum(spec['size'] for spec in specs)
+    assert result['wall'] >= result['resolve'] + result['download'] > 0
+
+def test_regressions_flag_slower_runs_only():
+    baseline = {'results': [{'workers': 1, 'wall': 10.0},
+                            {'workers': 4, 'wall': 4.0}]}
+    results = [{'workers': 1, 'wall': 11.0}, {'workers': 4, 'wall': 5.0},
+               {'workers': 8, 'wall': 9.0}]
+    assert benchmark.regressions(results, baseline, 0.2) == [(4, 4.0, 5.0)]
+
+def test_prompt_comes_before_heavy_imports():
+    _, imports = benchmark.startup_profile()
+    assert 'apps' in imports
+    assert [name for name in benchmark.HEAVY_MODULES if name in imports] == []
+
+def test_downloads_go_on_while_pages_parse():
+    pattern = re.compile(r'setup-[\d.]+\.exe')
+    page = fixtures.synthetic_page(pattern, anchors=200).encode()
+    with LocalServer({'/file': SyntheticFile(100000)}) as server:
+        result = benchmark.parse_trial(server.url('/file'), page, pattern,
+                                       parses=4, threads=2)
+    assert result['parse'] > 0 and result['throughput'] > 0
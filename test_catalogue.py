@@ -0,0 +1,49 @@
+'''Tests for catalogue.py and the app selection in apps.py'''
+
+import json
+import re
+import subprocess
+import sys
+
+import pytest
+
+import apps
+import catalogue
+import classes as cl
+
+def test_entries_are_light_records():
+    entries = catalogue.entries()
+    assert len(entries) == len({entry.name for entry in entries}) > 30
+    assert not hasattr(entries[0], '__dict__')
+    for entry in entries:
+        re.compile(entry.pattern)
+
+def test_select_by_name_and_tag():
+    chosen = catalogue.select(names=['vlc', 'Python'], tags=['BROWSER'])
+    assert [entry.name for entry in chosen] == ['Brave', 'Firefox', 'Python',
+                                                'VLC']
+    assert len(catalogue.select()) == len(catalogue.entries())
+
+def test_importing_apps_builds_nothing():
+    code = ('import sys, apps; apps.selected_names(); '
+            'print("classes" in sys.modules, "programs" in vars(apps))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                            text=True, check=True).stdout
+    assert output.split() == ['False', 'False']
+
+def test_apps_module_stays_compatible(monkeypatch):
+    vlc = apps.programs['VLC']
+    assert isinstance(vlc, cl.App)
+    assert vlc.pattern.search('vlc-3.0.21-win64.exe')
+    assert vlc.checksum_url == '{url}.sha256'
+    custom = cl.App('Custom', 'https://example.com/', re.compile('x'))
+    monkeypatch.setattr(apps, 'extra', {'Custom': custom})
+    assert apps.select(['custom']) == [custom]
+    assert apps.select(tags=['dev'])[-1].name == 'Windows Terminal'
+    assert apps.selected_names()[-1] == 'Custom'
+
+def test_bad_entry_is_reported(tmp_path):
+    path = tmp_path / 'catalogue.json'
+    path.write_text(json.dumps({'apps': [{'name': 'X', 'page': 'typo'}]}))
+    with pytest.raises(ValueError, match="'X'"):
+        catalogue.entries(str(path))
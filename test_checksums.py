@@ -0,0 +1,87 @@
+'''Tests for checksum verification while downloading (classes.py)'''
+
+import hashlib
+import os
+import re
+
+import classes as cl
+import pipeline
+from local_server import LocalServer, SyntheticFile
+from manifest import Manifest
+
+PAYLOAD = SyntheticFile(300000)
+SHA256 = hashlib.sha256(PAYLOAD.content()).hexdigest()
+SHA512 = hashlib.sha512(PAYLOAD.content()).hexdigest()
+
+def make_app(server, **kwargs):
+    url = server.url('/setup.exe')
+    app = cl.App('Setup', url, re.compile(r'.+'), download_url=url, **kwargs)
+    app.retry_delay = 0
+    return app
+
+def test_parse_checksum_files():
+    assert cl.parse_checksum(SHA256 + '\n') == 'sha256:' + SHA256
+    sums = f'{"0" * 128}  other.exe\n{SHA512.upper()} *setup.exe\n'
+    assert cl.parse_checksum(sums, 'setup.exe') == 'sha512:' + SHA512
+    assert cl.parse_checksum(sums) is None
+    assert cl.parse_checksum('<html>Not found</html>') is None
+
+def test_sidecar_digest_is_checked_while_streaming(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': PAYLOAD}) as server:
+        server.add('/setup.exe.sha512', f'{SHA512}  setup.exe\n', 'text/plain')
+        app = make_app(server, checksum_url='{url}.sha512')
+        assert pipeline.download_app(app) is True
+    assert app.digest == 'sha512:' + SHA512
+    assert app.hashes == {'sha256': SHA256, 'sha512': SHA512}
+
+def test_bad_leftover_is_downloaded_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'setup.exe.part').write_bytes(b'garbage')
+    with LocalServer({'/setup.exe': PAYLOAD}) as server:
+        # Recorded as cut from this very file, so it's resumed
+        cl.write_part_source('setup.exe.part', server.url('/setup.exe'),
+                             PAYLOAD.etag)
+        app = make_app(server, digest='sha256:' + SHA256)
+        assert pipeline.download_app(app) is True
+    assert (tmp_path / 'setup.exe').read_bytes() == PAYLOAD.content()
+    assert app.stats['retries'] == 1
+
+def test_mismatch_is_quarantined(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': PAYLOAD}) as server:
+        app = make_app(server, digest='sha256:' + '0' * 64)
+        assert pipeline.download_app(app, Manifest()) is None
+        assert [method for method, _, _ in server.log].count('GET') == 2
+    assert not (tmp_path / 'setup.exe').exists()
+    assert (tmp_path / 'quarantine' / 'setup.exe').stat().st_size == 300000
+    assert Manifest().get('Setup') is None
+
+def test_manifest_trusts_hash_while_mtime_is_unchanged(tmp_path,
+                                                       monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': PAYLOAD}) as server:
+        pipeline.download_app(make_app(server), Manifest())
+    entry = Manifest().get('Setup')
+    app = make_app(server)
+    app.get_file_name()
+    def no_hashing(*args, **kwargs):
+        raise AssertionError("file read again")
+    monkeypatch.setattr(cl, 'hash_file', no_hashing)
+    assert app.has_file_from(entry)
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    # Same size, other bytes, newer mtime: the file is hashed and rejected
+    (tmp_path / 'setup.exe').write_bytes(b'x' * 300000)
+    os.utime(tmp_path / 'setup.exe', (1, entry['mtime'] + 10))
+    assert not app.has_file_from(entry)
+
+def test_mtime_is_refreshed_once_the_hash_matches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': PAYLOAD}) as server:
+        pipeline.download_app(make_app(server), Manifest())
+        # Touched: hashed once, found unchanged, then trusted again
+        os.utime('setup.exe', (1, os.path.getmtime('setup.exe') + 10))
+        assert pipeline.download_app(make_app(server), Manifest()) is False
+        assert Manifest().get('Setup')['mtime'] == \
+            os.path.getmtime('setup.exe')
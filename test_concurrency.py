@@ -0,0 +1,131 @@
+'''Tests for the adaptive worker count (concurrency.py), with simulated
+links and against local_server.py'''
+
+import re
+from urllib.parse import urlsplit
+
+import bandwidth
+import classes as cl
+import pipeline
+from concurrency import AIMDController
+from local_server import LocalServer, SyntheticFile
+from scheduler import HostScheduler
+from sessions import SessionPool
+
+class Link:
+    '''Simulated run: throughput grows with the workers up to 'knee' of
+    them, errors and latency as set'''
+
+    def __init__(self, knee, controller):
+        self.knee = knee
+        self.controller = controller
+        self.now = 0
+        self.received = 0
+        self.errors = 0
+        self.latency = 0.05
+        controller.clock = lambda: self.now
+        controller.latency = lambda: {'cdn.example': self.latency}
+
+    def tick(self) -> int:
+        self.now += self.controller.interval
+        self.received += min(self.controller.limit, self.knee) * 1e6 * \
+            self.controller.interval
+        return self.controller.update(self.received, self.errors)
+
+def test_climbs_to_the_knee_and_stays_around_it():
+    link = Link(5, AIMDController(minimum=2, maximum=16, log=None))
+    limits = [link.tick() for _ in range(40)]
+    assert max(limits) == 6                 # One past the knee, taken back
+    assert set(limits[10:]) <= {5, 6}
+    assert [decision.limit for decision in
+            link.controller.decisions[:5]] == [3, 4, 5, 6, 5]
+    assert "didn't help" in link.controller.decisions[4].reason
+
+def test_errors_and_latency_halve_the_limit():
+    logged = []
+    link = Link(16, AIMDController(minimum=1, maximum=16, start=8,
+                                   hold=1, log=logged.append))
+    link.tick()
+    link.errors += 2
+    assert link.tick() == 4
+    assert link.tick() == 4                 # Holding
+    link.latency = 0.5
+    assert link.tick() == 2
+    assert logged[-2].startswith("Workers: 4 (2 error(s)")
+    assert "latency to cdn.example up from 50 ms" in logged[-1]
+
+def test_hosts_are_compared_with_themselves():
+    link = Link(16, AIMDController(minimum=1, maximum=16, start=8,
+                                   log=None))
+    latencies = {'cdn.example': 0.02}
+    link.controller.latency = lambda: dict(latencies)
+    link.tick()
+    link.tick()
+    latencies['slow.example'] = 0.4         # A slower site, not a rise
+    link.tick()
+    assert link.controller.limit == 10
+    latencies['slow.example'] = 1
+    assert link.tick() == 5
+    assert "latency to slow.example up from 400 ms" in \
+        link.controller.decisions[-1].reason
+
+def test_start_forgets_the_resolve_phase():
+    latencies = {'cdn.example': 0.01}      # A page, before the downloads
+    reset = []
+    controller = AIMDController(minimum=1, maximum=16, start=8, log=None,
+                                reset_latency=lambda: reset.append(True))
+    link = Link(16, controller)
+    controller.latency = lambda: dict(latencies)
+    link.tick()
+    link.tick()
+    controller.start()
+    latencies['cdn.example'] = 0.1          # First bytes of an installer
+    link.tick()
+    link.tick()
+    assert reset == [True]
+    assert controller.limit == 10
+    assert controller.decisions[-1].reason == "probing for more throughput"
+
+def test_session_latency_per_host():
+    with LocalServer({'/page': 'x'}, latency=0.1) as slow, \
+         LocalServer({'/page': 'x'}) as fast:
+        pool = SessionPool()
+        pool.get(slow.url('/page'))
+        pool.get(fast.url('/page'))
+        pool.head(fast.url('/page'))
+        latency = pool.latency()
+        assert latency[urlsplit(slow.url('')).netloc] >= 0.1
+        assert latency[urlsplit(fast.url('')).netloc] < 0.1
+        pool.reset_latency()
+        assert pool.latency() == {}
+
+def run_profile(server, controller) -> int:
+    '''Downloads 16 files from 'server'; returns the highest limit reached'''
+    apps = []
+    for index in range(16):
+        url = server.url(f'/files/{index}.exe')
+        apps.append(cl.App(str(index), url, re.compile('.+'),
+                           download_url=url, session=SessionPool()))
+    scheduler = HostScheduler(max_workers=2, per_host=16)
+    assert pipeline.run(apps, scheduler, controller=controller) == [True] * 16
+    return max([controller.minimum] + [decision.limit for decision
+                                       in controller.decisions])
+
+def test_more_workers_only_where_they_help(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    routes = {f'/files/{index}.exe': SyntheticFile(200000 + index)
+              for index in range(16)}
+    # Every connection capped at 200 kB/s: more of them go faster
+    with LocalServer(routes, bandwidth=2e5) as server:
+        capped = run_profile(server, AIMDController(
+            minimum=2, maximum=12, interval=0.3, tolerance=0.2, log=None))
+    # One shared 1 MB/s link: more connections just split it
+    for path in tmp_path.iterdir():
+        path.unlink()
+    monkeypatch.setattr(bandwidth, 'limiter',
+                        bandwidth.BandwidthLimiter(1e6))
+    with LocalServer(routes) as server:
+        shared = run_profile(server, AIMDController(
+            minimum=2, maximum=12, interval=0.3, tolerance=0.2, log=None))
+    assert capped >= 5
+    assert shared <= 3
@@ -0,0 +1,203 @@
+'''Offline tests for the download path, run against local_server.py'''
+
+import hashlib
+import os
+import re
+import tracemalloc
+
+import pytest
+import requests
+
+import classes as cl
+from local_server import LocalServer, SyntheticFile
+from manifest import Manifest
+from sessions import SessionPool
+
+def make_app(url, **kwargs):
+    return cl.App('Test', url, re.compile(r'.+'), download_url=url, **kwargs)
+
+def test_streaming_keeps_peak_memory_flat(tmp_path, monkeypatch):
+    size = 64 * 1024 * 1024
+    chunk_size = 256 * 1024
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/big.exe': SyntheticFile(size)}) as server:
+        app = make_app(server.url('/big.exe'), chunk_size=chunk_size)
+        app.get_file_name()
+        tracemalloc.start()
+        written = app.download_installer()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    assert written == size
+    assert (tmp_path / 'big.exe').stat().st_size == size
+    assert not (tmp_path / 'big.exe.part').exists()
+    # A handful of chunks at most, nowhere near the 64 MiB file
+    assert peak < 8 * chunk_size
+
+def test_streamed_file_matches_payload(tmp_path, monkeypatch):
+    payload = SyntheticFile(3 * 1024 * 1024 + 17)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}) as server:
+        app = make_app(server.url('/setup.exe'), chunk_size=64 * 1024)
+        app.get_file_name()
+        app.download_installer()
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
+
+def test_dropped_connection_resumes_with_range(tmp_path, monkeypatch):
+    payload = SyntheticFile(5 * 1024 * 1024)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}) as server:
+        server.drop('/setup.exe', 1024 * 1024, 2 * 1024 * 1024)
+        app = make_app(server.url('/setup.exe'), chunk_size=64 * 1024)
+        app.retry_delay = 0
+        app.get_file_name()
+        app.download_installer()
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
+    ranges = [entry[2] for entry in server.log]
+    assert ranges == [None, 'bytes=1048576-', 'bytes=3145728-']
+
+def test_installers_are_fetched_uncompressed(tmp_path, monkeypatch):
+    body = b'Write-Output "Installing"\r\n' * 40000
+    monkeypatch.chdir(tmp_path)
+    with LocalServer(compress=True) as server:
+        server.add('/setup.ps1', body, 'text/plain')
+        server.drop('/setup.ps1', 300000)
+        app = make_app(server.url('/setup.ps1'), chunk_size=64 * 1024)
+        app.retry_delay = 0
+        app.get_file_name()
+        assert app.probe_download()
+        assert app.content_length == len(body)
+        app.download_installer()
+    assert (tmp_path / 'setup.ps1').read_bytes() == body
+    # Offsets count the file's bytes, so the resumed range fits
+    assert [entry[2] for entry in server.log if entry[0] == 'GET'] == \
+        [None, f'bytes={300000 // 65536 * 65536}-']
+
+def interrupted_download(server, path='/setup.exe', cut=700000):
+    '''Leaves the '.part' file of a run cut short after 'cut' bytes;
+    returns its size (whole chunks only)'''
+    server.drop(path, cut)
+    app = make_app(server.url(path), max_retries=0, chunk_size=64 * 1024)
+    app.get_file_name()
+    with pytest.raises(requests.exceptions.RequestException):
+        app.download_installer()
+    server.log.clear()
+    return os.path.getsize(app.file_name + '.part')
+
+def test_leftover_part_file_is_resumed(tmp_path, monkeypatch):
+    payload = SyntheticFile(2 * 1024 * 1024)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}) as server:
+        done = interrupted_download(server)
+        app = make_app(server.url('/setup.exe'))
+        app.get_file_name()
+        app.download_installer()
+    assert done > 0
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
+    assert server.log == [('GET', '/setup.exe', f'bytes={done}-')]
+    assert sorted(tmp_path.iterdir()) == [tmp_path / 'setup.exe']
+
+def test_part_file_of_an_older_build_is_not_resumed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': SyntheticFile(2 * 1024 * 1024)}) \
+            as server:
+        assert interrupted_download(server) > 0
+        # New release, new ETag: If-Range gets the whole file back
+        newer = SyntheticFile(2 * 1024 * 1024 + 5)
+        server.add('/setup.exe', newer)
+        app = make_app(server.url('/setup.exe'))
+        app.get_file_name()
+        app.download_installer()
+    assert (tmp_path / 'setup.exe').read_bytes() == newer.content()
+    assert len(server.log) == 1
+
+def test_unrecorded_or_oversized_part_file_starts_over(tmp_path, monkeypatch):
+    payload = SyntheticFile(1024 * 1024)
+    part = tmp_path / 'setup.exe.part'
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}) as server:
+        app = make_app(server.url('/setup.exe'))
+        app.get_file_name()
+        # Nothing says where it came from
+        part.write_bytes(payload.content()[:1000])
+        app.download_installer()
+        assert server.log == [('GET', '/setup.exe', None)]
+        # Longer than the file: the 416 doesn't mean it's complete
+        part.write_bytes(bytes(2 * 1024 * 1024))
+        cl.write_part_source(str(part), app.download_url, '')
+        server.log.clear()
+        app.download_installer()
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
+    assert [entry[2] for entry in server.log] == ['bytes=2097152-', None]
+
+def test_empty_ranges_use_up_the_retries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': SyntheticFile(1000)}) as server:
+        server.fail('/setup.exe', 206, times=10,
+                    headers={'Content-Range': 'bytes 0-499/1000'})
+        app = make_app(server.url('/setup.exe'), max_retries=2)
+        app.retry_delay = 0
+        with pytest.raises(requests.exceptions.ConnectionError):
+            app.fetch_range('segment.part0', 0, 499)
+    assert len(server.log) == 3
+
+def test_segments_are_fetched_in_parallel_and_stitched(tmp_path, monkeypatch):
+    payload = SyntheticFile(17 * 1024 * 1024 + 3)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/big.exe': payload}) as server:
+        server.drop('/big.exe', 500000)
+        app = make_app(server.url('/big.exe'), segments=4)
+        app.retry_delay = 0
+        app.get_file_name()
+        app.download_installer()
+    assert (tmp_path / 'big.exe').read_bytes() == payload.content()
+    assert sorted(tmp_path.iterdir()) == [tmp_path / 'big.exe']
+    gets = [entry for entry in server.log if entry[0] == 'GET']
+    # Four segments, plus one retry for the dropped one
+    assert len(gets) == 5
+    assert all(entry[2] for entry in gets)
+
+def test_server_without_ranges_restarts_from_zero(tmp_path, monkeypatch):
+    payload = SyntheticFile(3 * 1024 * 1024)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}, ranges=False) as server:
+        server.drop('/setup.exe', 1024 * 1024)
+        app = make_app(server.url('/setup.exe'), segments=4)
+        app.retry_delay = 0
+        app.get_file_name()
+        app.download_installer()
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
+    assert [entry[0] for entry in server.log] == ['HEAD', 'GET', 'GET']
+
+def test_manifest_skips_unchanged_files(tmp_path, monkeypatch):
+    payload = SyntheticFile(2 * 1024 * 1024)
+    monkeypatch.chdir(tmp_path)
+    with LocalServer({'/setup.exe': payload}) as server:
+        manifest = Manifest()
+        app = make_app(server.url('/setup.exe'))
+        app.get_file_name()
+        assert not app.is_up_to_date(manifest.get(app.name))
+        app.download_installer()
+        manifest.record(app)
+        assert Manifest().get('Test')['sha256'] == \
+            hashlib.sha256(payload.content()).hexdigest()
+
+        # Next run: conditional request answered with 304, nothing moves
+        rerun = make_app(server.url('/setup.exe'))
+        rerun.get_file_name()
+        assert rerun.is_up_to_date(Manifest().get(rerun.name))
+        assert server.log[-1][0] == 'HEAD'
+
+        # New build behind the same url: downloaded again
+        server.add('/setup.exe', SyntheticFile(payload.size, etag='"v2"'))
+        assert not rerun.is_up_to_date(Manifest().get(rerun.name))
+
+def test_apps_on_one_host_share_connections(tmp_path, monkeypatch):
+    payloads = {f'/setup-{n}.exe': SyntheticFile(100000 + n) for n in range(5)}
+    monkeypatch.chdir(tmp_path)
+    pool = SessionPool(pool_size=2)
+    with LocalServer(payloads) as server:
+        for path in payloads:
+            app = make_app(server.url(path), session=pool)
+            app.get_file_name()
+            app.download_installer()
+    assert pool.stats() == {'127.0.0.1': {'requests': 5, 'connections': 1}}
@@ -0,0 +1,58 @@
+'''Tests for the HTTP/2 page client (http2.py) against local_h2_server.py,
+and for compressed pages'''
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('httpx')
+pytest.importorskip('h2')
+
+import classes as cl
+import http2
+import pipeline
+from local_h2_server import H2Server
+from local_server import LocalServer
+from sessions import SessionPool
+
+PAGE = ('<html><body>' + '<a href="/notes">Release notes</a>' * 500 +
+        '<a href="/files/setup-1.2.exe">Download</a></body></html>')
+
+def test_pages_share_one_compressed_connection():
+    routes = {f'/{index}.html': PAGE for index in range(8)}
+    with H2Server(routes, latency=0.2) as server:
+        client = http2.PageClient(prior_knowledge=True)
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(
+                lambda path: client.get(server.url(path),
+                                        headers=cl.PAGE_HEADERS), routes))
+        client.close()
+    assert [response.text for response in responses] == [PAGE] * 8
+    assert server.connections == 1
+    assert client.stats['versions'] == {'HTTP/2': 8}
+    assert server.sent < len(PAGE) * 8 / 10
+    assert client.stats['decoded'] == len(PAGE) * 8
+
+def test_app_resolves_over_http2():
+    with H2Server({'/download': PAGE}) as server:
+        app = cl.App('Setup', server.url('/download'),
+                     re.compile(r'setup-[\d.]+\.exe'),
+                     base_url=server.url(''))
+        app.page_session = http2.PageClient(prior_knowledge=True)
+        pipeline.find_download_url(app)
+        app.page_session.close()
+        assert app.download_url == server.url('/files/setup-1.2.exe')
+
+def test_falls_back_to_http1():
+    with LocalServer({'/download': PAGE}, compress=True) as server:
+        fallback = SessionPool()
+        client = http2.PageClient(fallback=fallback, prior_knowledge=True)
+        responses = [client.get(server.url('/download'),
+                                headers=cl.PAGE_HEADERS) for _ in range(2)]
+        client.close()
+    assert [response.text for response in responses] == [PAGE] * 2
+    assert responses[0].headers['Content-Encoding'] in ('br', 'gzip')
+    assert client.stats['requests'] == 0
+    # The host is only tried in HTTP/2 once
+    assert fallback.stats()['127.0.0.1']['requests'] == 2
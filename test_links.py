@@ -0,0 +1,41 @@
+'''Tests for link extraction in classes.py'''
+
+import re
+
+import apps
+import classes as cl
+import fixtures
+
+def test_fast_parser_stops_at_first_match():
+    html = ('<a href="/a">a</a><a name="no-href">b</a>'
+            '<A HREF="/b?x=1&amp;y=2">c</A><a href="/setup-2.exe">d</a>'
+            '<a href="/setup-1.exe">e</a>')
+    pattern = re.compile(r'setup-\d\.exe')
+    assert cl.first_links(html) == cl.html_links(html)
+    assert cl.first_links(html, pattern) == ['/a', '/b?x=1&y=2',
+                                             '/setup-2.exe']
+
+def test_fast_parser_finds_same_url_for_every_app():
+    for app in apps.programs.values():
+        html = fixtures.synthetic_page(app.pattern, anchors=300)
+        assert cl.pick_download_url(cl.first_links(html, app.pattern),
+                                    app.pattern) == \
+            cl.pick_download_url(cl.html_links(html), app.pattern)
+
+def test_match_can_be_the_last_link():
+    pattern = apps.programs['VLC'].pattern
+    html = fixtures.synthetic_page(pattern, anchors=50, position=1)
+    links = cl.first_links(html, pattern)
+    assert len(links) == 50 and pattern.search(links[-1])
+
+def test_fixture_pages_lead_to_the_same_url():
+    for app in apps.programs.values():
+        try:
+            with open(fixtures.recorded_path(app), encoding='utf-8') as page:
+                html = page.read()
+        except FileNotFoundError:
+            continue
+        url = cl.pick_download_url(cl.first_links(html, app.pattern),
+                                   app.pattern)
+        assert url is not None, app.name
+        assert url == cl.pick_download_url(cl.html_links(html), app.pattern)
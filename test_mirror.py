@@ -0,0 +1,100 @@
+'''Tests for mirror_server.py, with local_server.py as the origin'''
+
+import hashlib
+import re
+import threading
+import time
+
+import requests
+
+import classes as cl
+from local_server import LocalServer, SyntheticFile
+from mirror_server import MirrorServer
+from sessions import SessionPool
+
+def start_mirror(tmp_path, **kwargs):
+    return MirrorServer(str(tmp_path / 'store'), host='127.0.0.1', port=0,
+                        **kwargs).start()
+
+def settled(mirror):
+    '''Waits for the mirror to file the fetches its clients just read'''
+    while mirror.fetches:
+        time.sleep(0.01)
+
+def test_concurrent_clients_share_one_origin_fetch(tmp_path):
+    payload = SyntheticFile(4 * 1024 * 1024)
+    # Slow origin, so that every client asks while the fetch is running
+    with LocalServer({'/VSCodeSetup.exe': payload}, bandwidth=8e6) as origin, \
+         start_mirror(tmp_path) as mirror:
+        url = cl.mirror_url(mirror.url(), origin.url('/VSCodeSetup.exe'))
+        digests = []
+        def client():
+            response = requests.get(url, timeout=30)
+            digests.append(hashlib.sha256(response.content).hexdigest())
+        clients = [threading.Thread(target=client) for _ in range(50)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        settled(mirror)
+        assert origin.hits['/VSCodeSetup.exe'] == 1
+        assert mirror.origin_requests == 1
+        # Later requests are served from the store, ranges included
+        response = requests.get(url, headers={'Range': 'bytes=10-19'})
+        assert response.headers['X-Mirror'] == 'hit'
+        assert response.content == payload.content()[10:20]
+        assert origin.hits['/VSCodeSetup.exe'] == 1
+    assert digests == [hashlib.sha256(payload.content()).hexdigest()] * 50
+    blobs = [path.name for path in (tmp_path / 'store' / 'blobs').iterdir()]
+    assert blobs == [digests[0]]
+
+def test_least_recently_used_blobs_are_evicted(tmp_path):
+    # Different bytes: identical files would share one blob
+    routes = {f'/{name}.exe': name.encode() * 100000 for name in 'abc'}
+    with LocalServer(routes) as origin, \
+         start_mirror(tmp_path, max_bytes=250000) as mirror:
+        def fetch(name):
+            url = cl.mirror_url(mirror.url(), origin.url(f'/{name}.exe'))
+            source = requests.get(url).headers['X-Mirror']
+            settled(mirror)
+            return source
+        assert [fetch(name) for name in 'ab'] == ['miss', 'miss']
+        assert fetch('a') == 'hit'      # 'b' is now the least recently used
+        assert fetch('c') == 'miss'
+        assert sorted(url.split('/')[-1] for url in mirror.index) == \
+            ['a.exe', 'c.exe']
+        assert fetch('b') == 'miss'
+
+def test_deleted_blob_is_fetched_again_in_full(tmp_path):
+    payload = SyntheticFile(300000)
+    with LocalServer({'/setup.exe': payload}) as origin, \
+         start_mirror(tmp_path) as mirror:
+        url = cl.mirror_url(mirror.url(), origin.url('/setup.exe'))
+        requests.get(url)
+        settled(mirror)
+        for blob in (tmp_path / 'store' / 'blobs').iterdir():
+            blob.unlink()
+        response = requests.get(url, timeout=10)
+        assert response.status_code == 200
+        assert response.content == payload.content()
+        assert origin.hits['/setup.exe'] == 2
+
+def test_app_downloads_through_mirror_or_falls_back(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    payload = SyntheticFile(200000)
+    with LocalServer({'/setup.exe': payload}) as origin, \
+         start_mirror(tmp_path) as mirror:
+        url = origin.url('/setup.exe')
+        app = cl.App('Setup', url, re.compile('.+'), download_url=url,
+                     session=SessionPool(retries=0))
+        app.mirror = mirror.url()
+        app.get_file_name()
+        app.download_installer()
+        assert app.mirror and mirror.origin_requests == 1
+        # Mirror gone: the download comes from the site
+        app.mirror = 'http://127.0.0.1:9'
+        (tmp_path / 'setup.exe').unlink()
+        app.download_installer()
+        assert app.mirror is None
+        assert origin.hits['/setup.exe'] == 2
+    assert (tmp_path / 'setup.exe').read_bytes() == payload.content()
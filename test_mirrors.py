@@ -0,0 +1,149 @@
+'''Offline tests for mirror racing and switching (mirrors.py), run against
+local_server.py'''
+
+import json
+import re
+import time
+
+import pytest
+from tqdm import tqdm
+
+import bandwidth
+import classes as cl
+import mirrors
+import pipeline
+from local_server import LocalServer, SyntheticFile
+from sessions import SessionPool
+
+PAYLOAD = SyntheticFile(3000000)
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    '''A fresh mirror history, saved in tmp_path'''
+    fresh = mirrors.MirrorHistory()
+    fresh.use_file(str(tmp_path / mirrors.HISTORY_NAME))
+    monkeypatch.setattr(mirrors, 'history', fresh)
+    monkeypatch.chdir(tmp_path)
+    return fresh
+
+def make_app(slow, fast):
+    url = slow.url('/files/setup.exe')
+    app = cl.App('Mirrored', url, re.compile('.+'), download_url=url,
+                 mirrors=[fast.url('') + '{path}'], session=SessionPool())
+    app.get_file_name()
+    return app
+
+def downloads(server) -> list:
+    return [(path, byte_range) for method, path, byte_range in server.log
+            if method == 'GET']
+
+def test_fastest_mirror_is_picked_and_remembered(history):
+    routes = {'/files/setup.exe': PAYLOAD}
+    with LocalServer(routes, latency=0.2, bandwidth=2e6) as slow, \
+         LocalServer(routes) as fast:
+        app = make_app(slow, fast)
+        assert app.download_installer() == PAYLOAD.size
+        assert [url for url, _ in app.sources] == \
+            [fast.url('/files/setup.exe'), slow.url('/files/setup.exe')]
+        # Probed with a short byte range, then downloaded from the fast one
+        assert downloads(slow) == [('/files/setup.exe', 'bytes=0-262143')]
+        assert downloads(fast)[-1] == ('/files/setup.exe', None)
+
+        # Next run: no racing, the history is enough
+        again = mirrors.MirrorHistory()
+        again.use_file(history.path)
+        assert again.get(fast.url('')) is not None
+        mirrors.history = again
+        other = make_app(slow, fast)
+        assert other.pick_source() == fast.url('/files/setup.exe')
+        assert len(downloads(slow)) == 1
+    with open('setup.exe', 'rb') as installer:
+        assert installer.read() == PAYLOAD.content()
+
+def test_mirrors_are_raced_before_the_download(history):
+    routes = {'/files/setup.exe': PAYLOAD}
+    with LocalServer(routes, latency=0.2, bandwidth=2e6) as slow, \
+         LocalServer(routes) as fast:
+        app = make_app(slow, fast)
+        start = time.perf_counter()
+        pipeline.resolve_app(app)
+        assert app.sources[0][0] == fast.url('/files/setup.exe')
+        assert pipeline.download_app(app)
+        wall = time.perf_counter() - start
+    seconds = app.stats['seconds']
+    assert seconds['probe'] >= 0.2      # The slow mirror's first byte
+    # The race is counted once, as probing, not again as downloading
+    assert sum(seconds.values()) <= wall
+
+def test_transfer_moves_to_next_mirror_when_it_collapses(history,
+                                                         monkeypatch):
+    monkeypatch.setattr(mirrors, 'WINDOW', 0.2)
+    written = []
+    monkeypatch.setattr(tqdm, 'write', written.append)
+    routes = {'/files/setup.exe': PAYLOAD}
+    with LocalServer(routes) as first, \
+         LocalServer(routes, latency=0.05) as second:
+        app = make_app(first, second)
+        app.pick_source()
+        assert app.transfer_url() == first.url('/files/setup.exe')
+        first.bandwidth = 100000        # Collapses after the race
+        assert app.download_installer() == PAYLOAD.size
+        resumed = downloads(second)[-1]
+    assert app.transfer_url() == second.url('/files/setup.exe')
+    # Told above the progress bar
+    assert written[0].startswith("Leaving 127.0.0.1:")
+    # Picked up where the first mirror stopped
+    assert re.fullmatch(r'bytes=[1-9]\d*-', resumed[1])
+    # The slowdown is remembered for the next run
+    with open(history.path, encoding='utf-8') as saved:
+        assert json.load(saved) == history.hosts
+    with open('setup.exe', 'rb') as installer:
+        assert installer.read() == PAYLOAD.content()
+
+def test_bandwidth_limit_is_not_taken_for_a_slowdown(history,
+                                                     monkeypatch):
+    monkeypatch.setattr(mirrors, 'WINDOW', 0.2)
+    monkeypatch.setattr(bandwidth, 'limiter',
+                        bandwidth.BandwidthLimiter(400000))
+    payload = SyntheticFile(400000)
+    routes = {'/files/setup.exe': payload}
+    with LocalServer(routes) as first, LocalServer(routes) as second:
+        app = make_app(first, second)
+        app.pick_source()
+        probed = dict(history.hosts)
+        source = app.transfer_url()
+        # Well under a fifth of the probed speed, for a second
+        assert app.download_installer() == payload.size
+    assert app.transfer_url() == source
+    assert history.hosts == probed
+
+def test_mirrors_serving_another_file_are_left_out(history):
+    with LocalServer({'/files/setup.exe': PAYLOAD}) as good, \
+         LocalServer({'/files/setup.exe': SyntheticFile(1000)}) as stale:
+        app = make_app(good, stale)
+        app.content_length = PAYLOAD.size
+        assert [url for url, _ in mirrors.rank(app)] == \
+            [good.url('/files/setup.exe')]
+
+def test_remembered_mirror_serving_another_file_is_dropped(history):
+    with LocalServer({'/files/setup.exe': PAYLOAD}) as good, \
+         LocalServer({'/files/setup.exe': SyntheticFile(1000)}) as stale:
+        app = make_app(good, stale)
+        app.content_length = PAYLOAD.size
+        # Fast in an earlier run, so not raced (and not size checked) now
+        history.record(stale.url(''), ttfb=0.001, throughput=1e9)
+        history.record(good.url(''), ttfb=0.1, throughput=1e6)
+        assert app.pick_source() == stale.url('/files/setup.exe')
+        assert app.download_installer() == PAYLOAD.size
+    assert app.transfer_url() == good.url('/files/setup.exe')
+    with open('setup.exe', 'rb') as installer:
+        assert installer.read() == PAYLOAD.content()
+
+def test_speed_watch_waits_for_the_transfer_to_warm_up():
+    now = [0]
+    watch = mirrors.SpeedWatch(100, window=10, clock=lambda: now[0])
+    for second in range(1, 20):
+        now[0] = second
+        assert not watch.slow(10)   # 10 B/s, but not judged yet
+    now[0] = 20
+    assert watch.slow(10)
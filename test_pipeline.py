@@ -0,0 +1,66 @@
+'''Offline tests for pipeline.py, run against local_server.py'''
+
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import classes as cl
+import pipeline
+from local_server import LocalServer, SyntheticFile
+from scheduler import HostScheduler
+
+def make_apps(server):
+    server.add('/page', '<a href="/files/medium.exe">latest</a>')
+    small, big = server.url('/files/small.exe'), server.url('/files/big.exe')
+    return [cl.App('Small', small, re.compile('.+'), download_url=small),
+            cl.App('Scraped', server.url('/page'), re.compile(r'medium\.exe'),
+                   base_url=server.url('')),
+            cl.App('Big', big, re.compile('.+'), download_url=big)]
+
+PAYLOADS = {'/files/small.exe': SyntheticFile(1000),
+            '/files/medium.exe': SyntheticFile(50000),
+            '/files/big.exe': SyntheticFile(900000)}
+
+def test_resolves_everything_then_downloads_largest_first(tmp_path,
+                                                          monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer(PAYLOADS) as server:
+        apps = make_apps(server)
+        results = pipeline.run(apps, HostScheduler(max_workers=1,
+                                                   per_host=1))
+        assert results == [True] * 3
+        requests = [(method, path) for method, path, _ in server.log]
+    # Phase 1: one page fetch, one HEAD per file. Phase 2: biggest first.
+    assert requests[:4] == [('HEAD', '/files/small.exe'), ('GET', '/page'),
+                            ('HEAD', '/files/medium.exe'),
+                            ('HEAD', '/files/big.exe')]
+    assert requests[4:] == [('GET', '/files/big.exe'),
+                            ('GET', '/files/medium.exe'),
+                            ('GET', '/files/small.exe')]
+    for path, payload in PAYLOADS.items():
+        assert (tmp_path / path.split('/')[-1]).stat().st_size == payload.size
+
+def test_dry_run_prints_plan_without_downloading(tmp_path, monkeypatch,
+                                                 capsys):
+    monkeypatch.chdir(tmp_path)
+    with LocalServer(PAYLOADS) as server:
+        assert pipeline.run(make_apps(server), HostScheduler(),
+                            dry_run=True) == []
+        assert not [entry for entry in server.log
+                    if entry[0] == 'GET' and entry[1].startswith('/files/')]
+    plan = capsys.readouterr().out.splitlines()
+    assert [line.split()[1] for line in plan[1:4]] == ['Big', 'Scraped',
+                                                       'Small']
+    assert list(tmp_path.iterdir()) == []
+
+def test_pages_parsed_in_worker_processes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    context = multiprocessing.get_context('spawn')
+    with LocalServer(PAYLOADS) as server, \
+         ProcessPoolExecutor(1, mp_context=context) as parse_pool:
+        apps = make_apps(server)
+        results = pipeline.run(apps, HostScheduler(), parse_pool=parse_pool)
+    assert results == [True] * 3
+    assert apps[1].download_url == server.url('/files/medium.exe')
+    assert apps[1].stats['seconds']['parse'] > 0
+    assert (tmp_path / 'medium.exe').stat().st_size == 50000
@@ -0,0 +1,84 @@
+'''Tests for the per-app stats kept by classes.py and report.py'''
+
+import csv
+import json
+import re
+import time
+
+import classes as cl
+import pipeline
+import report
+from local_server import LocalServer, SyntheticFile
+
+def run_app(tmp_path, monkeypatch, server):
+    monkeypatch.chdir(tmp_path)
+    server.add('/page', '<a href="/files/setup.exe">latest</a>')
+    app = cl.App('Setup', server.url('/page'), re.compile(r'setup\.exe'),
+                 base_url=server.url(''))
+    app.retry_delay = 0
+    pipeline.download_app(app)
+    return app
+
+def test_stages_bytes_and_retries_are_recorded(tmp_path, monkeypatch):
+    with LocalServer({'/files/setup.exe': SyntheticFile(300000)}) as server:
+        server.drop('/files/setup.exe', 100000)
+        app = run_app(tmp_path, monkeypatch, server)
+    assert set(app.stats['seconds']) == {'page', 'parse', 'match', 'probe',
+                                         'download'}
+    assert app.stats['bytes'] == 300000
+    assert app.stats['retries'] == 1
+    assert app.stats['ttfb'] > 0
+    row = report.app_row(app)
+    assert row['throughput'] > 0 and not row['cache_hit']
+
+def test_stages_add_up_to_the_time_spent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    size = 9 * 1024 * 1024
+    with LocalServer({'/files/setup.exe': SyntheticFile(size)},
+                     latency=0.2) as server:
+        url = server.url('/files/setup.exe')
+        app = cl.App('Setup', url, re.compile('.+'), download_url=url,
+                     segments=4)
+        # Size known from a resolver (e.g. GitHub's API), range support not
+        app.content_length = size
+        start = time.perf_counter()
+        pipeline.download_app(app)
+        wall = time.perf_counter() - start
+        # Segmented (two, the file being too small for four)
+        assert len([entry for entry in server.log if entry[2]]) == 2
+    seconds = app.stats['seconds']
+    # The HEAD sent from within the download counts as downloading
+    assert 'probe' not in seconds
+    row = report.app_row(app)
+    assert row['total_seconds'] == sum(seconds.values()) <= wall
+
+def test_report_formats(tmp_path, monkeypatch):
+    with LocalServer({'/files/setup.exe': SyntheticFile(1000)}) as server:
+        app = run_app(tmp_path, monkeypatch, server)
+    report.write_report(str(tmp_path / 'run.json'), [app])
+    report.write_report(str(tmp_path / 'run.csv'), [app])
+    report.write_prometheus(str(tmp_path / 'run.prom'), [app])
+    saved = json.loads((tmp_path / 'run.json').read_text())
+    assert saved['totals']['bytes'] == 1000
+    with open(tmp_path / 'run.csv', newline='') as csv_file:
+        assert next(csv.DictReader(csv_file))['bytes'] == '1000'
+    metrics = (tmp_path / 'run.prom').read_text()
+    assert 'my_apps_bytes{app="Setup"} 1000\n' in metrics
+    assert 'my_apps_stage_seconds{app="Setup",stage="parse"}' in metrics
+    assert tuple(report.app_row(app)) == report.COLUMNS
+
+def test_empty_report(tmp_path):
+    report.write_report(str(tmp_path / 'run.csv'), [])
+    report.write_report(str(tmp_path / 'run.json'), [])
+    with open(tmp_path / 'run.csv', newline='') as csv_file:
+        assert next(csv.reader(csv_file)) == list(report.COLUMNS)
+        assert next(csv.reader(csv_file), None) is None
+    assert json.loads((tmp_path / 'run.json').read_text())['totals'] \
+        ['apps'] == 0
+
+def test_profiled_stage_still_returns(monkeypatch):
+    monkeypatch.setattr(cl, 'PROFILERS', {})
+    profiler = report.profile_stage('parse')
+    app = cl.App('Setup', 'http://localhost/', re.compile(r'setup\.exe'))
+    assert app.parse_html('<a href="/setup.exe">x</a>') == ['/setup.exe']
+    assert profiler.profile.getstats()
@@ -0,0 +1,53 @@
+'''Tests for resolve_cache.py'''
+
+import re
+
+import classes as cl
+from resolve_cache import ResolveCache
+
+class Clock:
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_app(name, url=None):
+    app = cl.App(name, f'https://example.com/{name}', re.compile(r'setup\.exe'))
+    app.download_url = url
+    return app
+
+def test_entries_expire_after_ttl(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / 'cache.json')
+    ResolveCache(path, ttl=60, clock=clock).put(make_app('A', 'https://a/1'))
+
+    cache = ResolveCache(path, ttl=60, clock=clock)
+    assert cache.get(make_app('A')) == 'https://a/1'
+    # Another pattern for the same app is another entry
+    other = make_app('A')
+    other.pattern = re.compile(r'setup-x64\.exe')
+    assert cache.get(other) is None
+
+    clock.now += 61
+    assert cache.get(make_app('A')) is None
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    clock = Clock()
+    cache = ResolveCache(str(tmp_path / 'cache.json'), max_entries=2,
+                         clock=clock)
+    for name in 'ABC':
+        clock.now += 1
+        if name == 'C':
+            cache.get(make_app('A'))   # A now used more recently than B
+        cache.put(make_app(name, f'https://{name}/1'))
+    assert cache.get(make_app('A')) == 'https://A/1'
+    assert cache.get(make_app('B')) is None
+    assert cache.get(make_app('C')) == 'https://C/1'
+
+def test_refresh_ignores_stored_entries(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    ResolveCache(path).put(make_app('A', 'https://a/1'))
+    cache = ResolveCache(path, refresh=True)
+    assert cache.get(make_app('A')) is None
+    cache.put(make_app('A', 'https://a/2'))
+    assert ResolveCache(path).get(make_app('A')) == 'https://a/2'
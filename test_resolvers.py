@@ -0,0 +1,61 @@
+'''Offline tests for resolvers.py, against recorded GitHub API answers'''
+
+import os
+import re
+
+import classes as cl
+import resolvers
+from fixtures import FIXTURE_DIR
+from local_server import LocalServer
+
+RELEASES = '/repos/git-for-windows/git/releases?per_page=10'
+
+def recorded(name) -> bytes:
+    with open(os.path.join(FIXTURE_DIR, name), 'rb') as fixture:
+        return fixture.read()
+
+def git_for_windows():
+    return cl.App('Git for Windows',
+                  r'https://github.com/git-for-windows/git/releases',
+                  re.compile(r'Git-.+-64-bit\.exe'))
+
+def test_github_resolver_picks_newest_stable_asset(tmp_path):
+    with LocalServer() as server:
+        server.add(RELEASES, recorded('github-releases-git-for-windows.json'),
+                   'application/json')
+        resolver = resolvers.GitHubResolver(api_url=server.url(''),
+                                            token='secret')
+        resolver.use_cache_file(str(tmp_path / 'releases.json'))
+        app = git_for_windows()
+        assert resolver.resolve(app)
+        assert app.download_url == 'https://github.com/git-for-windows/git/' \
+            'releases/download/v2.47.1.windows.1/Git-2.47.1-64-bit.exe'
+        assert app.content_length == 66350000
+        assert app.digest.startswith('sha256:3f6b4a8c')
+
+        # A later run asks again conditionally and reuses the stored answer
+        again = resolvers.GitHubResolver(api_url=server.url(''))
+        again.use_cache_file(str(tmp_path / 'releases.json'))
+        app = git_for_windows()
+        assert again.resolve(app)
+        assert app.download_url.endswith('/Git-2.47.1-64-bit.exe')
+        assert server.hits[RELEASES] == 2
+
+def test_github_resolver_falls_back_on_errors(tmp_path):
+    with LocalServer() as server:
+        server.add(RELEASES, b'[]')
+        server.fail(RELEASES, 403, headers={'X-RateLimit-Remaining': '0'})
+        resolver = resolvers.GitHubResolver(api_url=server.url(''))
+        assert not resolver.resolve(git_for_windows())
+
+def test_resolvers_are_chosen_by_host():
+    assert resolvers.for_app(git_for_windows()) is resolvers.github
+    assert resolvers.for_app(cl.App('7zip', 'https://www.7-zip.org/',
+                                    re.compile('x'))) is None
+
+def test_json_links_walks_nested_answers():
+    answer = {'products': [{'url': 'https://a/1.exe', 'size': 1},
+                           {'url': 'https://a/2.exe', 'notes': 'none'}],
+              'mirrors': {'eu': ['https://eu/1.exe']}}
+    assert cl.json_links(answer) == ['https://a/1.exe', 'https://a/2.exe',
+                                     'https://eu/1.exe']
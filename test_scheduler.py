@@ -0,0 +1,125 @@
+'''Offline tests for scheduler.py, using a fake clock and local_server.py'''
+
+import re
+import threading
+
+import pytest
+
+import classes as cl
+from local_server import LocalServer, SyntheticFile
+from scheduler import HostScheduler, TokenBucket, host_of
+from sessions import SessionPool
+
+class FakeClock:
+    '''Time only moves when someone sleeps'''
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+def test_token_bucket_spaces_out_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    bucket.take()
+    bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.sleep(0.25)
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.sleep(10)
+    assert bucket.delay() == 0
+    bucket.take()
+    bucket.take()   # Capacity caps the burst, however long the wait
+    assert bucket.delay() == pytest.approx(0.5)
+
+def run_jobs(server, paths, scheduler):
+    '''Downloads each path, half from '127.0.0.1' and half from 'localhost'
+    (two hosts as far as the scheduler is concerned). Returns the requests
+    sent as (host, fake time) pairs.'''
+    sent = []
+    pool = SessionPool(retries=0)
+
+    def throttle(url):
+        scheduler.throttle(url)
+        sent.append((host_of(url).split(':')[0], scheduler.clock()))
+    pool.throttle = throttle
+
+    apps = []
+    for n, path in enumerate(paths):
+        url = server.url(path)
+        if n % 2:
+            url = url.replace('127.0.0.1', 'localhost')
+        apps.append(cl.App(path, url, re.compile('.+'), download_url=url,
+                           session=pool))
+
+    def download(app):
+        app.get_file_name()
+        return app.download_installer()
+    results = scheduler.run(download, apps, progress=False)
+    return sent, results
+
+def test_jobs_only_start_when_their_host_has_a_token():
+    clock = FakeClock()
+    scheduler = HostScheduler(max_workers=2, per_host=2, rate=1,
+                              clock=clock, sleep=clock.sleep)
+    apps = [cl.App(name, url, re.compile('.+'), download_url=url)
+            for name, url in (('a1', 'http://a.test/1.exe'),
+                              ('a2', 'http://a.test/2.exe'),
+                              ('b1', 'http://b.test/1.exe'))]
+    started = []
+    both_started = threading.Event()
+
+    def job(app):
+        started.append((app.name, clock()))
+        if len(started) == 2:
+            both_started.set()
+        # The first request comes once the second job is picked
+        both_started.wait(5)
+        scheduler.throttle(app.download_url)    # Has its token already
+        return app.name
+    assert scheduler.run(job, apps, progress=False) == ['a1', 'a2', 'b1']
+    # a2 would have held a worker while waiting for a.test's next token
+    assert [name for name, _ in started] == ['a1', 'b1', 'a2']
+    assert started[2][1] >= 1
+    assert clock() < 2
+
+def test_429_pauses_only_that_host(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    paths = ['/a1.exe', '/b1.exe', '/a2.exe', '/b2.exe']
+    clock = FakeClock()
+    scheduler = HostScheduler(max_workers=4, per_host=1, rate=1,
+                              clock=clock, sleep=clock.sleep)
+    with LocalServer({path: SyntheticFile(1000) for path in paths}) as server:
+        server.fail('/a1.exe', 429, headers={'Retry-After': '30'})
+        sent, results = run_jobs(server, paths, scheduler)
+    assert results == [1000] * 4
+
+    a_times = [when for host, when in sent if host == '127.0.0.1']
+    b_times = [when for host, when in sent if host == 'localhost']
+    assert len(a_times) == 3 and len(b_times) == 2
+    # One request per second per host at most
+    for times in (a_times, b_times):
+        assert all(later - earlier >= 1 - 1e-9
+                   for earlier, later in zip(times, times[1:]))
+    # The other host carried on while this one waited out its Retry-After
+    assert a_times[1] >= 30
+    assert b_times[-1] < 30
+
+def test_429_without_retry_after_backs_off_then_gives_up(tmp_path,
+                                                         monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    clock = FakeClock()
+    scheduler = HostScheduler(max_workers=2, backoff=5, max_attempts=3,
+                              clock=clock, sleep=clock.sleep)
+    with LocalServer({'/a.exe': SyntheticFile(10)}) as server:
+        server.fail('/a.exe', 429, times=3)
+        with pytest.raises(cl.RateLimited):
+            run_jobs(server, ['/a.exe'], scheduler)
+    # Paused 5 s, then 10 s, before the third and last 429
+    assert clock() == pytest.approx(15)